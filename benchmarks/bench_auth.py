@@ -0,0 +1,111 @@
+"""
+Benchmarks `Auth` against every store type.
+
+Each store is populated with 1k, 100k and 1M users in a temporary directory, then each workload runs
+single-threaded and multi-threaded, and the throughput and p50/p99 latencies are written as JSON:
+
+    python -m benchmarks.bench_auth --output results.json
+    python -m benchmarks.bench_auth --sizes 1000 --stores SQLITE --threads 1 --output -
+
+Workloads:
+
+- read: `is_authenticated` on random IDs, half of them unknown.
+- write: `authorize_user` and `revoke_access` on random IDs, alternately.
+- mixed: 90% `is_authenticated`, 5% `remaining_time`, 4% `authorize_user` and 1% `revoke_access`.
+- table: `get_authorized_users_table`.
+"""
+
+import argparse
+import random
+import sys
+from typing import Callable, Dict, List
+from teleauth import Auth
+from benchmarks.common import parse_store_types, populate, run_threads, temporary_auth, write_results
+
+
+def read_workload(auth: Auth, users: int, rngs: List[random.Random]) -> Callable[[int, int], None]:
+    def operation(thread: int, i: int):
+        auth.is_authenticated(rngs[thread].randrange(2 * users))
+    return operation
+
+
+def write_workload(auth: Auth, users: int, rngs: List[random.Random]) -> Callable[[int, int], None]:
+    def operation(thread: int, i: int):
+        user_id = 2 * rngs[thread].randrange(users)
+        if i % 2:
+            auth.revoke_access(user_id)
+        else:
+            auth.authorize_user(user_id, 30, 0)
+    return operation
+
+
+def mixed_workload(auth: Auth, users: int, rngs: List[random.Random]) -> Callable[[int, int], None]:
+    def operation(thread: int, i: int):
+        rng = rngs[thread]
+        user_id = rng.randrange(2 * users)
+        dice = rng.random()
+        if dice < 0.90:
+            auth.is_authenticated(user_id)
+        elif dice < 0.95:
+            auth.remaining_time(user_id)
+        elif dice < 0.99:
+            auth.authorize_user(user_id, 30, 0)
+        else:
+            auth.revoke_access(user_id)
+    return operation
+
+
+def table_workload(auth: Auth, users: int, rngs: List[random.Random]) -> Callable[[int, int], None]:
+    def operation(thread: int, i: int):
+        auth.get_authorized_users_table()
+    return operation
+
+
+WORKLOADS: Dict[str, Callable] = {
+    "read": read_workload,
+    "write": write_workload,
+    "mixed": mixed_workload,
+    "table": table_workload,
+}
+
+
+def main(argv: List[str]=None):
+    parser = argparse.ArgumentParser(description="Benchmark teleauth's Auth against every store type.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000],
+                        help="numbers of users to populate the stores with")
+    parser.add_argument("--stores", nargs="+", default=[], help="store types to benchmark (default: all)")
+    parser.add_argument("--workloads", nargs="+", default=list(WORKLOADS), choices=list(WORKLOADS))
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8], help="numbers of concurrent threads")
+    parser.add_argument("--duration", type=float, default=2.0, help="maximum seconds per measurement")
+    parser.add_argument("--max-ops", type=int, default=100000, help="maximum operations per measurement")
+    parser.add_argument("--cache-size", type=int, default=0, help="size of the Auth cache (default: disabled)")
+    parser.add_argument("--bloom-capacity", type=int, default=0, help="capacity of the Bloom filter (default: disabled)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark-results.json", help='output file, or "-" for stdout')
+    args = parser.parse_args(argv)
+
+    results = []
+    for store_type in parse_store_types(args.stores):
+        for users in args.sizes:
+            for workload in args.workloads:
+                for threads in args.threads:
+                    # Every measurement starts from the same freshly populated store
+                    with temporary_auth(store_type, cache_size=args.cache_size, bloom_capacity=args.bloom_capacity) as auth:
+                        populate(auth, users)
+                        rngs = [random.Random(args.seed + thread) for thread in range(threads)]
+                        operation = WORKLOADS[workload](auth, users, rngs)
+                        measurement = run_threads(operation, threads, args.duration, args.max_ops)
+
+                    result = {"store": store_type.value, "users": users, "workload": workload,
+                              "threads": threads, "cache_size": args.cache_size, "bloom_capacity": args.bloom_capacity,
+                              **measurement}
+                    results.append(result)
+                    print(f"{store_type.value:<14} users={users:<8} {workload:<6} threads={threads:<3} "
+                          f"{measurement['ops_per_sec']:>12.1f} ops/s  p50={measurement['p50_us']:.1f}us  "
+                          f"p99={measurement['p99_us']:.1f}us", file=sys.stderr)
+
+    write_results(args.output, "bench_auth", results)
+
+
+if __name__ == "__main__":
+    main()
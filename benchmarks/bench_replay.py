@@ -0,0 +1,250 @@
+"""
+Replays streams of Telegram updates through the same `Auth` calls the handlers of `example.py` make, offline.
+
+Updates are either generated, with user IDs drawn from a distribution, or read from a recording, then dispatched
+to a thread pool that plays the role of the `Updater` workers. The throughput and the p50/p99/p999 latencies of each
+handler are written as JSON, per store type:
+
+    python -m benchmarks.bench_replay --output results.json
+    python -m benchmarks.bench_replay --distribution flood --rate 5000 --workers 4 --stores SQLITE --output -
+    python -m benchmarks.bench_replay --recording updates.ndjson --output -
+
+Distributions:
+
+- zipf: a few users send most of the updates, as in an active group (`--zipf-exponent`, default 1.1).
+- uniform: every authorized user is equally likely.
+- flood: `--unknown-ratio` of the updates (default 95%) come from users that were never authorized.
+
+Recordings are NDJSON files with one update per line, either Telegram `Update` objects (`message.from.id` and
+`message.text`) or `{"user_id": ..., "handler": ...}`. Commands are mapped to the handlers below, other messages to `echo`.
+
+Handlers, as in `example.py`:
+
+- echo: `is_authenticated`.
+- start: `is_authenticated`, then `remaining_time`.
+- auth: `is_admin`, then `authorize_user`.
+- authorized_users: `is_admin`, then `get_authorized_users_table`.
+
+With `--rate`, updates arrive at a fixed rate and latencies include the time spent waiting for a worker;
+otherwise they are dispatched as fast as the workers take them.
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
+from time import perf_counter, perf_counter_ns, sleep
+from typing import Callable, Dict, Iterator, List, Tuple
+from teleauth import Auth
+from benchmarks.common import parse_store_types, percentile, populate, temporary_auth, write_results
+
+# Owner of the benchmarked `Auth`, so the admin handlers go all the way to the store
+OWNER = 0
+
+COMMANDS = {"/start": "start", "/auth": "auth", "/authorized_users": "authorized_users"}
+
+
+def echo(auth: Auth, user_id: int):
+    auth.is_authenticated(user_id)
+
+
+def start(auth: Auth, user_id: int):
+    if auth.is_authenticated(user_id):
+        auth.remaining_time(user_id)
+
+
+def authorize(auth: Auth, user_id: int):
+    if auth.is_admin(OWNER):
+        auth.authorize_user(user_id, 30, 0)
+
+
+def authorized_users(auth: Auth, user_id: int):
+    if auth.is_admin(OWNER):
+        auth.get_authorized_users_table()
+
+
+HANDLERS: Dict[str, Callable[[Auth, int], None]] = {
+    "echo": echo,
+    "start": start,
+    "auth": authorize,
+    "authorized_users": authorized_users,
+}
+
+DEFAULT_MIX = "echo=0.9,start=0.08,auth=0.019,authorized_users=0.001"
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """
+    Parses a handler mix given on the command line, e.g. "echo=0.9,start=0.1".
+    """
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in HANDLERS:
+            raise ValueError(f"Unknown handler: {name}")
+        weights[name] = float(weight)
+    return weights
+
+
+def user_sampler(distribution: str, users: int, rng: random.Random, zipf_exponent: float,
+                 unknown_ratio: float) -> Callable[[], int]:
+    """
+    Returns a function drawing user IDs. Authorized users have the even IDs written by `populate`.
+
+    :param distribution: "zipf", "uniform" or "flood".
+    :param users: The number of authorized users.
+    :param rng: The random number generator to draw from.
+    :param zipf_exponent: The exponent of the Zipf distribution.
+    :param unknown_ratio: The fraction of IDs of unknown users in a flood.
+    """
+    if distribution == "zipf":
+        cumulative = list(accumulate(1 / rank ** zipf_exponent for rank in range(1, users + 1)))
+        total = cumulative[-1]
+        return lambda: 2 * bisect_left(cumulative, rng.random() * total)
+    if distribution == "uniform":
+        return lambda: 2 * rng.randrange(users)
+    if distribution == "flood":
+        # Unknown users have odd IDs, well beyond the authorized ones
+        return lambda: 2 * rng.randrange(2 ** 40) + 1 if rng.random() < unknown_ratio else 2 * rng.randrange(users)
+    raise ValueError(f"Unknown distribution: {distribution}")
+
+
+def synthetic_updates(count: int, sampler: Callable[[], int], mix: Dict[str, float],
+                      rng: random.Random) -> List[Tuple[str, int]]:
+    names = list(mix)
+    handlers = rng.choices(names, weights=[mix[name] for name in names], k=count)
+    return [(handler, sampler()) for handler in handlers]
+
+
+def recorded_updates(path: str) -> Iterator[Tuple[str, int]]:
+    """
+    Reads a recording of updates, as (handler, user_id) tuples.
+    """
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            update = json.loads(line)
+            if "user_id" in update:
+                yield update.get("handler", "echo"), update["user_id"]
+                continue
+            message = update.get("message") or update.get("edited_message")
+            if message is None or "from" not in message:
+                continue
+            command = (message.get("text") or "").split(" ", 1)[0].split("@", 1)[0]
+            yield COMMANDS.get(command, "echo"), message["from"]["id"]
+
+
+def replay(auth: Auth, updates: List[Tuple[str, int]], workers: int, rate: float) -> dict:
+    """
+    Dispatches the updates to a pool of `workers` threads and measures the latency of each one.
+
+    :param auth: The `Auth` instance the handlers call.
+    :param updates: The (handler, user_id) tuples to replay, in order.
+    :param workers: The number of worker threads.
+    :param rate: The number of updates per second, or 0 to dispatch them as fast as the workers take them.
+    :return: The overall and per-handler throughput and latencies.
+    """
+    latencies: Dict[str, List[int]] = {name: [] for name in HANDLERS}
+    lock = threading.Lock()
+    # Bounds the backlog when dispatching as fast as possible, so latencies measure the handlers, not the queue
+    slots = threading.BoundedSemaphore(workers * 2)
+    errors = []
+
+    def run(handler: str, user_id: int, arrival: int):
+        try:
+            HANDLERS[handler](auth, user_id)
+            latency = perf_counter_ns() - arrival
+            with lock:
+                latencies[handler].append(latency)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            if not rate:
+                slots.release()
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="teleauth-replay") as pool:
+        for i, (handler, user_id) in enumerate(updates):
+            if rate:
+                # Open loop: the update arrives at its scheduled time, whether or not a worker is free
+                delay = start + i / rate - perf_counter()
+                if delay > 0:
+                    sleep(delay)
+            else:
+                slots.acquire()
+            pool.submit(run, handler, user_id, perf_counter_ns())
+    elapsed = perf_counter() - start
+    if errors:
+        raise errors[0]
+
+    def summary(measured: List[int]) -> dict:
+        measured = sorted(measured)
+        return {
+            "updates": len(measured),
+            "p50_us": round(percentile(measured, 50) / 1000, 3),
+            "p99_us": round(percentile(measured, 99) / 1000, 3),
+            "p999_us": round(percentile(measured, 99.9) / 1000, 3),
+        }
+
+    overall = summary([latency for measured in latencies.values() for latency in measured])
+    return {
+        **overall,
+        "seconds": round(elapsed, 6),
+        "updates_per_sec": round(overall["updates"] / elapsed, 1) if elapsed else 0.0,
+        "handlers": {name: summary(measured) for name, measured in latencies.items() if measured},
+    }
+
+
+def main(argv: List[str]=None):
+    parser = argparse.ArgumentParser(description="Replay Telegram update streams through teleauth's Auth.")
+    parser.add_argument("--stores", nargs="+", default=[], help="store types to benchmark (default: all)")
+    parser.add_argument("--users", type=int, default=100000, help="number of authorized users in the store")
+    parser.add_argument("--updates", type=int, default=100000, help="number of synthetic updates")
+    parser.add_argument("--distribution", default="zipf", choices=["zipf", "uniform", "flood"])
+    parser.add_argument("--zipf-exponent", type=float, default=1.1)
+    parser.add_argument("--unknown-ratio", type=float, default=0.95, help="share of unknown users in a flood")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"handler weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--recording", help="NDJSON file of updates to replay instead of synthetic ones")
+    parser.add_argument("--workers", type=int, default=4, help="worker threads, like Updater(workers=...)")
+    parser.add_argument("--rate", type=float, default=0, help="updates per second (default: as fast as possible)")
+    parser.add_argument("--cache-size", type=int, default=0, help="size of the Auth cache (default: disabled)")
+    parser.add_argument("--bloom-capacity", type=int, default=0, help="capacity of the Bloom filter (default: disabled)")
+    parser.add_argument("--admission-rate", type=float, default=0, help="per-user lookups per second (default: no limit)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark-results.json", help='output file, or "-" for stdout')
+    args = parser.parse_args(argv)
+
+    if args.recording:
+        updates = list(recorded_updates(args.recording))
+        source = args.recording
+    else:
+        rng = random.Random(args.seed)
+        sampler = user_sampler(args.distribution, args.users, rng, args.zipf_exponent, args.unknown_ratio)
+        updates = synthetic_updates(args.updates, sampler, parse_mix(args.mix), rng)
+        source = args.distribution
+
+    results = []
+    for store_type in parse_store_types(args.stores):
+        with temporary_auth(store_type, cache_size=args.cache_size, bloom_capacity=args.bloom_capacity,
+                            admission_rate=args.admission_rate) as auth:
+            populate(auth, args.users)
+            measurement = replay(auth, updates, args.workers, args.rate)
+
+        result = {"store": store_type.value, "users": args.users, "source": source, "workers": args.workers,
+                  "rate": args.rate, "cache_size": args.cache_size, "bloom_capacity": args.bloom_capacity,
+                  "admission_rate": args.admission_rate, **measurement}
+        results.append(result)
+        print(f"{store_type.value:<14} {source:<8} workers={args.workers:<3} "
+              f"{measurement['updates_per_sec']:>10.1f} updates/s  p50={measurement['p50_us']:.1f}us  "
+              f"p99={measurement['p99_us']:.1f}us  p999={measurement['p999_us']:.1f}us", file=sys.stderr)
+
+    write_results(args.output, "bench_replay", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmarks the cold start of a bot: importing teleauth, constructing `Auth` and answering the first update.
+
+Each store type is populated in a temporary directory, then every measurement runs in a fresh interpreter,
+with and without `lazy_open`, and the median of the runs is written as JSON:
+
+    python -m benchmarks.bench_startup --output results.json
+    python -m benchmarks.bench_startup --sizes 1000 --stores SQLITE JSON --runs 3 --output -
+
+Measurements, in milliseconds:
+
+- import: `import teleauth`.
+- construct: `Auth(...)`.
+- first_call: the first `is_authenticated`, which opens the store when `lazy_open` is set.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from statistics import median
+from typing import List
+from teleauth import StoreType
+from benchmarks.common import STORE_OPTIONS, parse_store_types, populate, temporary_auth, write_results
+
+# Run in a fresh interpreter, so nothing is imported or cached yet
+STARTUP_SCRIPT = """
+import json, sys
+from time import perf_counter
+start = perf_counter()
+import teleauth
+imported = perf_counter()
+auth = teleauth.Auth(0, [], teleauth.StoreType[sys.argv[1]], store_options=json.loads(sys.argv[2]),
+                     lazy_open=sys.argv[3] == "1")
+constructed = perf_counter()
+auth.is_authenticated(1)
+called = perf_counter()
+auth.close()
+print(json.dumps({"import": imported - start, "construct": constructed - imported, "first_call": called - constructed}))
+"""
+
+
+def measure_startup(store_type: StoreType, store_options: dict, lazy_open: bool) -> dict:
+    """
+    Starts a new interpreter that imports teleauth, opens the store and looks up a user.
+
+    :return: A dict with the duration of each step, in seconds.
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT, store_type.name, json.dumps(store_options), "1" if lazy_open else "0"],
+        check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main(argv: List[str]=None):
+    parser = argparse.ArgumentParser(description="Benchmark the import time and first-call latency of teleauth.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[0, 100000],
+                        help="numbers of users to populate the stores with")
+    parser.add_argument("--stores", nargs="+", default=[], help="store types to benchmark (default: all)")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters started per measurement")
+    parser.add_argument("--output", default="benchmark-results.json", help='output file, or "-" for stdout')
+    args = parser.parse_args(argv)
+
+    results = []
+    for store_type in parse_store_types(args.stores):
+        for users in args.sizes:
+            with temporary_auth(store_type) as auth:
+                populate(auth, users)
+                auth.flush()
+                store_options = dict(STORE_OPTIONS.get(store_type, {}), filename=auth.store.filename)
+                # The shared memory segment is owned by the populating process, the workers attach to it
+                if store_type == StoreType.SHARED_MEMORY:
+                    store_options["owner"] = False
+
+                for lazy_open in (False, True):
+                    runs = [measure_startup(store_type, store_options, lazy_open) for _ in range(args.runs)]
+                    measurement = {step: round(median(run[step] for run in runs) * 1000, 3)
+                                   for step in ("import", "construct", "first_call")}
+
+                    result = {"store": store_type.value, "users": users, "lazy_open": lazy_open, "runs": args.runs,
+                              **{f"{step}_ms": value for step, value in measurement.items()}}
+                    results.append(result)
+                    print(f"{store_type.value:<14} users={users:<8} lazy_open={lazy_open!s:<5} "
+                          f"import={measurement['import']:.1f}ms  construct={measurement['construct']:.1f}ms  "
+                          f"first_call={measurement['first_call']:.1f}ms", file=sys.stderr)
+
+    write_results(args.output, "bench_startup", results)
+
+
+if __name__ == "__main__":
+    main()
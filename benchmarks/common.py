@@ -0,0 +1,167 @@
+"""
+Helpers shared by the benchmark scripts: temporary stores, population, timing and result files.
+"""
+
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from datetime import datetime
+from time import perf_counter, perf_counter_ns, time
+from typing import Callable, Dict, Iterator, List
+from teleauth import Auth, StoreType
+
+# Extra store_options needed to run a store type in a benchmark, on top of the temporary filename
+STORE_OPTIONS: Dict[StoreType, dict] = {
+    StoreType.SHARED_MEMORY: {"name": "teleauth-bench", "capacity": 2000000},
+}
+
+
+def parse_store_types(names: List[str]) -> List[StoreType]:
+    """
+    Converts store type names given on the command line, defaulting to every registered store type.
+
+    :param names: The names of the store types, e.g. ["SQLITE", "JSON"].
+    :return: The store types.
+    """
+    if not names:
+        return list(StoreType)
+    return [StoreType[name.upper()] for name in names]
+
+
+@contextmanager
+def temporary_auth(store_type: StoreType, **auth_options) -> Iterator[Auth]:
+    """
+    Creates an `Auth` whose store lives in a temporary directory, removed on exit.
+
+    :param store_type: The store type to use.
+    :param auth_options: Extra keyword arguments for `Auth`.
+    :return: A context manager that yields the `Auth` instance.
+    """
+    with tempfile.TemporaryDirectory(prefix="teleauth-bench-") as directory:
+        store_options = dict(STORE_OPTIONS.get(store_type, {}), filename=os.path.join(directory, "teleauth"))
+        auth = Auth(0, [], store_type, store_options=store_options, **auth_options)
+        try:
+            yield auth
+        finally:
+            auth.close()
+            if store_type == StoreType.SHARED_MEMORY:
+                # The segment outlives the store on purpose
+                shared_memory.SharedMemory(store_options["name"]).unlink()
+
+
+def populate(auth: Auth, users: int, expired_ratio: float=0.1):
+    """
+    Fills the store with `users` users, whose IDs are the even numbers from 0 to 2 * users,
+    so odd IDs can be used for lookups of unknown users.
+
+    :param auth: The `Auth` instance to fill.
+    :param users: The number of users.
+    :param expired_ratio: The fraction of users whose access already expired.
+    """
+    now = int(time())
+    expired = int(users * expired_ratio)
+    # A single batch: one transaction in SQLite, one file write in JSON
+    auth.store.upsert_users_many(
+        (2 * i, now - 3600 if i < expired else now + (1 + i % 30) * 86400) for i in range(users))
+
+
+def percentile(sorted_values: List[int], q: float) -> int:
+    """
+    Returns the q-th percentile of already sorted values, using the nearest-rank method.
+
+    :param sorted_values: The values, in ascending order.
+    :param q: The percentile, between 0 and 100.
+    """
+    if not sorted_values:
+        return 0
+    rank = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def run_threads(operation: Callable[[int, int], None], threads: int, duration: float, max_ops: int) -> dict:
+    """
+    Calls `operation(thread_index, i)` from `threads` threads until `duration` seconds pass or `max_ops` calls are
+    made in total, and measures the latency of each call.
+
+    :param operation: The operation to benchmark.
+    :param threads: The number of threads.
+    :param duration: The maximum duration of the run, in seconds.
+    :param max_ops: The maximum number of operations, across all threads.
+    :return: A dict with the number of operations, the throughput and the p50/p99 latencies in microseconds.
+    """
+    latencies = [[] for _ in range(threads)]
+    ops_per_thread = max(1, max_ops // threads)
+    barrier = threading.Barrier(threads + 1)
+    errors = []
+
+    def worker(index: int):
+        measured = latencies[index]
+        barrier.wait()
+        deadline = perf_counter() + duration
+        try:
+            for i in range(ops_per_thread):
+                start = perf_counter_ns()
+                operation(index, i)
+                measured.append(perf_counter_ns() - start)
+                if perf_counter() > deadline:
+                    break
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = perf_counter() - start
+    if errors:
+        raise errors[0]
+
+    merged = sorted(latency for measured in latencies for latency in measured)
+    return {
+        "ops": len(merged),
+        "seconds": round(elapsed, 6),
+        "ops_per_sec": round(len(merged) / elapsed, 1) if elapsed else 0.0,
+        "p50_us": round(percentile(merged, 50) / 1000, 3),
+        "p99_us": round(percentile(merged, 99) / 1000, 3),
+    }
+
+
+def environment() -> dict:
+    """
+    Describes the machine and interpreter the benchmark ran on, so results from different releases can be compared.
+    """
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "sqlite": sqlite3.sqlite_version,
+    }
+
+
+def write_results(path: str, benchmark: str, results: List[dict]):
+    """
+    Writes the results as a JSON document.
+
+    :param path: The output file, or "-" for the standard output.
+    :param benchmark: The name of the benchmark.
+    :param results: One dict per measurement.
+    """
+    document = {"benchmark": benchmark, "environment": environment(), "results": results}
+    if path == "-":
+        json.dump(document, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(path, "w") as f:
+            json.dump(document, f, indent=2)
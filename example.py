@@ -9,15 +9,14 @@ import logging
 def start(update: Update, context: CallbackContext):
     update.message.reply_text("Hi! I'm a simple Telegram bot that demonstrates user authentication.Type /auth to authorize a user, /unauth to revoke access, or /authorized_users to see a list of authorized users.")
     
-    user_id = update.effective_user.id
+    # A single store lookup for the authentication and the remaining time
+    status = auth.get_status(update.effective_user.id)
     
-    if not auth.is_authenticated(user_id):
+    if not status.authenticated:
         update.message.reply_text("You are not authenticated.")
         return
 
-    remaining = auth.remaining_time(user_id)
-
-    days, hours, minutes = remaining
+    days, hours, minutes = status.remaining
     text = (
         "You are authenticated!\n"
         f"{days} days, {hours} hours, and {minutes} minutes remaining"
@@ -103,8 +102,9 @@ def authorized_users(update: Update, context: CallbackContext):
         update.message.reply_text("You are not authorized to use this command.")
         return
 
-    table = auth.get_authorized_users_table()
-    update.message.reply_text(f"Authorized users:\n<pre>{table}</pre>", parse_mode=ParseMode.HTML)
+    # The table is split so that each message fits in Telegram's length limit
+    for table in auth.get_authorized_users_tables():
+        update.message.reply_text(f"Authorized users:\n<pre>{table}</pre>", parse_mode=ParseMode.HTML)
 
 def authorized_admins(update: Update, context: CallbackContext):
     user_id = update.message.from_user.id
@@ -4,7 +4,7 @@ setup(
     name='teleauth',
     version='1.1.1',
     description='A library for user authentication in Telegram bots',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*', 'tests', 'tests.*']),
     install_requires=['prettytable'],
     author='nilopro',
     author_email='menezesdev@pm.me',
@@ -50,8 +50,11 @@ updater.idle()
 """
 
 
-from .auth import Auth
-from .store import IStore, StoreType
+from importlib import import_module
+
+from .auth import AccessLevel, Auth, AuthStatus
+from .cache import CachedStore
+from .store import IStore, STORE_MODULES, StoreType
 
 from .auth import *
 from .store import *
@@ -59,6 +62,33 @@ from .store import *
 __all__ = [
     # Expose classes and functions from auth module
     'Auth',
+    'AccessLevel',
+    'AuthStatus',
     # Expose classes and functions from store module
     'StoreType',
-]
\ No newline at end of file
+    'ALL_SCOPES',
+    # Expose classes and functions from async modules
+    'AsyncAuth',
+    'AsyncStore',
+    # Expose classes and functions from cache module
+    'CachedStore',
+]
+
+def __getattr__(name: str):
+    # The async classes pull in asyncio, so they are only imported when used
+    if name == 'AsyncAuth':
+        from .async_auth import AsyncAuth
+        return AsyncAuth
+    if name == 'AsyncStore':
+        from .async_store import AsyncStore
+        return AsyncStore
+    # The store classes and modules that `from .store import *` exported when they all lived in store.py
+    if name == 'timedelta':
+        from datetime import timedelta
+        return timedelta
+    if name in ('json', 'sqlite3'):
+        return import_module(name)
+    for module, class_name in STORE_MODULES.values():
+        if class_name == name:
+            return getattr(import_module(module), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
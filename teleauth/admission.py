@@ -0,0 +1,69 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+class AdmissionController:
+    """
+    Limits how often each user can be looked up, with a token bucket per user ID, so a flood from a single user
+    is turned away before it reaches the cache or the store.
+
+    Each user may make `burst` calls at once, then `rate` calls per second. Buckets are kept in an LRU table of at
+    most `max_users` entries, so memory is capped and each check is constant time. A user whose bucket was evicted
+    (or has been idle long enough to refill it) starts again with a full bucket, so evictions only ever let calls in.
+    """
+
+    def __init__(self, rate: float, burst: float=10, max_users: int=65536):
+        """
+        Initializes a new instance of the AdmissionController class.
+
+        :param rate: The number of calls per second each user is allowed, on average.
+        :param burst: The number of calls a user can make at once. Default: 10
+        :param max_users: The maximum number of users tracked at a time. Default: 65536
+        """
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"Invalid rate or burst: {rate}, {burst}")
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.admitted = 0
+        self.rejected = 0
+        # user_id -> [tokens, time of the last refill], least recently seen first
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def admit(self, user_id: int) -> bool:
+        """
+        Takes a token from the user's bucket.
+
+        :param user_id: The user's ID
+        :return: True if the call is allowed, False if it must be rejected.
+        """
+        now = monotonic()
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = [self.burst, now]
+                if len(self._buckets) > self.max_users:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(user_id)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                self.admitted += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def info(self) -> dict:
+        """
+        Returns the number of admitted and rejected calls, the share of calls that were shed and the number of
+        users currently tracked.
+        """
+        with self._lock:
+            calls = self.admitted + self.rejected
+            return {"admitted": self.admitted, "rejected": self.rejected,
+                    "shed_ratio": self.rejected / calls if calls else 0.0, "users": len(self._buckets)}
@@ -0,0 +1,398 @@
+import asyncio
+from datetime import datetime
+from time import time
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+from teleauth.async_store import AsyncStore
+from teleauth.auth import (DENIED_MESSAGE, MESSAGE_MAX_LENGTH, AccessLevel, Auth, AuthStatus, _check_scopes,
+                           _remaining_time, _require, _status, _to_datetimes, _to_timestamp)
+from teleauth.cache import CacheInfo
+from teleauth.expiry import ExpiryScheduler
+from teleauth.store import ALL_SCOPES, Cursor, StoreType, _active_scopes
+from teleauth.tables import _admins_table, _users_rows, _users_table, _users_tables
+
+
+class AsyncAuth:
+    """
+    Asyncio version of `Auth`, for bot frameworks whose handlers run on an event loop (e.g. python-telegram-bot v20+).
+
+    Every method mirrors the one in `Auth`, but the store is accessed through an `AsyncStore`, so blocking I/O runs
+    in a dedicated executor. With `cache_size` set, `is_authenticated` is answered on the loop for cached users,
+    and with `bloom_capacity` set, for users that were never authorized.
+
+    :param owner: The user ID of the bot owner.
+    :param authorized_admin_ids: A list of user IDs of authorized admins.
+    :param store_type: The store type to use (`SQLITE`, `SQLITE_SHARDED`, `JSON`, `JSON_JOURNAL`, `MMAP` or `SHARED_MEMORY`). Defaults to `SQLITE`.
+    :param cache_size: The maximum number of users kept in an in-process authentication cache in front of the store.
+                       Defaults to 0 (no cache).
+    :param cache_coherence_interval: The maximum time, in seconds, before the cache sees writes made by other processes.
+                                     Defaults to 0 (only this process's writes are seen).
+    :param store_options: Extra keyword arguments for the store class, such as `filename`.
+    :param bloom_capacity: The number of users a Bloom filter of every authorized user ID is sized for.
+                           Defaults to 0 (no filter).
+    :param bloom_error_rate: The false-positive rate of the Bloom filter at capacity. Defaults to 0.01.
+    :param bloom_max_bytes: The maximum size of the Bloom filter, in bytes. Defaults to no limit.
+    :param stats: Whether to record call counts, latency histograms and store counters, read with `stats()`.
+    :param stats_exporter: A function called with a `stats()` snapshot every `stats_export_interval` seconds.
+    :param stats_export_interval: The number of seconds between two exports. Defaults to 60.
+    :param admission_rate: The number of lookups per second each user is allowed. Defaults to 0 (no limit).
+    :param admission_burst: The number of lookups a user can make at once. Defaults to 10.
+    :param admission_max_users: The maximum number of users whose rate is tracked at a time. Defaults to 65536.
+    :param lazy_open: Whether to defer opening the store until it is first used. Defaults to False.
+    :param table_cache: Whether to cache the rendered users and admins tables. Defaults to False.
+    """
+    def __init__(self, owner: int, authorized_admin_ids: List[int], store_type: StoreType=StoreType.SQLITE,
+                 cache_size: int=0, store_options: Optional[dict]=None, bloom_capacity: int=0,
+                 bloom_error_rate: float=0.01, bloom_max_bytes: Optional[int]=None, stats: bool=False,
+                 stats_exporter: Optional[Callable[[dict], None]]=None, stats_export_interval: float=60.0,
+                 lazy_open: bool=False, cache_coherence_interval: float=0, admission_rate: float=0,
+                 admission_burst: float=10, admission_max_users: int=65536, table_cache: bool=False):
+        self.auth = Auth(owner, authorized_admin_ids, store_type, cache_size=cache_size, store_options=store_options,
+                         bloom_capacity=bloom_capacity, bloom_error_rate=bloom_error_rate,
+                         bloom_max_bytes=bloom_max_bytes, stats=stats, stats_exporter=stats_exporter,
+                         stats_export_interval=stats_export_interval, lazy_open=lazy_open,
+                         cache_coherence_interval=cache_coherence_interval, admission_rate=admission_rate,
+                         admission_burst=admission_burst, admission_max_users=admission_max_users,
+                         table_cache=table_cache)
+        self.owner = owner
+        self.store = AsyncStore(self.auth.store)
+
+    async def close(self):
+        """
+        Closes the connection to the store (if applicable).
+        """
+        if self.auth.expiry_scheduler is not None:
+            self.auth.expiry_scheduler.stop()
+        await self.store.close()
+
+    async def flush(self):
+        """
+        Makes every grant and revocation made so far durable.
+        """
+        await self.store.flush()
+
+    def start_expiry_scheduler(self, batch_size: int=500) -> ExpiryScheduler:
+        """
+        Starts a background thread that removes users from the store as soon as their access expires.
+
+        :param batch_size: The maximum number of users removed per delete. Default: 500
+        :return: The running scheduler.
+        """
+        return self.auth.start_expiry_scheduler(batch_size)
+
+    def on_expire(self, callback: Callable[[int], None]) -> Callable[[int], None]:
+        """
+        Registers a function to be called with the ID of each user whose access expired, e.g. to notify them.
+        Starts the expiry scheduler if it is not running. Can be used as a decorator.
+        Coroutine functions are scheduled on the event loop this method is called from.
+
+        :param callback: The function or coroutine function to call.
+        :return: The callback, unchanged.
+        """
+        if asyncio.iscoroutinefunction(callback):
+            loop = asyncio.get_running_loop()
+            self.auth.on_expire(lambda user_id: asyncio.run_coroutine_threadsafe(callback(user_id), loop))
+        else:
+            self.auth.on_expire(callback)
+        return callback
+
+    def cache_info(self) -> Optional[CacheInfo]:
+        """
+        Returns the hit/miss statistics of the authentication cache.
+
+        :return: A `CacheInfo` tuple, or None if the cache is disabled.
+        """
+        return self.auth.cache_info()
+
+    def stats(self) -> Optional[dict]:
+        """
+        Returns a snapshot of the instrumentation data. The store methods are recorded; see `Auth.stats`.
+
+        :return: None if instrumentation is disabled, the snapshot otherwise.
+        """
+        return self.auth.stats()
+
+    def is_admin(self, user_id: int) -> bool:
+        """
+        Determines if the specified user is an authorized admin. Admins are kept in memory, so this is not a coroutine.
+
+        :param user_id: The user ID to check.
+        :return: True if the user is an authorized admin, False otherwise.
+        """
+        return self.is_owner(user_id) or self.store.is_admin(user_id)
+
+    def is_owner(self, user_id) -> bool:
+        return self.owner == user_id
+
+    async def authorize_admin(self, user_id):
+        """
+        Authorize a user as an administrator.
+
+        param user_id: The user id to authorize
+        """
+        await self.store.authorize_admin(user_id)
+
+    async def revoke_admin(self, user_id):
+        """
+        Revokes administrator access from a user.
+
+        param user_id: The ID of the user to revoke access from.
+        """
+        await self.store.revoke_admin(user_id)
+
+    async def is_authenticated(self, user_id: int) -> bool:
+        """
+        Determines if the specified user is authenticated (either an authorized admin or an authorized user with an unexpired access).
+
+        :param user_id: The user ID to check.
+        :return: True if the user is authenticated, False otherwise.
+        """
+        if self.auth.admission is not None and not self.auth._admit(user_id):
+            return False
+        return await self.store.is_authenticated(user_id)
+
+    async def authorize_user(self, user_id: int, days: int, hours: int):
+        """
+        Grants access to the specified user for the specified number of days and hours.
+
+        :param user_id: The user ID to authorize.
+        :param days: The number of days of access to grant.
+        :param hours: The number of hours of access to grant.
+        """
+        await self.store.authorize_user(user_id, days, hours)
+        self.auth._schedule_expiry(days, hours)
+
+    async def revoke_access(self, user_id: int):
+        """
+        Revokes access to the specified user.
+
+        :param user_id: The user ID to revoke access to.
+        """
+        await self.store.revoke_access(user_id)
+
+    async def is_authenticated_many(self, user_ids: Iterable[int]) -> Dict[int, bool]:
+        """
+        Determines which of the specified users are authenticated, using a single batched lookup when the store supports it.
+
+        :param user_ids: The user IDs to check.
+        :return: A dict mapping each user ID to True if the user is authenticated, False otherwise.
+        """
+        return await self.store.is_authenticated_many(user_ids)
+
+    async def authorize_users_many(self, user_ids: Iterable[int], days: int, hours: int):
+        """
+        Grants access to all the specified users for the specified number of days and hours, in a single batch.
+
+        :param user_ids: The user IDs to authorize.
+        :param days: The number of days of access to grant.
+        :param hours: The number of hours of access to grant.
+        """
+        await self.store.authorize_users_many(user_ids, days, hours)
+        self.auth._schedule_expiry(days, hours)
+
+    async def revoke_many(self, user_ids: Iterable[int]):
+        """
+        Revokes access to all the specified users, in a single batch.
+
+        :param user_ids: The user IDs to revoke access to.
+        """
+        await self.store.revoke_many(user_ids)
+
+    async def grant_scopes(self, user_id: int, scopes: int, days: int=0, hours: int=0):
+        """
+        Grants scopes to the specified user, for the specified number of days and hours, or for good if both are 0.
+
+        :param user_id: The user ID to grant the scopes to.
+        :param scopes: The bitmask of the scopes to grant, e.g. an `enum.IntFlag`.
+        :param days: The number of days the scopes are granted for. Default: 0
+        :param hours: The number of hours the scopes are granted for. Default: 0
+        """
+        expires = int(time()) + days * 86400 + hours * 3600 if days or hours else None
+        await self.store.grant_scopes(user_id, _check_scopes(scopes), expires)
+
+    async def revoke_scopes(self, user_id: int, scopes: int=ALL_SCOPES):
+        """
+        Revokes scopes from the specified user.
+
+        :param user_id: The user ID to revoke the scopes from.
+        :param scopes: The bitmask of the scopes to revoke. Default: every scope
+        """
+        await self.store.revoke_scopes(user_id, _check_scopes(scopes))
+
+    async def get_scopes(self, user_id: int) -> int:
+        """
+        Returns the scopes the specified user currently holds. Admins (including the owner) hold every scope.
+
+        :param user_id: The user's ID
+        :return: The bitmask of the unexpired scopes, 0 if the user has none.
+        """
+        if self.is_admin(user_id):
+            return ALL_SCOPES
+        return _active_scopes(await self.store.get_scopes(user_id), time())
+
+    async def has_scopes(self, user_id: int, scopes: int) -> bool:
+        """
+        Determines whether the specified user holds all the specified scopes, with a single store lookup.
+
+        :param user_id: The user ID to check.
+        :param scopes: The bitmask of the required scopes, e.g. `Scope.PREMIUM | Scope.MODERATOR`.
+        :return: True if none of the scopes is missing or expired, False otherwise.
+        """
+        scopes = _check_scopes(scopes)
+        if self.is_admin(user_id):
+            return True
+        if self.auth.admission is not None and not self.auth.admission.admit(user_id):
+            return False
+        return _active_scopes(await self.store.get_scopes(user_id), time()) & scopes == scopes
+
+    async def get_authorized_users_table(self, field_names:List[str]=["USER ID", "EXPIRES"], datetime_format:str="%d/%m/%Y %H:%M") -> str:
+        """
+        Returns a prettytable string with all authorized users and their expiration dates.
+        Expired users will be highlighted with a warning symbol.
+
+        :param field_names: The field names to be displayed in the table. Default: ["USER ID", "EXPIRES"]
+        :param datetime_format: The format for the expiration date. Default: "%d/%m/%Y %H:%M"
+        :return: The table as a string
+        """
+        table_cache = self.auth.table_cache
+        if table_cache is not None:
+            return await self.store._run(table_cache.users_table, field_names, datetime_format)
+        users = await self.store.get_authorized_users()
+        return _users_table(users, field_names, datetime_format)
+
+    async def get_authorized_users_tables(self, field_names:List[str]=["USER ID", "EXPIRES"], datetime_format:str="%d/%m/%Y %H:%M",
+                                          max_length:int=MESSAGE_MAX_LENGTH - 96) -> List[str]:
+        """
+        Same as `get_authorized_users_table`, but splits the table into chunks that fit in a Telegram message.
+
+        :param field_names: The field names to be displayed in the tables. Default: ["USER ID", "EXPIRES"]
+        :param datetime_format: The format for the expiration date. Default: "%d/%m/%Y %H:%M"
+        :param max_length: The maximum length of each table. Default: 4000, leaving room for a short caption
+        :return: The tables as strings
+        """
+        def render():
+            if self.auth.table_cache is not None:
+                return self.auth.table_cache.users_tables(field_names, datetime_format, max_length)
+            users = self.store.store.iter_authorized_users()
+            return list(_users_tables(_users_rows(users, datetime_format), field_names, max_length))
+        return await self.store._run(render)
+
+    async def iter_authorized_users(self, batch_size: int=1000) -> AsyncIterator[Tuple[int, datetime]]:
+        """
+        Iterates over all authorized users, ordered by expiration date, loading `batch_size` users at a time.
+
+        :param batch_size: The number of users loaded from the store at a time. Default: 1000
+        :return: An async iterator of tuples containing the user IDs and expiration dates.
+        """
+        async for user_id, expires in self.store.iter_authorized_users(batch_size):
+            yield user_id, datetime.fromtimestamp(expires)
+
+    async def get_authorized_users_page(self, after_cursor: Optional[Cursor]=None, limit: int=100) -> Tuple[List[Tuple[int, datetime]], Optional[Cursor]]:
+        """
+        Returns a page of authorized users, ordered by expiration date and then user ID.
+
+        :param after_cursor: The cursor returned with the previous page, or None to get the first page.
+        :param limit: The maximum number of users in the page. Default: 100
+        :return: A tuple containing the users of the page and the cursor of the next page (None if this is the last one).
+        """
+        page, cursor = await self.store.get_authorized_users_page(after_cursor, limit)
+        return _to_datetimes(page), cursor
+
+    async def iter_expiring_between(self, start: Optional[datetime]=None, end: Optional[datetime]=None,
+                                    batch_size: int=1000) -> AsyncIterator[Tuple[int, datetime]]:
+        """
+        Iterates over the users whose access expires in a range, ordered by expiration date.
+
+        :param start: The start of the range, included. Default: no lower bound
+        :param end: The end of the range, excluded. Default: no upper bound
+        :param batch_size: The number of users loaded from the store at a time. Default: 1000
+        :return: An async iterator of tuples containing the user IDs and expiration dates.
+        """
+        async for user_id, expires in self.store.iter_expiring_between(_to_timestamp(start), _to_timestamp(end),
+                                                                        batch_size):
+            yield user_id, datetime.fromtimestamp(expires)
+
+    async def count_active(self) -> int:
+        """
+        Returns the number of users whose access hasn't expired, without loading them.
+        """
+        return await self.store.count_active()
+
+    async def count_expired(self, since: Optional[datetime]=None) -> int:
+        """
+        Returns the number of users whose access expired and who weren't purged yet, without loading them.
+
+        :param since: Only count the users whose access expired at or after this date. Default: all of them
+        """
+        return await self.store.count_expired(_to_timestamp(since))
+
+    def get_authorized_admins_table(self, field_names:List[str]=["USER ID"]) -> str:
+        """
+        Returns a prettytable string with all authorized admins. Admins are kept in memory, so this is not a coroutine.
+
+        :param field_names: The field names to be displayed in the table. Default: ["USER ID"]
+        :return: The table as a string
+        """
+        if self.auth.table_cache is not None:
+            return self.auth.table_cache.admins_table(field_names)
+        admins = self.store.authorized_admin_ids
+        return _admins_table(admins, field_names)
+
+    async def remaining_time(self, user_id: int) -> Tuple[int, int, int]:
+        """
+        Returns the number of days, hours, and minutes remaining for the specified user.
+
+        :param user_id: The user's ID
+        :return: A tuple containing the number of days, hours, and minutes remaining.
+                 If the user is not authorized or has expired, all values will be 0.
+        """
+        user = await self.store.get_authorized_user(user_id)
+        return _remaining_time(user)
+
+    async def get_status(self, user_id: int) -> AuthStatus:
+        """
+        Returns whether the specified user is the owner, an admin and authenticated, and when their access expires,
+        with a single store lookup. Admins (including the owner) are always authenticated.
+
+        :param user_id: The user's ID
+        :return: An `AuthStatus` tuple.
+        """
+        if self.auth.admission is not None and not self.auth._admit(user_id):
+            return AuthStatus(user_id, False, False, False, None, (0, 0, 0), throttled=True)
+        user = await self.store.get_authorized_user(user_id)
+        return _status(user_id, self.is_owner(user_id), self.is_admin(user_id), user)
+
+    def require(self, level: AccessLevel=AccessLevel.USER, denied_message: Optional[str]=DENIED_MESSAGE) -> Callable:
+        """
+        Decorator for python-telegram-bot v20+ handlers that only runs them for users with the specified access level.
+        The status of the user is resolved once per update and stored as `context.auth_status`.
+        Updates without a user (e.g. channel posts) are ignored.
+
+        :param level: The access level required to run the handler. Default: `AccessLevel.USER`
+        :param denied_message: The reply sent to users without that level, or None to ignore them silently.
+        :return: The decorator.
+        """
+        return _require(self.get_status, level, denied_message)
+
+    async def _insert_user(self, user_id: int, expires: datetime):
+        """
+        Inserts a new user in the store.
+
+        :param user_id: The user's ID
+        :param expires: The new expiration date for the user
+        """
+        expires = int(expires.timestamp())
+        await self.store.insert_user(user_id, expires)
+        if self.auth.expiry_scheduler is not None:
+            self.auth.expiry_scheduler.schedule(expires)
+
+    async def _update_user(self, user_id: int, expires: datetime):
+        """
+        Updates the expiration date for the specified user.
+
+        :param user_id: The user's ID
+        :param expires: The new expiration date for the user
+        """
+        expires = int(expires.timestamp())
+        await self.store.update_user(user_id, expires)
+        if self.auth.expiry_scheduler is not None:
+            self.auth.expiry_scheduler.schedule(expires)
@@ -0,0 +1,153 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from teleauth.bloom import BloomFilterStore
+from teleauth.cache import CachedStore
+from teleauth.store import Cursor, IStore, Scopes, StoreWrapper
+
+
+class AsyncStore:
+    """
+    Awaitable facade over any store.
+
+    Blocking calls are moved to a dedicated single-thread executor, so they never stall the event loop and
+    are serialized: two writes can't interleave, and the underlying connection or file is only touched by one thread.
+    When the wrapped store is a `CachedStore`, `is_authenticated` is answered on the loop itself for cached users,
+    and when it contains a `BloomFilterStore`, for users that are definitely not in the store.
+    """
+
+    def __init__(self, store: IStore, executor: Optional[ThreadPoolExecutor]=None):
+        """
+        Initializes a new instance of the AsyncStore class.
+
+        :param store: The store to wrap.
+        :param executor: The executor that runs the blocking calls. Defaults to a new single-thread executor,
+                         which is shut down by `close`.
+        """
+        self.store = store
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="teleauth")
+        self._bloom_filter = None
+        wrapped = store
+        while isinstance(wrapped, StoreWrapper):
+            if isinstance(wrapped, BloomFilterStore):
+                self._bloom_filter = wrapped
+                break
+            wrapped = wrapped.store
+
+    @property
+    def authorized_admin_ids(self) -> List[int]:
+        return self.store.authorized_admin_ids
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    async def close(self):
+        """
+        Closes the wrapped store and shuts down the executor if it was created by this instance.
+        """
+        await self._run(self.store.close)
+        if self._own_executor:
+            self._executor.shutdown(wait=False)
+
+    async def flush(self):
+        await self._run(self.store.flush)
+
+    def is_admin(self, user_id: int) -> bool:
+        # Admins are kept in memory, no I/O involved
+        return self.store.is_admin(user_id)
+
+    async def authorize_admin(self, user_id):
+        await self._run(self.store.authorize_admin, user_id)
+
+    async def revoke_admin(self, user_id):
+        await self._run(self.store.revoke_admin, user_id)
+
+    async def is_authenticated(self, user_id: int) -> bool:
+        if isinstance(self.store, CachedStore):
+            authenticated = self.store.peek_authenticated(user_id)
+            if authenticated is not None:
+                return authenticated
+        if self._bloom_filter is not None and not self.is_admin(user_id) and not self._bloom_filter.might_contain(user_id):
+            return False
+        return await self._run(self.store.is_authenticated, user_id)
+
+    async def authorize_user(self, user_id: int, days: int, hours: int):
+        await self._run(self.store.authorize_user, user_id, days, hours)
+
+    async def revoke_access(self, user_id: int):
+        await self._run(self.store.revoke_access, user_id)
+
+    async def get_authorized_user(self, user_id: int) -> Tuple[int, int]:
+        return await self._run(self.store.get_authorized_user, user_id)
+
+    async def get_authorized_users(self) -> List[Tuple[int, int]]:
+        return await self._run(self.store.get_authorized_users)
+
+    async def insert_user(self, user_id: int, expires: int):
+        await self._run(self.store.insert_user, user_id, expires)
+
+    async def update_user(self, user_id: int, expires: int):
+        await self._run(self.store.update_user, user_id, expires)
+
+    async def is_authenticated_many(self, user_ids: Iterable[int]) -> Dict[int, bool]:
+        return await self._run(self.store.is_authenticated_many, list(user_ids))
+
+    async def authorize_users_many(self, user_ids: Iterable[int], days: int, hours: int):
+        await self._run(self.store.authorize_users_many, list(user_ids), days, hours)
+
+    async def revoke_many(self, user_ids: Iterable[int]):
+        await self._run(self.store.revoke_many, list(user_ids))
+
+    async def upsert_users_many(self, users: Iterable[Tuple[int, int]]):
+        await self._run(self.store.upsert_users_many, list(users))
+
+    async def get_authorized_users_page(self, after_cursor: Optional[Cursor]=None, limit: int=100) -> Tuple[List[Tuple[int, int]], Optional[Cursor]]:
+        return await self._run(self.store.get_authorized_users_page, after_cursor, limit)
+
+    async def iter_authorized_users(self, batch_size: int=1000) -> AsyncIterator[Tuple[int, int]]:
+        cursor = None
+        while True:
+            page, cursor = await self.get_authorized_users_page(cursor, batch_size)
+            for user in page:
+                yield user
+            if cursor is None:
+                return
+
+    async def next_expiry(self) -> Optional[int]:
+        return await self._run(self.store.next_expiry)
+
+    async def purge_expired(self, before: int, limit: int) -> List[int]:
+        return await self._run(self.store.purge_expired, before, limit)
+
+    async def iter_expiring_between(self, start: Optional[int]=None, end: Optional[int]=None,
+                                    batch_size: int=1000) -> AsyncIterator[Tuple[int, int]]:
+        users = await self._run(self.store.iter_expiring_between, start, end, batch_size)
+        while True:
+            # One batch per executor call, so the event loop never waits on the store
+            batch = await self._run(list, islice(users, batch_size))
+            for user in batch:
+                yield user
+            if len(batch) < batch_size:
+                return
+
+    async def count_expiring_between(self, start: Optional[int]=None, end: Optional[int]=None) -> int:
+        return await self._run(self.store.count_expiring_between, start, end)
+
+    async def count_active(self) -> int:
+        return await self._run(self.store.count_active)
+
+    async def count_expired(self, since: Optional[int]=None) -> int:
+        return await self._run(self.store.count_expired, since)
+
+    async def get_scopes(self, user_id: int) -> Optional[Scopes]:
+        return await self._run(self.store.get_scopes, user_id)
+
+    async def grant_scopes(self, user_id: int, scopes: int, expires: Optional[int]):
+        await self._run(self.store.grant_scopes, user_id, scopes, expires)
+
+    async def revoke_scopes(self, user_id: int, scopes: int):
+        await self._run(self.store.revoke_scopes, user_id, scopes)
@@ -1,40 +1,353 @@
-from typing import List, Tuple
-from prettytable import PrettyTable
-from teleauth.store import IStore, StoreType, STORE_CLASSES
+from enum import Enum
+from math import ceil
+from functools import partial, wraps
+from time import time
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from teleauth.admission import AdmissionController
+from teleauth.bloom import BloomFilterStore
+from teleauth.cache import CachedStore, CacheInfo
+from teleauth.expiry import ExpiryScheduler
+from teleauth.stats import InstrumentedStore, Stats
+from teleauth.store import ALL_SCOPES, Cursor, IStore, LazyStore, StoreType, STORE_CLASSES, _active_scopes
+from teleauth.tables import TableCache, _admins_table, _users_rows, _users_table, _users_tables
 from datetime import datetime
 
-def create_store(store_type: StoreType, authorized_admin_ids: List[int]) -> IStore:
+def create_store(store_type: StoreType, authorized_admin_ids: List[int], **store_options) -> IStore:
     """
     Factory method that creates a store instance based on the specified store type.
     
-    :param store_type: The store type to use (either `SQLITE` or `JSON`).
+    :param store_type: The store type to use (`SQLITE`, `SQLITE_SHARDED`, `JSON`, `JSON_JOURNAL`, `MMAP` or `SHARED_MEMORY`).
     :param authorized_admin_ids: A list of user IDs of authorized admins.
+    :param store_options: Extra keyword arguments for the store class, such as `filename`.
     :return: An instance of the store.
     """
     store_class = STORE_CLASSES.get(store_type)
     if store_class is None:
         raise ValueError(f"Invalid store type: {store_type}")
-    return store_class(authorized_admin_ids)
+    return store_class(authorized_admin_ids, **store_options)
+
+def _to_datetimes(users: Iterable[Tuple[int, int]]) -> List[Tuple[int, datetime]]:
+    """
+    Converts the expiration timestamps returned by the store to datetimes.
+    
+    :param users: Tuples containing the user IDs and expiration timestamps.
+    :return: Tuples containing the user IDs and expiration dates.
+    """
+    return [(user_id, datetime.fromtimestamp(expires)) for user_id, expires in users]
+
+def _to_timestamp(date: Optional[datetime]) -> Optional[int]:
+    """
+    Converts a bound of a range of expiration dates to the first whole epoch second at or after it.
+    
+    :param date: The date, or None for an open bound.
+    :return: The timestamp, or None.
+    """
+    return None if date is None else ceil(date.timestamp())
+
+# Maximum length of a Telegram message
+MESSAGE_MAX_LENGTH = 4096
+
+def _check_scopes(scopes: int) -> int:
+    """
+    Validates a bitmask of scopes, e.g. an `enum.IntFlag`, and converts it to a plain int.
+    """
+    scopes = int(scopes)
+    if not 0 < scopes <= ALL_SCOPES:
+        raise ValueError(f"Scopes must be a non-empty bitmask of at most 63 bits: {scopes}")
+    return scopes
+
+
+def _remaining_time(user: Optional[Tuple[int, int]]) -> Tuple[int, int, int]:
+    """
+    Splits the time left until the user's access expires into days, hours and minutes.
+    
+    :param user: A tuple containing the user ID and the expiration timestamp, or None if the user is not authorized.
+    :return: A tuple containing the number of days, hours, and minutes remaining.
+             If the user is not authorized or has expired, all values will be 0.
+    """
+    days, hours, minutes = 0, 0, 0
+
+    if user is not None:
+        user_id, expires = user
+        remaining = int(expires - time())
+        if remaining > 0:
+            days, seconds = divmod(remaining, 86400)
+            hours = seconds // 3600
+            minutes = (seconds % 3600) // 60
+
+    return days, hours, minutes
+
+class AccessLevel(Enum):
+    """
+    The access levels a handler can require, from the least to the most privileged.
+    """
+    USER = 'USER'
+    ADMIN = 'ADMIN'
+    OWNER = 'OWNER'
+
+class AuthStatus(NamedTuple):
+    """
+    Everything `Auth` knows about a user, resolved with a single store lookup.
+    """
+    user_id: int
+    owner: bool
+    admin: bool
+    authenticated: bool
+    # None if the user has no access in the store (admins may not either)
+    expires: Optional[datetime]
+    remaining: Tuple[int, int, int]
+    # True if the lookup was rejected by admission control, in which case the user is reported as not authenticated
+    throttled: bool = False
+
+    def has_level(self, level: AccessLevel) -> bool:
+        """
+        Determines whether the user has the specified access level.
+        """
+        if level == AccessLevel.OWNER:
+            return self.owner
+        if level == AccessLevel.ADMIN:
+            return self.admin
+        return self.authenticated
+
+def _status(user_id: int, owner: bool, admin: bool, user: Optional[Tuple[int, int]]) -> AuthStatus:
+    """
+    Builds the status of a user from the admin registry and the result of the store lookup.
+    
+    :param user_id: The user's ID
+    :param owner: Whether the user is the bot owner.
+    :param admin: Whether the user is an admin (or the owner).
+    :param user: A tuple containing the user ID and the expiration timestamp, or None if the user is not in the store.
+    """
+    expires = None if user is None else user[1]
+    authenticated = admin or (expires is not None and expires > time())
+    return AuthStatus(user_id, owner, admin, authenticated,
+                      None if expires is None else datetime.fromtimestamp(expires), _remaining_time(user))
+
+def _require(get_status: Callable, level: AccessLevel, denied_message: Optional[str]) -> Callable:
+    """
+    Builds the handler decorator of `Auth.require` and `AsyncAuth.require`.
+    
+    :param get_status: `get_status` of the `Auth` or `AsyncAuth` instance.
+    :param level: The access level required to run the handler.
+    :param denied_message: The reply sent to users without that level, or None to ignore them silently.
+    """
+    def decorator(handler: Callable) -> Callable:
+        # Imported here, so `import teleauth` doesn't pay for asyncio
+        import asyncio
+
+        if asyncio.iscoroutinefunction(handler):
+            @wraps(handler)
+            async def async_wrapper(update, context, *args, **kwargs):
+                # Updates without a user (channel posts, polls...) can't be authorized
+                if update.effective_user is None:
+                    return None
+                status = get_status(update.effective_user.id)
+                if asyncio.iscoroutine(status):
+                    status = await status
+                context.auth_status = status
+                if status.has_level(level):
+                    return await handler(update, context, *args, **kwargs)
+                # Flooding users don't get a reply either
+                if denied_message is not None and not status.throttled and update.effective_message is not None:
+                    await update.effective_message.reply_text(denied_message)
+            return async_wrapper
+
+        @wraps(handler)
+        def wrapper(update, context, *args, **kwargs):
+            if update.effective_user is None:
+                return None
+            status = get_status(update.effective_user.id)
+            context.auth_status = status
+            if status.has_level(level):
+                return handler(update, context, *args, **kwargs)
+            if denied_message is not None and not status.throttled and update.effective_message is not None:
+                update.effective_message.reply_text(denied_message)
+        return wrapper
+    return decorator
+
+# Reply sent by `require` to users who lack the required access level
+DENIED_MESSAGE = "You are not authorized to use this command."
 
 class Auth:
     """
     Initializes the authentication system.
     
     :param authorized_admin_ids: A list of user IDs of authorized admins.
-    :param store_type: The store type to use (either `SQLITE` or `JSON`). Defaults to `SQLITE`.
+    :param store_type: The store type to use (`SQLITE`, `SQLITE_SHARDED`, `JSON`, `JSON_JOURNAL`, `MMAP` or `SHARED_MEMORY`). Defaults to `SQLITE`.
+    :param cache_size: The maximum number of users kept in an in-process authentication cache in front of the store.
+                       Defaults to 0 (no cache).
+    :param cache_coherence_interval: The maximum time, in seconds, before the cache sees grants and revocations made by
+                                     other processes. Requires SQLite's `change_log_size` store option (in every
+                                     process): the JSON stores can't be shared between processes.
+                                     Defaults to 0 (only this process's writes are seen).
+    :param store_options: Extra keyword arguments for the store class, such as `filename`.
+    :param bloom_capacity: The number of users a Bloom filter of every authorized user ID is sized for. Lookups of users
+                           that are not in it are answered without touching the store, which absorbs floods of updates
+                           from unknown users. When several processes write to the store, set
+                           `cache_coherence_interval` too, so users they grant access to are added to the filter.
+                           Defaults to 0 (no filter).
+    :param bloom_error_rate: The false-positive rate of the Bloom filter at capacity. Defaults to 0.01.
+    :param bloom_max_bytes: The maximum size of the Bloom filter, in bytes, at the cost of a higher false-positive rate.
+                            Defaults to no limit.
+    :param stats: Whether to record call counts, latency histograms and store counters, read with `stats()`.
+                  Defaults to False, which adds no overhead at all.
+    :param stats_exporter: A function called with a `stats()` snapshot every `stats_export_interval` seconds.
+                           Setting it enables `stats`.
+    :param stats_export_interval: The number of seconds between two exports. Defaults to 60.
+    :param admission_rate: The number of lookups per second (`is_authenticated`, `get_status`, `has_scopes`) each user is allowed,
+                           on average. Lookups beyond that are answered as not authenticated without touching the
+                           cache or the store. Admins are never limited. Defaults to 0 (no limit).
+    :param admission_burst: The number of lookups a user can make at once. Defaults to 10.
+    :param admission_max_users: The maximum number of users whose rate is tracked at a time. Defaults to 65536.
+    :param lazy_open: Whether to defer opening the store (connecting to the database, loading the file...) until
+                      it is first used, for short-lived workers where startup time matters. The Bloom filter and the
+                      cache coherence read the store, so they still open it right away. Defaults to False.
+    :param table_cache: Whether to keep every user in memory and cache the rendered users and admins tables, so
+                        asking for them again only lays them out when a user was granted or revoked access (or
+                        expired) in between. Defaults to False.
     """
-    def __init__(self, owner: int, authorized_admin_ids: List[int], store_type: StoreType=StoreType.SQLITE):
+
+    # Methods whose calls are recorded when instrumentation is enabled
+    INSTRUMENTED_METHODS = (
+        "is_admin", "authorize_admin", "revoke_admin", "is_authenticated", "authorize_user", "revoke_access",
+        "is_authenticated_many", "authorize_users_many", "revoke_many", "get_authorized_users_table",
+        "get_authorized_users_tables", "get_authorized_users_page", "get_authorized_admins_table", "remaining_time",
+        "get_status", "count_active", "count_expired", "grant_scopes", "revoke_scopes", "get_scopes", "has_scopes",
+        "flush",
+    )
+
+    def __init__(self, owner: int, authorized_admin_ids: List[int], store_type: StoreType=StoreType.SQLITE,
+                 cache_size: int=0, store_options: Optional[dict]=None, bloom_capacity: int=0,
+                 bloom_error_rate: float=0.01, bloom_max_bytes: Optional[int]=None, stats: bool=False,
+                 stats_exporter: Optional[Callable[[dict], None]]=None, stats_export_interval: float=60.0,
+                 lazy_open: bool=False, cache_coherence_interval: float=0, admission_rate: float=0,
+                 admission_burst: float=10, admission_max_users: int=65536, table_cache: bool=False):
         self.owner = owner
-        self.store = create_store(store_type, authorized_admin_ids)
+        if lazy_open:
+            self.store = LazyStore(partial(create_store, store_type, authorized_admin_ids, **(store_options or {})))
+        else:
+            self.store = create_store(store_type, authorized_admin_ids, **(store_options or {}))
+
+        self._stats = None
+        if stats or stats_exporter is not None:
+            self._stats = Stats(stats_exporter, stats_export_interval)
+            self.store.stats = self._stats
+            self.store = InstrumentedStore(self.store, self._stats)
+            # Shadow the methods on the instance, so a disabled instrumentation doesn't even cost a wrapper call
+            for name in self.INSTRUMENTED_METHODS:
+                setattr(self, name, self._stats.timed(f"auth.{name}", getattr(self, name)))
+
+        self.bloom_filter = None
+        if bloom_capacity > 0:
+            # Below the cache, so writes made through the cache reach the filter, and so do the changes it asks for.
+            # Without a cache, the filter asks for them itself.
+            self.store = self.bloom_filter = BloomFilterStore(
+                self.store, bloom_capacity, bloom_error_rate, bloom_max_bytes, stats=self._stats,
+                coherence_interval=cache_coherence_interval if cache_size <= 0 else 0)
+            if self._stats is not None:
+                self._stats.add_source("bloom", self._bloom_stats)
+
+        self.table_cache = None
+        if table_cache:
+            # Below the cache too, and above the store so it sees every write, including the expiry scheduler's
+            self.store = self.table_cache = TableCache(self.store)
+            if self._stats is not None:
+                self._stats.add_source("tables", self.table_cache.info)
 
+        if cache_size > 0:
+            self.store = CachedStore(self.store, cache_size, cache_coherence_interval)
+            if self._stats is not None:
+                self._stats.add_source("cache", self._cache_stats)
 
+        self.admission = None
+        if admission_rate > 0:
+            self.admission = AdmissionController(admission_rate, admission_burst, admission_max_users)
+            if self._stats is not None:
+                self._stats.add_source("admission", self.admission.info)
+        self.expiry_scheduler = None
+
+    def stats(self) -> Optional[dict]:
+        """
+        Returns a snapshot of the instrumentation data.
+        
+        :return: None if instrumentation is disabled. Otherwise a dict with:
+                 "operations": the call count and latency histogram (in seconds) of each `Auth` ("auth.<method>")
+                 and store ("store.<method>") method;
+                 "counters": store counters such as "commits", "rows_scanned" and "bytes_written";
+                 "cache": the cache statistics and hit rate, if the cache is enabled;
+                 "bloom": the size and contents of the Bloom filter, if it is enabled. The lookups it answered
+                 are counted in "counters" as "bloom_negatives";
+                 "admission": the admitted and rejected lookups, if admission control is enabled;
+                 "tables": the cached and laid out tables, if the table cache is enabled.
+        """
+        if self._stats is None:
+            return None
+        return self._stats.snapshot()
+
+    def _bloom_stats(self) -> dict:
+        bloom = self.bloom_filter.filter
+        return {"size": bloom.size, "hashes": bloom.hashes, "count": bloom.count,
+                "removed": self.bloom_filter.removed, "rebuilds": self.bloom_filter.rebuilds}
+
+    def _cache_stats(self) -> dict:
+        info = self.cache_info()
+        lookups = info.hits + info.misses
+        return dict(info._asdict(), hit_rate=info.hits / lookups if lookups else 0.0)
     
     def close(self):
         """
         Closes the connection to the store (if applicable).
         """
+        if self.expiry_scheduler is not None:
+            self.expiry_scheduler.stop()
         self.store.close()
 
+    def flush(self):
+        """
+        Makes every grant and revocation made so far durable, e.g. before acknowledging a payment.
+        Only needed when the store commits writes in the background (SQLite's `group_commit_interval`).
+        """
+        self.store.flush()
+
+    def start_expiry_scheduler(self, batch_size: int=500) -> ExpiryScheduler:
+        """
+        Starts a background thread that removes users from the store as soon as their access expires.
+        
+        :param batch_size: The maximum number of users removed per delete. Default: 500
+        :return: The running scheduler.
+        """
+        if self.expiry_scheduler is None:
+            self.expiry_scheduler = ExpiryScheduler(self.store, batch_size)
+            self.expiry_scheduler.start()
+        return self.expiry_scheduler
+
+    def on_expire(self, callback: Callable[[int], None]) -> Callable[[int], None]:
+        """
+        Registers a function to be called with the ID of each user whose access expired, e.g. to notify them.
+        Starts the expiry scheduler if it is not running. Can be used as a decorator.
+        
+        :param callback: The function to call. It runs on the scheduler thread.
+        :return: The callback, unchanged.
+        """
+        if self.expiry_scheduler is None:
+            # Registered before the thread starts, so the users that already expired aren't purged without it
+            self.expiry_scheduler = ExpiryScheduler(self.store)
+            self.expiry_scheduler.add_callback(callback)
+            self.expiry_scheduler.start()
+        else:
+            self.expiry_scheduler.add_callback(callback)
+        return callback
+
+    def cache_info(self) -> Optional[CacheInfo]:
+        """
+        Returns the hit/miss statistics of the authentication cache.
+
+        :return: A `CacheInfo` tuple, or None if the cache is disabled.
+        """
+        if isinstance(self.store, CachedStore):
+            return self.store.cache_info()
+        return None
+
     def is_admin(self, user_id: int) -> bool:
         """
         Determines if the specified user is an authorized admin.
@@ -70,8 +383,16 @@ class Auth:
         :param user_id: The user ID to check.
         :return: True if the user is authenticated, False otherwise.
         """
+        if self.admission is not None and not self._admit(user_id):
+            return False
         return self.store.is_authenticated(user_id)
     
+    def _admit(self, user_id: int) -> bool:
+        """
+        Takes a token from the user's admission bucket. Admins and the owner are always admitted.
+        """
+        return self.is_owner(user_id) or self.store.is_admin(user_id) or self.admission.admit(user_id)
+
     def authorize_user(self, user_id: int, days: int, hours: int):
         """
         Grants access to the specified user for the specified number of days and hours.
@@ -81,6 +402,7 @@ class Auth:
         :param hours: The number of hours of access to grant.
         """
         self.store.authorize_user(user_id, days, hours)
+        self._schedule_expiry(days, hours)
     
     def revoke_access(self, user_id: int):
         """
@@ -90,6 +412,84 @@ class Auth:
         """
         self.store.revoke_access(user_id)
     
+    def is_authenticated_many(self, user_ids: Iterable[int]) -> Dict[int, bool]:
+        """
+        Determines which of the specified users are authenticated, using a single batched lookup when the store supports it.
+        
+        :param user_ids: The user IDs to check.
+        :return: A dict mapping each user ID to True if the user is authenticated, False otherwise.
+        """
+        return self.store.is_authenticated_many(user_ids)
+
+    def authorize_users_many(self, user_ids: Iterable[int], days: int, hours: int):
+        """
+        Grants access to all the specified users for the specified number of days and hours, in a single batch.
+        
+        :param user_ids: The user IDs to authorize.
+        :param days: The number of days of access to grant.
+        :param hours: The number of hours of access to grant.
+        """
+        self.store.authorize_users_many(user_ids, days, hours)
+        self._schedule_expiry(days, hours)
+
+    def revoke_many(self, user_ids: Iterable[int]):
+        """
+        Revokes access to all the specified users, in a single batch.
+        
+        :param user_ids: The user IDs to revoke access to.
+        """
+        self.store.revoke_many(user_ids)
+
+    def grant_scopes(self, user_id: int, scopes: int, days: int=0, hours: int=0):
+        """
+        Grants scopes (e.g. premium features or moderator commands) to the specified user, for the specified number
+        of days and hours, or for good if both are 0. Scopes the user already has get the new expiration.
+        Scopes are independent of the user's access: revoking it, or letting it expire, leaves them as they are.
+        
+        :param user_id: The user ID to grant the scopes to.
+        :param scopes: The bitmask of the scopes to grant, e.g. an `enum.IntFlag`.
+        :param days: The number of days the scopes are granted for. Default: 0
+        :param hours: The number of hours the scopes are granted for. Default: 0
+        """
+        expires = int(time()) + days * 86400 + hours * 3600 if days or hours else None
+        self.store.grant_scopes(user_id, _check_scopes(scopes), expires)
+
+    def revoke_scopes(self, user_id: int, scopes: int=ALL_SCOPES):
+        """
+        Revokes scopes from the specified user.
+        
+        :param user_id: The user ID to revoke the scopes from.
+        :param scopes: The bitmask of the scopes to revoke. Default: every scope
+        """
+        self.store.revoke_scopes(user_id, _check_scopes(scopes))
+
+    def get_scopes(self, user_id: int) -> int:
+        """
+        Returns the scopes the specified user currently holds. Admins (including the owner) hold every scope.
+        
+        :param user_id: The user's ID
+        :return: The bitmask of the unexpired scopes, 0 if the user has none.
+        """
+        if self.is_admin(user_id):
+            return ALL_SCOPES
+        return _active_scopes(self.store.get_scopes(user_id), time())
+
+    def has_scopes(self, user_id: int, scopes: int) -> bool:
+        """
+        Determines whether the specified user holds all the specified scopes, with a single store lookup (or cache hit)
+        however many scopes are checked. Admins (including the owner) hold every scope.
+        
+        :param user_id: The user ID to check.
+        :param scopes: The bitmask of the required scopes, e.g. `Scope.PREMIUM | Scope.MODERATOR`.
+        :return: True if none of the scopes is missing or expired, False otherwise.
+        """
+        scopes = _check_scopes(scopes)
+        if self.is_admin(user_id):
+            return True
+        if self.admission is not None and not self.admission.admit(user_id):
+            return False
+        return _active_scopes(self.store.get_scopes(user_id), time()) & scopes == scopes
+    
     def get_authorized_users_table(self, field_names:List[str]=["USER ID", "EXPIRES"], datetime_format:str="%d/%m/%Y %H:%M") -> str:
         """
         Returns a prettytable string with all authorized users and their expiration dates.
@@ -99,21 +499,76 @@ class Auth:
         :param datetime_format: The format for the expiration date. Default: "%d/%m/%Y %H:%M"
         :return: The table as a string
         """
-
+        if self.table_cache is not None:
+            return self.table_cache.users_table(field_names, datetime_format)
         users = self.store.get_authorized_users()
-        table = PrettyTable(border=False, padding_width=0, preserve_internal_border=True)
-        table.field_names = field_names
+        return _users_table(users, field_names, datetime_format)
+
+    def get_authorized_users_tables(self, field_names:List[str]=["USER ID", "EXPIRES"], datetime_format:str="%d/%m/%Y %H:%M",
+                                    max_length:int=MESSAGE_MAX_LENGTH - 96) -> Iterator[str]:
+        """
+        Same as `get_authorized_users_table`, but streams the users from the store and splits the table into chunks
+        that fit in a Telegram message, so it works with any number of users.
+        
+        :param field_names: The field names to be displayed in the tables. Default: ["USER ID", "EXPIRES"]
+        :param datetime_format: The format for the expiration date. Default: "%d/%m/%Y %H:%M"
+        :param max_length: The maximum length of each table. Default: 4000, leaving room for a short caption
+        :return: An iterator of tables as strings
+        """
+        if self.table_cache is not None:
+            return iter(self.table_cache.users_tables(field_names, datetime_format, max_length))
+        users = self.store.iter_authorized_users()
+        return _users_tables(_users_rows(users, datetime_format), field_names, max_length)
+
+    def iter_authorized_users(self, batch_size: int=1000) -> Iterator[Tuple[int, datetime]]:
+        """
+        Iterates over all authorized users, ordered by expiration date, loading `batch_size` users at a time.
+        
+        :param batch_size: The number of users loaded from the store at a time. Default: 1000
+        :return: An iterator of tuples containing the user IDs and expiration dates.
+        """
+        for user_id, expires in self.store.iter_authorized_users(batch_size):
+            yield user_id, datetime.fromtimestamp(expires)
+
+    def get_authorized_users_page(self, after_cursor: Optional[Cursor]=None, limit: int=100) -> Tuple[List[Tuple[int, datetime]], Optional[Cursor]]:
+        """
+        Returns a page of authorized users, ordered by expiration date and then user ID.
+        
+        :param after_cursor: The cursor returned with the previous page, or None to get the first page.
+        :param limit: The maximum number of users in the page. Default: 100
+        :return: A tuple containing the users of the page and the cursor of the next page (None if this is the last one).
+        """
+        page, cursor = self.store.get_authorized_users_page(after_cursor, limit)
+        return _to_datetimes(page), cursor
+
+    def iter_expiring_between(self, start: Optional[datetime]=None, end: Optional[datetime]=None,
+                              batch_size: int=1000) -> Iterator[Tuple[int, datetime]]:
+        """
+        Iterates over the users whose access expires in a range, ordered by expiration date, e.g. to remind
+        the users expiring in the next 24 hours, or to list the ones that expired since a date.
+        
+        :param start: The start of the range, included. Default: no lower bound
+        :param end: The end of the range, excluded. Default: no upper bound
+        :param batch_size: The number of users loaded from the store at a time. Default: 1000
+        :return: An iterator of tuples containing the user IDs and expiration dates.
+        """
+        for user_id, expires in self.store.iter_expiring_between(_to_timestamp(start), _to_timestamp(end), batch_size):
+            yield user_id, datetime.fromtimestamp(expires)
+
+    def count_active(self) -> int:
+        """
+        Returns the number of users whose access hasn't expired, without loading them.
+        Admins are not counted, unless they were also granted access as users.
+        """
+        return self.store.count_active()
 
-        for user in users:
-            user_id, expires = user
-            expires_str = expires.strftime(datetime_format)
-            if expires < datetime.now():
-                # Highlight expired users
-                table.add_row([f"{user_id}", f"{expires_str} ⚠️"])
-            else:
-                table.add_row([user_id, expires_str])
+    def count_expired(self, since: Optional[datetime]=None) -> int:
+        """
+        Returns the number of users whose access expired and who weren't purged yet, without loading them.
         
-        return str(table)
+        :param since: Only count the users whose access expired at or after this date. Default: all of them
+        """
+        return self.store.count_expired(_to_timestamp(since))
 
     def get_authorized_admins_table(self, field_names:List[str]=["USER ID"]) -> str:
         """
@@ -122,15 +577,10 @@ class Auth:
         :param field_names: The field names to be displayed in the table. Default: ["USER ID"]
         :return: The table as a string
         """
-
+        if self.table_cache is not None:
+            return self.table_cache.admins_table(field_names)
         admins = self.store.authorized_admin_ids
-        table = PrettyTable(border=False, padding_width=0, preserve_internal_border=True)
-        table.field_names = field_names
-
-        for user_id in admins:
-            table.add_row([user_id])
-        
-        return str(table)
+        return _admins_table(admins, field_names)
     
     def remaining_time(self, user_id: int) -> Tuple[int, int, int]:
         """
@@ -140,18 +590,44 @@ class Auth:
         :return: A tuple containing the number of days, hours, and minutes remaining. 
                  If the user is not authorized or has expired, all values will be 0.
         """
-        days, hours, minutes = 0, 0, 0
+        user = self.store.get_authorized_user(user_id)
+        return _remaining_time(user)
+
+    def get_status(self, user_id: int) -> AuthStatus:
+        """
+        Returns whether the specified user is the owner, an admin and authenticated, and when their access expires,
+        with a single store lookup. Admins (including the owner) are always authenticated.
         
+        :param user_id: The user's ID
+        :return: An `AuthStatus` tuple.
+        """
+        if self.admission is not None and not self._admit(user_id):
+            return AuthStatus(user_id, False, False, False, None, (0, 0, 0), throttled=True)
         user = self.store.get_authorized_user(user_id)
+        return _status(user_id, self.is_owner(user_id), self.is_admin(user_id), user)
 
-        if user is not None:
-            user_id, expires = user
-            remaining = expires - datetime.now()
-            days = remaining.days
-            hours = remaining.seconds // 3600
-            minutes = (remaining.seconds % 3600) // 60
+    def require(self, level: AccessLevel=AccessLevel.USER, denied_message: Optional[str]=DENIED_MESSAGE) -> Callable:
+        """
+        Decorator for python-telegram-bot handlers that only runs them for users with the specified access level.
+        The status of the user is resolved once per update with `get_status`, and stored as `context.auth_status`
+        so the handler doesn't have to query it again. Updates without a user (e.g. channel posts) are ignored.
+        Works with both regular and coroutine handlers.
+        
+        :param level: The access level required to run the handler. Default: `AccessLevel.USER`
+        :param denied_message: The reply sent to users without that level, or None to ignore them silently.
+        :return: The decorator.
+        """
+        return _require(self.get_status, level, denied_message)
 
-        return days, hours, minutes
+    def _schedule_expiry(self, days: int, hours: int):
+        """
+        Lets the expiry scheduler (if running) know about a new grant.
+        
+        :param days: The number of days of access granted.
+        :param hours: The number of hours of access granted.
+        """
+        if self.expiry_scheduler is not None:
+            self.expiry_scheduler.schedule(int(time()) + days * 86400 + hours * 3600)
 
     def _insert_user(self, user_id: int, expires: datetime):
         """
@@ -160,7 +636,10 @@ class Auth:
         :param user_id: The user's ID
         :param expires: The new expiration date for the user
         """
+        expires = int(expires.timestamp())
         self.store.insert_user(user_id, expires)
+        if self.expiry_scheduler is not None:
+            self.expiry_scheduler.schedule(expires)
     
     def _update_user(self, user_id: int, expires: datetime):
         """
@@ -169,4 +648,7 @@ class Auth:
         :param user_id: The user's ID
         :param expires: The new expiration date for the user
         """
+        expires = int(expires.timestamp())
         self.store.update_user(user_id, expires)
+        if self.expiry_scheduler is not None:
+            self.expiry_scheduler.schedule(expires)
@@ -0,0 +1,257 @@
+import math
+import threading
+from contextlib import contextmanager
+from time import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from teleauth.store import IStore, StoreWrapper
+
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+
+def _splitmix64(x: int) -> int:
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter of integers. Membership tests can return false positives, never false negatives.
+    """
+
+    def __init__(self, capacity: int, error_rate: float=0.01, max_bytes: Optional[int]=None):
+        """
+        Initializes a new instance of the BloomFilter class.
+
+        :param capacity: The number of items the filter is sized for.
+        :param error_rate: The false-positive rate once `capacity` items were added, between 0 and 1.
+        :param max_bytes: The maximum size of the bit array. When it caps the size, the false-positive rate is higher.
+        """
+        if not 0 < error_rate < 1:
+            raise ValueError(f"Invalid error rate: {error_rate}")
+        capacity = max(1, capacity)
+        bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        if max_bytes is not None:
+            bits = min(bits, max_bytes * 8)
+        self.capacity = capacity
+        self.bits = max(64, bits)
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.count = 0
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _hash(self, item: int) -> Tuple[int, int]:
+        # Double hashing: the k indexes are h1 + i * h2, derived from a single 64-bit hash
+        h = _splitmix64(item & MASK64)
+        return h & 0xFFFFFFFF, (h >> 32) | 1
+
+    def add(self, item: int):
+        array, bits = self._array, self.bits
+        index, step = self._hash(item)
+        for _ in range(self.hashes):
+            index %= bits
+            array[index >> 3] |= 1 << (index & 7)
+            index += step
+        self.count += 1
+
+    def __contains__(self, item: int) -> bool:
+        array, bits = self._array, self.bits
+        index, step = self._hash(item)
+        for _ in range(self.hashes):
+            index %= bits
+            if not array[index >> 3] & (1 << (index & 7)):
+                return False
+            index += step
+        return True
+
+    @property
+    def size(self) -> int:
+        """
+        The size of the bit array, in bytes.
+        """
+        return len(self._array)
+
+
+class BloomFilterStore(StoreWrapper):
+    """
+    Answers lookups of users that were never authorized without touching the wrapped store, e.g. during a flood of
+    updates from unknown users.
+
+    A Bloom filter holds every user ID written through this wrapper. Users that aren't in it are definitely not in
+    the store; the others (including the few false positives) are looked up in the store as usual.
+    Revoked users stay in the filter until it is rebuilt from the store, once they make up `rebuild_ratio` of it.
+
+    Users written by other processes are added as they show up in `changes_since`: either when a cache above this
+    wrapper asks for them, before it drops its own entries, or every `coherence_interval` seconds.
+    """
+
+    def __init__(self, store: IStore, capacity: int, error_rate: float=0.01, max_bytes: Optional[int]=None,
+                 rebuild_ratio: float=0.25, stats=None, coherence_interval: float=0):
+        """
+        Initializes a new instance of the BloomFilterStore class, loading the users of the store into the filter.
+
+        :param store: The store to wrap.
+        :param capacity: The number of users the filter is sized for. It is resized when rebuilt if the store outgrew it.
+        :param error_rate: The false-positive rate at capacity. Default: 0.01
+        :param max_bytes: The maximum size of the filter, in bytes. Default: no limit
+        :param rebuild_ratio: The fraction of removed users in the filter that triggers a rebuild. Default: 0.25
+        :param stats: Where to count the lookups answered by the filter ("bloom_negatives"), if instrumentation is enabled.
+        :param coherence_interval: The maximum time, in seconds, before users written by other processes are added to
+                                   the filter. Default: 0 (only when a cache above asks for the changes)
+        """
+        super().__init__(store)
+        self.error_rate = error_rate
+        self.max_bytes = max_bytes
+        self.rebuild_ratio = rebuild_ratio
+        self.stats = stats
+        self.removed = 0
+        self.rebuilds = 0
+        self._capacity = capacity
+        self._lock = threading.Lock()
+        self.coherence_interval = coherence_interval
+        if coherence_interval > 0:
+            changes = store.changes_since(None)
+            if changes is None:
+                raise ValueError(f"{type(store).__name__} doesn't track changes, set SQLite's change_log_size")
+            self._change_seq = changes[0]
+            self._sync_lock = threading.Lock()
+            self._next_sync = time() + coherence_interval
+        self.rebuild()
+
+    def rebuild(self):
+        """
+        Rebuilds the filter from the users in the store, dropping the removed ones.
+        """
+        with self._lock:
+            users = [user_id for user_id, _ in self.store.iter_authorized_users()]
+            self._capacity = max(self._capacity, 2 * len(users))
+            bloom = BloomFilter(self._capacity, self.error_rate, self.max_bytes)
+            for user_id in users:
+                bloom.add(user_id)
+            # Swapped in one assignment: lookups never see a partially built filter
+            self.filter = bloom
+            self.removed = 0
+            self.rebuilds += 1
+
+    def _learn(self, user_ids: Optional[List[int]]):
+        """
+        Adds users changed by other processes to the filter, or rebuilds it if they are no longer known.
+        Revoked users are added too, which only costs a false positive.
+        """
+        if user_ids is None:
+            self.rebuild()
+            return
+        with self._lock:
+            for user_id in user_ids:
+                self.filter.add(user_id)
+
+    def _sync(self):
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sync = time() + self.coherence_interval
+            self._change_seq, user_ids = self.store.changes_since(self._change_seq)
+            self._learn(user_ids)
+        finally:
+            self._sync_lock.release()
+
+    def changes_since(self, seq: Optional[int]) -> Optional[Tuple[int, Optional[List[int]]]]:
+        changes = self.store.changes_since(seq)
+        if changes is not None and seq is not None:
+            # Before the caller drops its entries, so its next lookup of these users gets past the filter
+            self._learn(changes[1])
+        return changes
+
+    def might_contain(self, user_id: int) -> bool:
+        """
+        Determines whether the specified user may be in the store, without touching it.
+
+        :param user_id: The user's ID
+        :return: False if the user is definitely not in the store, True otherwise.
+        """
+        if user_id in self.filter:
+            return True
+        if self.coherence_interval and time() >= self._next_sync:
+            self._sync()
+            if user_id in self.filter:
+                return True
+        if self.stats is not None:
+            self.stats.incr("bloom_negatives")
+        return False
+
+    @contextmanager
+    def _adding(self, user_ids: Iterable[int]):
+        """
+        Adds users to the filter before they are written to the store, so a concurrent lookup never misses a stored
+        user, and holds the lock during the write, so a rebuild can't drop them.
+        """
+        with self._lock:
+            for user_id in user_ids:
+                self.filter.add(user_id)
+            yield
+
+    def _removed(self, count: int):
+        with self._lock:
+            self.removed += count
+            rebuild = self.removed > self.rebuild_ratio * self.filter.count
+        if rebuild:
+            self.rebuild()
+
+    def is_authenticated(self, user_id: int) -> bool:
+        if self.is_admin(user_id):
+            return True
+        return self.might_contain(user_id) and self.store.is_authenticated(user_id)
+
+    def get_authorized_user(self, user_id: int) -> Tuple[int, int]:
+        if not self.might_contain(user_id):
+            return None
+        return self.store.get_authorized_user(user_id)
+
+    def is_authenticated_many(self, user_ids: Iterable[int]) -> Dict[int, bool]:
+        result = {}
+        pending = []
+        for user_id in user_ids:
+            if self.is_admin(user_id) or self.might_contain(user_id):
+                pending.append(user_id)
+            else:
+                result[user_id] = False
+        if pending:
+            result.update(self.store.is_authenticated_many(pending))
+        return result
+
+    def authorize_user(self, user_id: int, days: int, hours: int):
+        with self._adding([user_id]):
+            self.store.authorize_user(user_id, days, hours)
+
+    def insert_user(self, user_id: int, expires: int):
+        with self._adding([user_id]):
+            self.store.insert_user(user_id, expires)
+
+    def update_user(self, user_id: int, expires: int):
+        with self._adding([user_id]):
+            self.store.update_user(user_id, expires)
+
+    def authorize_users_many(self, user_ids: Iterable[int], days: int, hours: int):
+        user_ids = list(user_ids)
+        with self._adding(user_ids):
+            self.store.authorize_users_many(user_ids, days, hours)
+
+    def upsert_users_many(self, users: Iterable[Tuple[int, int]]):
+        users = list(users)
+        with self._adding(user_id for user_id, _ in users):
+            self.store.upsert_users_many(users)
+
+    def revoke_access(self, user_id: int):
+        self.store.revoke_access(user_id)
+        self._removed(1)
+
+    def revoke_many(self, user_ids: Iterable[int]):
+        user_ids = list(user_ids)
+        self.store.revoke_many(user_ids)
+        self._removed(len(user_ids))
+
+    def purge_expired(self, before: int, limit: int) -> List[int]:
+        user_ids = self.store.purge_expired(before, limit)
+        if user_ids:
+            self._removed(len(user_ids))
+        return user_ids
@@ -0,0 +1,316 @@
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from teleauth.store import IStore, Scopes, StoreWrapper
+
+
+class CacheInfo(NamedTuple):
+    """
+    Statistics of a `CachedStore`, in the same shape as `functools.lru_cache`'s `cache_info()`.
+    """
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class CachedStore(StoreWrapper):
+    """
+    A bounded LRU cache in front of any store.
+
+    The cache keeps the expiration timestamp of each looked up user (or the fact that the user is unknown),
+    so `is_authenticated` is decided locally by comparing it with the current time instead of querying the store.
+    Writes made through the cache update or invalidate the affected entries. The scopes of the users are kept in a
+    second LRU of the same size, so `get_scopes` is answered locally too.
+
+    Writes made by other processes are picked up when `coherence_interval` is set: at most that often, a lookup asks
+    the store which users changed since the last time (see `IStore.changes_since`) and drops them from the cache.
+    """
+
+    def __init__(self, store: IStore, maxsize: int=1024, coherence_interval: float=0):
+        """
+        Initializes a new instance of the CachedStore class.
+
+        :param store: The store to cache.
+        :param maxsize: The maximum number of users to keep in the cache. The least recently used users are evicted first.
+        :param coherence_interval: The maximum time, in seconds, a write made by another process stays invisible.
+                                   Default: 0 (only writes made through this cache are seen)
+        """
+        super().__init__(store)
+        self.maxsize = maxsize
+        self.coherence_interval = coherence_interval
+        self.hits = 0
+        self.misses = 0
+        # user_id -> expiration timestamp, or None if the user is not in the store
+        self._entries = OrderedDict()
+        # user_id -> scopes, or None if the user has no scopes
+        self._scopes = OrderedDict()
+        self._lock = Lock()
+        # Bumped on every write so a slow lookup can't cache a value that a concurrent write already replaced
+        self._generation = 0
+
+        if coherence_interval > 0:
+            changes = store.changes_since(None)
+            if changes is None:
+                raise ValueError(f"{type(store).__name__} doesn't track changes, set SQLite's change_log_size")
+            self._change_seq = changes[0]
+            self._sync_lock = Lock()
+            self._next_sync = time() + coherence_interval
+
+    def _sync(self):
+        """
+        Drops the users changed by other processes from the cache. Only one thread asks the store at a time.
+        """
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sync = time() + self.coherence_interval
+            seq, user_ids = self.store.changes_since(self._change_seq)
+            with self._lock:
+                self._generation += 1
+                if user_ids is None:
+                    # Too far behind to know which users changed
+                    self._entries.clear()
+                    self._scopes.clear()
+                else:
+                    for user_id in user_ids:
+                        self._entries.pop(user_id, None)
+                        self._scopes.pop(user_id, None)
+            self._change_seq = seq
+        finally:
+            self._sync_lock.release()
+
+    def cache_info(self) -> CacheInfo:
+        """
+        Returns the cache statistics. Hits and misses include the lookups of scopes, the current size doesn't.
+
+        :return: A `CacheInfo` tuple with the hits, misses, maximum size and current size of the cache.
+        """
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    def cache_clear(self):
+        """
+        Drops every cached entry and resets the statistics.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+            self._generation += 1
+            self.hits = 0
+            self.misses = 0
+
+    def _get_expires(self, user_id: int) -> Optional[int]:
+        """
+        Returns the expiration timestamp of the specified user, loading it from the store on a cache miss.
+
+        :param user_id: The user's ID
+        :return: The expiration timestamp, or None if the user is not in the store.
+        """
+        if self.coherence_interval and time() >= self._next_sync:
+            self._sync()
+        with self._lock:
+            try:
+                expires = self._entries[user_id]
+            except KeyError:
+                self.misses += 1
+                generation = self._generation
+            else:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return expires
+
+        user = self.store.get_authorized_user(user_id)
+        expires = None if user is None else user[1]
+
+        with self._lock:
+            if generation == self._generation:
+                self._put(user_id, expires)
+        return expires
+
+    def peek_authenticated(self, user_id: int) -> Optional[bool]:
+        """
+        Determines whether the specified user is authenticated using only the cache, never touching the store.
+
+        :param user_id: The user id to check.
+        :return: True or False if the answer is known locally, None on a cache miss.
+        """
+        if self.is_admin(user_id):
+            return True
+        if self.coherence_interval and time() >= self._next_sync:
+            # Syncing touches the store: answer as a miss, so the caller looks the user up the usual way
+            return None
+
+        with self._lock:
+            if user_id not in self._entries:
+                return None
+            expires = self._entries[user_id]
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+        return expires is not None and expires > time()
+
+    def _put(self, user_id: int, expires: Optional[int]):
+        # Must be called with the lock held
+        self._entries[user_id] = expires
+        self._entries.move_to_end(user_id)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _set(self, user_id: int, expires: Optional[int]):
+        with self._lock:
+            self._generation += 1
+            self._put(user_id, expires)
+
+    def _invalidate(self, user_id: int):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(user_id, None)
+
+    def is_authenticated(self, user_id: int) -> bool:
+        if self.is_admin(user_id):
+            return True
+
+        expires = self._get_expires(user_id)
+        return expires is not None and expires > time()
+
+    def authorize_user(self, user_id: int, days: int, hours: int):
+        try:
+            self.store.authorize_user(user_id, days, hours)
+        finally:
+            self._invalidate(user_id)
+
+    def revoke_access(self, user_id: int):
+        try:
+            self.store.revoke_access(user_id)
+        except BaseException:
+            self._invalidate(user_id)
+            raise
+        self._set(user_id, None)
+
+    def get_authorized_user(self, user_id: int) -> Tuple[int, int]:
+        expires = self._get_expires(user_id)
+        if expires is None:
+            return None
+        return (user_id, expires)
+
+    def insert_user(self, user_id: int, expires: int):
+        try:
+            self.store.insert_user(user_id, expires)
+        except BaseException:
+            self._invalidate(user_id)
+            raise
+        self._set(user_id, expires)
+
+    def update_user(self, user_id: int, expires: int):
+        try:
+            self.store.update_user(user_id, expires)
+        except BaseException:
+            self._invalidate(user_id)
+            raise
+        self._set(user_id, expires)
+
+    def is_authenticated_many(self, user_ids: Iterable[int]) -> Dict[int, bool]:
+        result = {}
+        misses = []
+        now = time()
+        with self._lock:
+            for user_id in user_ids:
+                if self.store.is_admin(user_id):
+                    result[user_id] = True
+                elif user_id in self._entries:
+                    expires = self._entries[user_id]
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    result[user_id] = expires is not None and expires > now
+                else:
+                    self.misses += 1
+                    misses.append(user_id)
+
+        if misses:
+            result.update(self.store.is_authenticated_many(misses))
+        return result
+
+    def authorize_users_many(self, user_ids: Iterable[int], days: int, hours: int):
+        user_ids = list(user_ids)
+        try:
+            self.store.authorize_users_many(user_ids, days, hours)
+        finally:
+            for user_id in user_ids:
+                self._invalidate(user_id)
+
+    def revoke_many(self, user_ids: Iterable[int]):
+        user_ids = list(user_ids)
+        try:
+            self.store.revoke_many(user_ids)
+        except BaseException:
+            for user_id in user_ids:
+                self._invalidate(user_id)
+            raise
+        for user_id in user_ids:
+            self._set(user_id, None)
+
+    def upsert_users_many(self, users: Iterable[Tuple[int, int]]):
+        users = list(users)
+        try:
+            self.store.upsert_users_many(users)
+        except BaseException:
+            for user_id, _ in users:
+                self._invalidate(user_id)
+            raise
+        for user_id, expires in users:
+            self._set(user_id, expires)
+
+    def get_scopes(self, user_id: int) -> Optional[Scopes]:
+        if self.coherence_interval and time() >= self._next_sync:
+            self._sync()
+        with self._lock:
+            try:
+                scopes = self._scopes[user_id]
+            except KeyError:
+                self.misses += 1
+                generation = self._generation
+            else:
+                self._scopes.move_to_end(user_id)
+                self.hits += 1
+                return scopes
+
+        scopes = self.store.get_scopes(user_id)
+
+        with self._lock:
+            if generation == self._generation:
+                self._scopes[user_id] = scopes
+                if len(self._scopes) > self.maxsize:
+                    self._scopes.popitem(last=False)
+        return scopes
+
+    def _invalidate_scopes(self, user_id: int):
+        with self._lock:
+            self._generation += 1
+            self._scopes.pop(user_id, None)
+
+    def grant_scopes(self, user_id: int, scopes: int, expires: Optional[int]):
+        try:
+            self.store.grant_scopes(user_id, scopes, expires)
+        finally:
+            self._invalidate_scopes(user_id)
+
+    def revoke_scopes(self, user_id: int, scopes: int):
+        try:
+            self.store.revoke_scopes(user_id, scopes)
+        finally:
+            self._invalidate_scopes(user_id)
+
+    def upsert_scopes_many(self, scopes: Iterable[Tuple[int, Scopes]]):
+        scopes = list(scopes)
+        try:
+            self.store.upsert_scopes_many(scopes)
+        finally:
+            for user_id, _ in scopes:
+                self._invalidate_scopes(user_id)
+
+    def purge_expired(self, before: int, limit: int) -> List[int]:
+        user_ids = self.store.purge_expired(before, limit)
+        for user_id in user_ids:
+            self._set(user_id, None)
+        return user_ids
@@ -0,0 +1,126 @@
+import heapq
+import logging
+import threading
+from time import time
+from typing import Callable, List, Optional
+from teleauth.store import IStore
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryScheduler:
+    """
+    Background engine that removes users from the store as their access expires.
+
+    A min-heap of wake-up times, seeded with the earliest expiration in the store and fed with new grants, tells
+    the sweeper thread when to wake. Each time it wakes, it purges the expired users in batches of `batch_size`
+    and calls every `on_expire` callback with the ID of each purged user, so the bot can notify them (or archive them).
+    """
+
+    # Seconds to wait before trying again when a sweep fails
+    RETRY_INTERVAL = 60
+
+    def __init__(self, store: IStore, batch_size: int=500):
+        """
+        Initializes a new instance of the ExpiryScheduler class.
+
+        :param store: The store to purge.
+        :param batch_size: The maximum number of users removed per delete, so large sweeps don't hold the store's
+                           write lock for long.
+        """
+        self.store = store
+        self.batch_size = batch_size
+        self.callbacks: List[Callable[[int], None]] = []
+        self._heap = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def add_callback(self, callback: Callable[[int], None]):
+        """
+        Registers a function to be called with the ID of each user whose access expired and was purged.
+
+        :param callback: The function to call. It runs on the sweeper thread.
+        """
+        self.callbacks.append(callback)
+
+    def start(self):
+        """
+        Starts the sweeper thread. Users that already expired are purged right away.
+        """
+        if self._thread is not None:
+            return
+        self._stopped = False
+        self._schedule_next()
+        self._thread = threading.Thread(target=self._run, name="teleauth-expiry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the sweeper thread and waits for it to finish.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def schedule(self, expires: int):
+        """
+        Makes the sweeper wake up at the specified time. Called for every new grant, so it doesn't have to poll the store.
+
+        :param expires: The expiration timestamp of a user's access, in epoch seconds.
+        """
+        with self._condition:
+            # Later wake-ups are redundant: after each sweep the next one is read from the store again
+            if not self._heap or expires < self._heap[0]:
+                heapq.heappush(self._heap, expires)
+                self._condition.notify()
+
+    def sweep(self, now: Optional[int]=None) -> List[int]:
+        """
+        Purges every user whose access expired and fires the callbacks.
+
+        :param now: The reference time, in epoch seconds. Defaults to the current time.
+        :return: The IDs of the purged users.
+        """
+        now = int(time()) if now is None else now
+        purged = []
+        while True:
+            user_ids = self.store.purge_expired(now, self.batch_size)
+            purged.extend(user_ids)
+            for user_id in user_ids:
+                for callback in self.callbacks:
+                    try:
+                        callback(user_id)
+                    except Exception:
+                        logger.exception("on_expire callback failed for user %s", user_id)
+            if len(user_ids) < self.batch_size:
+                return purged
+
+    def _schedule_next(self):
+        expires = self.store.next_expiry()
+        if expires is not None:
+            self.schedule(expires)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (not self._heap or self._heap[0] > time()):
+                    timeout = self._heap[0] - time() if self._heap else None
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+                # Several grants may expire at once; a single sweep handles them all
+                now = time()
+                while self._heap and self._heap[0] <= now:
+                    heapq.heappop(self._heap)
+
+            try:
+                self.sweep(int(now))
+                self._schedule_next()
+            except Exception:
+                logger.exception("Failed to purge expired users")
+                with self._condition:
+                    heapq.heappush(self._heap, time() + self.RETRY_INTERVAL)
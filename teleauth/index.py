@@ -0,0 +1,100 @@
+from bisect import bisect_left, insort
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from teleauth.store import _range
+
+# The number of changed users above which a query merges them into the sorted list instead of moving them one by one
+MAX_MOVES = 16
+
+
+class ExpiryIndex:
+    """
+    The users of an in-memory store sorted by expiration timestamp, so range and count queries cost O(log n + k)
+    instead of a scan of every user.
+
+    The sorted list is built on the first query. Writes only record the previous expiration of the users they touch,
+    and the next query moves just those users. Each move shifts the list, so when more than a few users changed they
+    are merged in a single pass instead: m writes between two queries cost O(n + m log m), not O(m·n). The list is
+    rebuilt from scratch when most of the users changed.
+
+    The store calls `changed` before each write and the queries, with its write lock held.
+    """
+
+    def __init__(self, load: Callable[[], Iterable[Tuple[int, int]]], lookup: Callable[[int], Optional[int]]):
+        """
+        Initializes a new instance of the ExpiryIndex class.
+
+        :param load: A function returning every (user_id, expires) of the store.
+        :param lookup: A function returning the expiration timestamp of a user, or None if the user is not in the store.
+        """
+        self._load = load
+        self._lookup = lookup
+        # (expires, user_id), None until the first query
+        self._sorted: Optional[List[Tuple[int, int]]] = None
+        # user_id -> expiration timestamp in `_sorted` (None if absent), for the users written since the last query
+        self._previous: Dict[int, Optional[int]] = {}
+
+    def changed(self, user_ids: Iterable[int]):
+        """
+        Records that the users are about to be written.
+
+        :param user_ids: The IDs of the users.
+        """
+        if self._sorted is None:
+            return
+        for user_id in user_ids:
+            if user_id not in self._previous:
+                self._previous[user_id] = self._lookup(user_id)
+        if len(self._previous) > 256 and len(self._previous) * 4 > len(self._sorted):
+            # Sorting every user again is cheaper than moving them one by one
+            self.reset()
+
+    def reset(self):
+        """
+        Drops the sorted list, e.g. after the store was reloaded.
+        """
+        self._sorted = None
+        self._previous.clear()
+
+    def _update(self) -> List[Tuple[int, int]]:
+        if self._sorted is None:
+            self._sorted = sorted((expires, user_id) for user_id, expires in self._load())
+            return self._sorted
+        if len(self._previous) > MAX_MOVES:
+            changed = self._previous
+            users = [user for user in self._sorted if user[1] not in changed]
+            users.extend(sorted((expires, user_id) for user_id, expires in
+                                ((user_id, self._lookup(user_id)) for user_id in changed) if expires is not None))
+            # Timsort merges the two sorted runs in linear time
+            users.sort()
+            self._sorted = users
+            self._previous.clear()
+            return users
+        for user_id, previous in self._previous.items():
+            expires = self._lookup(user_id)
+            if expires == previous:
+                continue
+            if previous is not None:
+                del self._sorted[bisect_left(self._sorted, (previous, user_id))]
+            if expires is not None:
+                insort(self._sorted, (expires, user_id))
+        self._previous.clear()
+        return self._sorted
+
+    def _slice(self, start: Optional[int], end: Optional[int]) -> Tuple[List[Tuple[int, int]], int, int]:
+        users = self._update()
+        start, end = _range(start, end)
+        return users, bisect_left(users, (start,)), bisect_left(users, (end,))
+
+    def between(self, start: Optional[int], end: Optional[int]) -> List[Tuple[int, int]]:
+        """
+        Returns the (user_id, expires) of the users whose access expires in [start, end), ordered by expiration.
+        """
+        users, low, high = self._slice(start, end)
+        return [(user_id, expires) for expires, user_id in users[low:high]]
+
+    def count_between(self, start: Optional[int], end: Optional[int]) -> int:
+        """
+        Returns the number of users whose access expires in [start, end).
+        """
+        _, low, high = self._slice(start, end)
+        return high - low
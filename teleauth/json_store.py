@@ -0,0 +1,404 @@
+import json
+import os
+import threading
+from datetime import datetime
+from time import time
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from teleauth.index import ExpiryIndex
+from teleauth.store import IStore, Scopes
+
+
+def _parse(expires: str) -> int:
+    """
+    Converts an expiration date as written in the JSON file (ISO 8601, local time) to an epoch timestamp.
+    """
+    return int(datetime.fromisoformat(expires).timestamp())
+
+
+def _format(expires: int) -> str:
+    """
+    Converts an epoch timestamp to the ISO 8601 local time written in the JSON file.
+    """
+    return datetime.fromtimestamp(expires).isoformat()
+
+
+def _parse_scopes(scopes: dict) -> Scopes:
+    return (scopes["mask"], {int(scope): _parse(expires) for scope, expires in scopes.get("expires", {}).items()})
+
+
+def _format_scopes(scopes: Scopes) -> dict:
+    return {"mask": scopes[0], "expires": {scope: _format(expires) for scope, expires in scopes[1].items()}}
+
+
+class JSONStore(IStore):
+    """
+    A store that keeps the users in a JSON file, rewritten on every change.
+
+    The file holds ISO 8601 expiration dates, but they are only parsed when the file is read and formatted when it
+    is written: in memory, `store` maps each user ID to its expiration timestamp, so lookups and listings never
+    touch a string. Scopes are kept apart from the users, in the "scopes" section of the file.
+
+    Each write replaces the file with the users of this process, so only one process may use the file at a time:
+    use SQLite to share the users between processes.
+    """
+
+    def __init__(self, authorized_admin_ids: List[int], filename:str="teleauth"):
+        super().__init__(authorized_admin_ids, filename)
+        # user_id -> expiration timestamp
+        self.store: Dict[int, int] = {}
+        # Serializes writes, so the file is never dumped while another thread changes the users
+        self._lock = threading.RLock()
+        # Admins authorized at runtime, persisted in the "admins" section of the file
+        self.admins = set()
+        # user_id -> scopes, persisted in the "scopes" section of the file
+        self.scopes: Dict[int, Scopes] = {}
+        # Users sorted by expiration, for listings and range queries
+        self._index = ExpiryIndex(lambda: self.store.items(), lambda user_id: self.store.get(user_id))
+        try:
+            self.store, self.admins, self.scopes = self._load()
+        except FileNotFoundError:
+            # Create an empty JSON file if it does not exist
+            self._dump(self.store, self.admins, self.scopes)
+        self.authorized_admin_ids.update(self.admins)
+
+    def _load(self) -> Tuple[Dict[int, int], Set[int], Dict[int, Scopes]]:
+        """
+        Reads the users, admins and scopes from the JSON file.
+
+        :return: The expiration timestamp of each user ID, the admins, and the scopes of each user ID.
+        """
+        with open(f"{self.filename}.json", "r") as f:
+            data = json.load(f)
+        if "users" in data:
+            users = data["users"]
+            admins = set(data.get("admins", []))
+            scopes = data.get("scopes", {})
+        else:
+            # Files written by older versions only hold the users
+            users = data
+            admins = set()
+            scopes = {}
+        # JSON object keys are always strings
+        return ({int(user_id): _parse(user["expires"]) for user_id, user in users.items()}, admins,
+                {int(user_id): _parse_scopes(user_scopes) for user_id, user_scopes in scopes.items()})
+    
+    def close(self):
+        with self._lock:
+            self._dump(self.store, self.admins, self.scopes)
+
+    def _dump(self, store: Dict[int, int], admins: Set[int], scopes: Dict[int, Scopes]):
+        """
+        Writes the users, admins and scopes to the JSON file. The data is written to a temporary file that then replaces
+        the previous one, so a crash in the middle of a write can't leave a truncated file behind.
+        
+        :param store: The expiration timestamp of each user to write.
+        :param admins: The admins to write.
+        :param scopes: The scopes of each user to write.
+        """
+        tmp_filename = f"{self.filename}.json.tmp"
+        with open(tmp_filename, "w") as f:
+            users = {user_id: {"expires": _format(expires)} for user_id, expires in store.items()}
+            user_scopes = {user_id: _format_scopes(granted) for user_id, granted in scopes.items()}
+            json.dump({"users": users, "admins": sorted(admins), "scopes": user_scopes}, f)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.replace(tmp_filename, f"{self.filename}.json")
+        if self.stats is not None:
+            self.stats.incr("commits")
+            self.stats.incr("bytes_written", size)
+    
+    def _save_admin(self, user_id: int):
+        with self._lock:
+            self.admins.add(user_id)
+            self.close()
+
+    def _delete_admin(self, user_id: int):
+        with self._lock:
+            if user_id in self.admins:
+                self.admins.discard(user_id)
+                self.close()
+
+    def is_authenticated(self, user_id: int) -> bool:
+        if self.is_admin(user_id):
+            return True
+
+        expires = self.store.get(user_id)
+        return expires is not None and expires > time()
+    
+    def authorize_user(self, user_id: int, days: int, hours: int):
+        expires = int(time()) + days * 86400 + hours * 3600
+        self.update_user(user_id, expires)
+    
+    def revoke_access(self, user_id: int):
+        with self._lock:
+            if user_id in self.store.keys():
+                self._index.changed((user_id,))
+                del self.store[user_id]
+                self.close()
+
+    def get_authorized_user(self, user_id: int) -> Tuple[int, int]:
+        expires = self.store.get(user_id)
+        if expires is None:
+            return None
+        return (user_id, expires)
+
+    def get_authorized_users(self) -> List[Tuple[int, int]]:
+        # Copying the items is atomic, iterating over the dict while another thread writes is not
+        users = list(self.store.items())
+        if self.stats is not None:
+            self.stats.incr("rows_scanned", len(users))
+        return users
+
+    def iter_authorized_users(self, batch_size: int=1000) -> Iterator[Tuple[int, int]]:
+        # Everything is in memory and already sorted, no need to paginate
+        return self.iter_expiring_between()
+
+    def iter_expiring_between(self, start: Optional[int]=None, end: Optional[int]=None,
+                              batch_size: int=1000) -> Iterator[Tuple[int, int]]:
+        with self._lock:
+            return iter(self._index.between(start, end))
+
+    def count_expiring_between(self, start: Optional[int]=None, end: Optional[int]=None) -> int:
+        with self._lock:
+            return self._index.count_between(start, end)
+
+    def insert_user(self, user_id: int, expires: int):
+        with self._lock:
+            self._index.changed((user_id,))
+            self.store[user_id] = expires
+            self.close()
+    
+    def update_user(self, user_id: int, expires: int):
+        self.insert_user(user_id, expires)
+
+    def revoke_many(self, user_ids: Iterable[int]):
+        user_ids = list(user_ids)
+        with self._lock:
+            self._index.changed(user_ids)
+            removed = False
+            for user_id in user_ids:
+                if self.store.pop(user_id, None) is not None:
+                    removed = True
+            if removed:
+                self.close()
+
+    def upsert_users_many(self, users: Iterable[Tuple[int, int]]):
+        users = list(users)
+        with self._lock:
+            self._index.changed(user_id for user_id, _ in users)
+            self.store.update(users)
+            self.close()
+
+    def get_scopes(self, user_id: int) -> Optional[Scopes]:
+        return self.scopes.get(user_id)
+
+    def iter_scopes(self) -> Iterator[Tuple[int, Scopes]]:
+        # Copying the items is atomic, iterating over the dict while another thread writes is not
+        return iter(list(self.scopes.items()))
+
+    def grant_scopes(self, user_id: int, scopes: int, expires: Optional[int]):
+        with self._lock:
+            super().grant_scopes(user_id, scopes, expires)
+
+    def revoke_scopes(self, user_id: int, scopes: int):
+        with self._lock:
+            super().revoke_scopes(user_id, scopes)
+
+    def _set_scopes(self, user_id: int, scopes: Optional[Scopes]):
+        if scopes is None:
+            if self.scopes.pop(user_id, None) is None:
+                return
+        else:
+            self.scopes[user_id] = scopes
+        self.close()
+
+    def upsert_scopes_many(self, scopes: Iterable[Tuple[int, Scopes]]):
+        scopes = list(scopes)
+        with self._lock:
+            self.scopes.update(scopes)
+            self.close()
+        
+
+
+class JournaledJSONStore(JSONStore):
+    """
+    A JSON store that appends each mutation as a JSON line to a journal instead of rewriting the whole file,
+    so the cost of a write doesn't depend on the number of users.
+
+    The journal is replayed on startup. Once it grows past `compact_threshold` bytes, it is compacted in a background
+    thread into a new snapshot of the JSON file, which replaces the previous one with an atomic rename.
+    """
+
+    def __init__(self, authorized_admin_ids: List[int], filename:str="teleauth", compact_threshold:int=1024 * 1024,
+                 fsync:bool=False):
+        """
+        Initializes a new instance of the JournaledJSONStore class.
+        
+        :param authorized_admin_ids: List of user ids that are authorized to use the bot as admins.
+        :param filename: storage filename
+        :param compact_threshold: The journal size, in bytes, that triggers a compaction. Default: 1 MiB
+        :param fsync: Whether to fsync the journal after each write, trading throughput for durability on power loss.
+        """
+        super().__init__(authorized_admin_ids, filename)
+        self.compact_threshold = compact_threshold
+        self.fsync = fsync
+        self.journal_filename = f"{self.filename}.journal"
+        self._compactor = None
+
+        # A journal left behind by an interrupted compaction is older than the current one
+        rotated = self._replay(f"{self.journal_filename}.compacting")
+        current = self._replay(self.journal_filename)
+        self.authorized_admin_ids = set(authorized_admin_ids) | self.admins
+        self._journal = open(self.journal_filename, "a")
+        self._journal_size = self._journal.tell()
+        if rotated is not None or current is False:
+            # Finish the interrupted compaction, or get rid of a partially written last line
+            self._write_snapshot(self._rotate())
+
+    def _replay(self, journal_filename: str):
+        """
+        Applies the mutations recorded in a journal file to the in-memory store.
+        
+        :param journal_filename: The journal to replay.
+        :return: None if the journal does not exist, False if it ends with a partially written line, True otherwise.
+        """
+        try:
+            f = open(journal_filename, "r")
+        except FileNotFoundError:
+            return None
+
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Only the last write can be partial, if the process crashed in the middle of it
+                    return False
+                self._apply(record)
+        return True
+
+    def _apply(self, record: dict):
+        if record["op"] in ("set", "del"):
+            self._index.changed((record["user_id"],))
+        if record["op"] == "set":
+            expires = record["expires"]
+            # Journals written by older versions hold ISO 8601 dates
+            self.store[record["user_id"]] = _parse(expires) if isinstance(expires, str) else expires
+        elif record["op"] == "del":
+            self.store.pop(record["user_id"], None)
+        elif record["op"] == "admin_add":
+            self.admins.add(record["user_id"])
+        elif record["op"] == "admin_del":
+            self.admins.discard(record["user_id"])
+        elif record["op"] == "scopes":
+            if record["mask"]:
+                # JSON object keys are always strings
+                self.scopes[record["user_id"]] = (record["mask"], {int(scope): expires
+                                                                    for scope, expires in record["expires"].items()})
+            else:
+                self.scopes.pop(record["user_id"], None)
+
+    def _append(self, records: List[dict]):
+        """
+        Applies the records to the in-memory store and appends them to the journal. Must be called with the lock held.
+        
+        :param records: The mutations to record.
+        """
+        for record in records:
+            self._apply(record)
+        data = "".join(json.dumps(record) + "\n" for record in records)
+        self._journal.write(data)
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self._journal_size += len(data)
+        if self.stats is not None:
+            self.stats.incr("commits")
+            self.stats.incr("bytes_written", len(data))
+
+        if self._journal_size >= self.compact_threshold and self._compactor is None:
+            snapshot = self._rotate()
+            self._compactor = threading.Thread(target=self._compact, args=(snapshot,), daemon=True)
+            self._compactor.start()
+
+    def _rotate(self) -> Tuple[Dict[int, int], Set[int], Dict[int, Scopes]]:
+        """
+        Moves the current journal aside and starts a new one. Must be called with the lock held.
+        
+        :return: A copy of the users, admins and scopes that includes every mutation of the rotated journal.
+        """
+        self._journal.close()
+        os.replace(self.journal_filename, f"{self.journal_filename}.compacting")
+        self._journal = open(self.journal_filename, "a")
+        self._journal_size = 0
+        # The scopes of a user are replaced, never changed in place, so a shallow copy is enough
+        return dict(self.store), set(self.admins), dict(self.scopes)
+
+    def _write_snapshot(self, snapshot: Tuple[Dict[int, int], Set[int], Dict[int, Scopes]]):
+        self._dump(*snapshot)
+        os.remove(f"{self.journal_filename}.compacting")
+
+    def _compact(self, snapshot: Tuple[Dict[int, int], Set[int], Dict[int, Scopes]]):
+        try:
+            self._write_snapshot(snapshot)
+        finally:
+            with self._lock:
+                self._compactor = None
+
+    def flush(self):
+        with self._lock:
+            if not self.fsync:
+                os.fsync(self._journal.fileno())
+
+    def close(self):
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        with self._lock:
+            self._write_snapshot(self._rotate())
+            self._journal.close()
+
+    def _save_admin(self, user_id: int):
+        with self._lock:
+            self._append([{"op": "admin_add", "user_id": user_id}])
+
+    def _delete_admin(self, user_id: int):
+        with self._lock:
+            if user_id in self.admins:
+                self._append([{"op": "admin_del", "user_id": user_id}])
+
+    def revoke_access(self, user_id: int):
+        with self._lock:
+            if user_id in self.store:
+                self._append([{"op": "del", "user_id": user_id}])
+
+    def insert_user(self, user_id: int, expires: int):
+        with self._lock:
+            self._append([{"op": "set", "user_id": user_id, "expires": expires}])
+
+    def revoke_many(self, user_ids: Iterable[int]):
+        with self._lock:
+            records = [{"op": "del", "user_id": user_id} for user_id in set(user_ids) if user_id in self.store]
+            if records:
+                self._append(records)
+
+    def upsert_users_many(self, users: Iterable[Tuple[int, int]]):
+        with self._lock:
+            records = [{"op": "set", "user_id": user_id, "expires": expires} for user_id, expires in users]
+            if records:
+                self._append(records)
+
+    def _set_scopes(self, user_id: int, scopes: Optional[Scopes]):
+        if scopes is None:
+            if user_id in self.scopes:
+                self._append([{"op": "scopes", "user_id": user_id, "mask": 0}])
+        else:
+            self._append([{"op": "scopes", "user_id": user_id, "mask": scopes[0], "expires": scopes[1]}])
+
+    def upsert_scopes_many(self, scopes: Iterable[Tuple[int, Scopes]]):
+        with self._lock:
+            records = [{"op": "scopes", "user_id": user_id, "mask": mask, "expires": expiries}
+                       for user_id, (mask, expiries) in scopes]
+            if records:
+                self._append(records)
@@ -0,0 +1,348 @@
+"""
+Streams users from one store to another, or to and from NDJSON and CSV files, in constant memory.
+
+Users are moved in batches, each written with a single `upsert_users_many` call (one transaction in SQLite,
+one file write in JSON). With a checkpoint file, the position of the last written batch is saved after each one,
+so an interrupted migration resumes where it stopped when run again with the same checkpoint.
+The scopes of the users are moved after them, in batches too: they are few, so they are simply moved again on resume.
+
+From the command line:
+
+    python -m teleauth.migration copy --from JSON:teleauth --to SQLITE:teleauth --checkpoint migration.json
+    python -m teleauth.migration export --from SQLITE:teleauth --output users.ndjson
+    python -m teleauth.migration import --to SQLITE_SHARDED:teleauth --input users.csv
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+from datetime import datetime
+from itertools import islice
+from time import perf_counter
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+from teleauth.store import Cursor, IStore, Scopes, StoreType
+
+# Formats of the exported files, by file extension
+FORMATS = {".ndjson": "ndjson", ".jsonl": "ndjson", ".csv": "csv"}
+# Users are written as "user_id,expires" rows, their scopes as "user_id,,scopes,scope_expires" rows
+CSV_HEADER = ["user_id", "expires", "scopes", "scope_expires"]
+
+
+class MigrationProgress(NamedTuple):
+    """
+    The progress of a migration, passed to the `progress` callback after each batch and returned at the end.
+    """
+    # Users written by this run (not counting the ones written before a resume)
+    users: int
+    seconds: float
+    # Users whose scopes were written by this run
+    scopes: int = 0
+
+    @property
+    def users_per_second(self) -> float:
+        return self.users / self.seconds if self.seconds else 0.0
+
+
+def _load_checkpoint(checkpoint: Optional[str]) -> Optional[dict]:
+    if checkpoint is None:
+        return None
+    try:
+        with open(checkpoint, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _save_checkpoint(checkpoint: Optional[str], state: dict):
+    """
+    Writes the checkpoint atomically, so a crash can't leave a truncated one behind.
+    """
+    if checkpoint is None:
+        return
+    with open(f"{checkpoint}.tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(f"{checkpoint}.tmp", checkpoint)
+
+
+def _remove_checkpoint(checkpoint: Optional[str]):
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+
+def _iter_users(store: IStore, after_cursor: Optional[Cursor], batch_size: int) -> Iterator[Tuple[int, int]]:
+    """
+    Iterates over the users of a store in (expires, user_id) order, starting after the cursor.
+    """
+    if after_cursor is None:
+        # Stores that keep everything in memory override this to avoid sorting once per page
+        yield from store.iter_authorized_users(batch_size)
+        return
+    cursor = after_cursor
+    while cursor is not None:
+        page, cursor = store.get_authorized_users_page(cursor, batch_size)
+        yield from page
+
+
+def _batches(users: Iterable, batch_size: int) -> Iterator[list]:
+    users = iter(users)
+    while True:
+        batch = list(islice(users, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def copy_store(source: IStore, target: IStore, batch_size: int=10000, checkpoint: Optional[str]=None,
+               progress: Optional[Callable[[MigrationProgress], None]]=None) -> MigrationProgress:
+    """
+    Copies the users, their scopes and the persisted admins of a store to another one, of any type.
+
+    :param source: The store to read from.
+    :param target: The store to write to. Users already in it are updated.
+    :param batch_size: The number of users (or users' scopes) written per batch. Default: 10000
+    :param checkpoint: A file where the position of the last batch is saved, to resume an interrupted copy.
+                       It is removed once the copy is complete.
+    :param progress: A function called with a `MigrationProgress` after each batch.
+    :return: The final progress.
+    """
+    state = _load_checkpoint(checkpoint)
+    cursor = None if state is None else tuple(state["cursor"])
+    start = perf_counter()
+    copied = 0
+
+    if state is None:
+        for user_id in source.authorized_admin_ids:
+            target.authorize_admin(user_id)
+    for batch in _batches(_iter_users(source, cursor, batch_size), batch_size):
+        target.upsert_users_many(batch)
+        target.flush()
+        user_id, expires = batch[-1]
+        _save_checkpoint(checkpoint, {"cursor": [expires, user_id]})
+        copied += len(batch)
+        if progress is not None:
+            progress(MigrationProgress(copied, perf_counter() - start))
+
+    scoped = 0
+    for batch in _batches(source.iter_scopes(), batch_size):
+        target.upsert_scopes_many(batch)
+        target.flush()
+        scoped += len(batch)
+        if progress is not None:
+            progress(MigrationProgress(copied, perf_counter() - start, scoped))
+
+    _remove_checkpoint(checkpoint)
+    return MigrationProgress(copied, perf_counter() - start, scoped)
+
+
+def _format(path: str, format: Optional[str]) -> str:
+    if format is None:
+        format = FORMATS.get(os.path.splitext(path)[1].lower())
+        if format is None:
+            raise ValueError(f"Can't tell the format of {path}, use one of: {', '.join(FORMATS)}")
+    if format not in FORMATS.values():
+        raise ValueError(f"Invalid format: {format}")
+    return format
+
+
+def export_users(store: IStore, path: str, format: Optional[str]=None, batch_size: int=10000,
+                 checkpoint: Optional[str]=None,
+                 progress: Optional[Callable[[MigrationProgress], None]]=None) -> MigrationProgress:
+    """
+    Writes the users of a store to a file, ordered by expiration date. Each user is written as
+    `{"user_id": ..., "expires": ...}` in NDJSON, or as a `user_id,expires` row in CSV, with the expiration date
+    in epoch seconds. Their scopes follow, as `{"user_id": ..., "scopes": ..., "scope_expires": {scope: expires}}`
+    in NDJSON, or as `user_id,,scopes,scope:expires scope:expires` rows in CSV. Admins are not exported.
+
+    :param store: The store to read from.
+    :param path: The file to write.
+    :param format: "ndjson" or "csv". Default: guessed from the file extension
+    :param batch_size: The number of users read from the store at a time. Default: 10000
+    :param checkpoint: A file where the position of the last batch is saved, to resume an interrupted export.
+    :param progress: A function called with a `MigrationProgress` after each batch.
+    :return: The final progress.
+    """
+    format = _format(path, format)
+    state = _load_checkpoint(checkpoint)
+    start = perf_counter()
+    exported = 0
+
+    with open(path, "a" if state is not None else "w", newline="") as f:
+        if state is None:
+            cursor = None
+            if format == "csv":
+                csv.writer(f).writerow(CSV_HEADER)
+        else:
+            cursor = tuple(state["cursor"])
+            # Drop whatever was written after the last checkpoint
+            f.truncate(state["offset"])
+            f.seek(state["offset"])
+
+        writer = csv.writer(f) if format == "csv" else None
+        for batch in _batches(_iter_users(store, cursor, batch_size), batch_size):
+            if writer is not None:
+                writer.writerows(batch)
+            else:
+                f.write("".join(json.dumps({"user_id": user_id, "expires": expires}) + "\n" for user_id, expires in batch))
+            f.flush()
+            user_id, expires = batch[-1]
+            _save_checkpoint(checkpoint, {"cursor": [expires, user_id], "offset": f.tell()})
+            exported += len(batch)
+            if progress is not None:
+                progress(MigrationProgress(exported, perf_counter() - start))
+
+        # Not checkpointed: a resumed export drops them and writes them all again after the last users
+        scoped = 0
+        for batch in _batches(store.iter_scopes(), batch_size):
+            if writer is not None:
+                writer.writerows([user_id, "", mask, " ".join(f"{scope}:{expires}" for scope, expires in expiries.items())]
+                                 for user_id, (mask, expiries) in batch)
+            else:
+                f.write("".join(json.dumps({"user_id": user_id, "scopes": mask, "scope_expires": expiries}) + "\n"
+                                for user_id, (mask, expiries) in batch))
+            scoped += len(batch)
+            if progress is not None:
+                progress(MigrationProgress(exported, perf_counter() - start, scoped))
+
+    _remove_checkpoint(checkpoint)
+    return MigrationProgress(exported, perf_counter() - start, scoped)
+
+
+def _parse_expires(expires) -> int:
+    """
+    Accepts epoch seconds, or ISO 8601 dates (local time) for files written by hand.
+    """
+    try:
+        return int(expires)
+    except ValueError:
+        return int(datetime.fromisoformat(expires).timestamp())
+
+
+def _parse_line(line: str, format: str) -> Optional[Tuple[int, Union[int, Scopes]]]:
+    """
+    Parses a line of an exported file.
+
+    :return: None for a blank line or the CSV header, otherwise the user ID and either an expiration timestamp
+             or the user's scopes.
+    """
+    if format == "csv":
+        row = next(csv.reader([line]))
+        # Files written by older versions only have the first two columns
+        if not row or row[:2] == CSV_HEADER[:2]:
+            return None
+        if len(row) > 2 and row[2]:
+            expiries = dict(item.split(":", 1) for item in row[3].split()) if len(row) > 3 else {}
+            return int(row[0]), (int(row[2]), {int(scope): _parse_expires(expires) for scope, expires in expiries.items()})
+        user_id, expires = row[:2]
+    else:
+        if not line.strip():
+            return None
+        record = json.loads(line)
+        if "scopes" in record:
+            expiries = record.get("scope_expires", {})
+            return record["user_id"], (record["scopes"], {int(scope): _parse_expires(expires)
+                                                          for scope, expires in expiries.items()})
+        user_id, expires = record["user_id"], record["expires"]
+    return int(user_id), _parse_expires(expires)
+
+
+def import_users(store: IStore, path: str, format: Optional[str]=None, batch_size: int=10000,
+                 checkpoint: Optional[str]=None,
+                 progress: Optional[Callable[[MigrationProgress], None]]=None) -> MigrationProgress:
+    """
+    Reads users and their scopes from a file written by `export_users` (or by hand, in the same format) into a store.
+    Users already in the store are updated, and their scopes replaced.
+
+    :param store: The store to write to.
+    :param path: The file to read.
+    :param format: "ndjson" or "csv". Default: guessed from the file extension
+    :param batch_size: The number of users written per batch. Default: 10000
+    :param checkpoint: A file where the position of the last batch is saved, to resume an interrupted import.
+    :param progress: A function called with a `MigrationProgress` after each batch.
+    :return: The final progress.
+    """
+    format = _format(path, format)
+    state = _load_checkpoint(checkpoint)
+    start = perf_counter()
+    imported = 0
+    scoped = 0
+
+    with open(path, "rb") as f:
+        if state is not None:
+            f.seek(state["offset"])
+        # Reading bytes line by line keeps the offset of each line known, for the checkpoint
+        lines = (line.decode("utf-8") for line in iter(f.readline, b""))
+        records = (record for record in (_parse_line(line, format) for line in lines) if record is not None)
+        for batch in _batches(records, batch_size):
+            users = [record for record in batch if isinstance(record[1], int)]
+            scopes = [record for record in batch if not isinstance(record[1], int)]
+            if users:
+                store.upsert_users_many(users)
+            if scopes:
+                store.upsert_scopes_many(scopes)
+            store.flush()
+            # The generators read exactly up to the last line of the batch
+            _save_checkpoint(checkpoint, {"offset": f.tell()})
+            imported += len(users)
+            scoped += len(scopes)
+            if progress is not None:
+                progress(MigrationProgress(imported, perf_counter() - start, scoped))
+
+    _remove_checkpoint(checkpoint)
+    return MigrationProgress(imported, perf_counter() - start, scoped)
+
+
+def _open_store(spec: str) -> IStore:
+    """
+    Opens a store described as "STORE_TYPE:filename", e.g. "SQLITE:teleauth".
+    """
+    from teleauth.auth import create_store
+
+    store_type, _, filename = spec.partition(":")
+    return create_store(StoreType[store_type.upper()], [], filename=filename or "teleauth")
+
+
+def _print_progress(progress: MigrationProgress):
+    print(f"\r{progress.users} users, {progress.users_per_second:.0f} users/s", end="", file=sys.stderr)
+
+
+def main(argv: List[str]=None):
+    parser = argparse.ArgumentParser(prog="python -m teleauth.migration",
+                                     description="Move teleauth users between stores and NDJSON/CSV files.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    copy = commands.add_parser("copy", help="copy the users, scopes and admins of a store to another one")
+    copy.add_argument("--from", dest="source", required=True, help='source store, e.g. "JSON:teleauth"')
+    copy.add_argument("--to", dest="target", required=True, help='target store, e.g. "SQLITE:teleauth"')
+    export = commands.add_parser("export", help="write the users and scopes of a store to a file")
+    export.add_argument("--from", dest="source", required=True, help='source store, e.g. "SQLITE:teleauth"')
+    export.add_argument("--output", required=True, help="an .ndjson or .csv file")
+    import_ = commands.add_parser("import", help="read users and scopes from a file into a store")
+    import_.add_argument("--to", dest="target", required=True, help='target store, e.g. "SQLITE:teleauth"')
+    import_.add_argument("--input", required=True, help="an .ndjson or .csv file")
+    for command in (copy, export, import_):
+        command.add_argument("--batch-size", type=int, default=10000, help="users per batch")
+        command.add_argument("--checkpoint", help="file used to resume an interrupted run")
+    args = parser.parse_args(argv)
+
+    options = {"batch_size": args.batch_size, "checkpoint": args.checkpoint, "progress": _print_progress}
+    stores = []
+    try:
+        if args.command == "copy":
+            stores = [_open_store(args.source), _open_store(args.target)]
+            result = copy_store(*stores, **options)
+        elif args.command == "export":
+            stores = [_open_store(args.source)]
+            result = export_users(stores[0], args.output, **options)
+        else:
+            stores = [_open_store(args.target)]
+            result = import_users(stores[0], args.input, **options)
+    finally:
+        for store in stores:
+            store.close()
+    print(f"\r{result.users} users and the scopes of {result.scopes} in {result.seconds:.1f}s "
+          f"({result.users_per_second:.0f} users/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
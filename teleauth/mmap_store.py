@@ -0,0 +1,336 @@
+import json
+import mmap
+import os
+import struct
+import threading
+from time import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from teleauth.index import ExpiryIndex
+from teleauth.store import IStore, Scopes
+
+# Each user is a fixed-width (int64 user_id, int64 expires) record, little-endian
+RECORD = struct.Struct("<qq")
+# File header: magic number and number of records
+HEADER = struct.Struct("<8sq")
+MAGIC = b"TAUTHMM1"
+# Expiration written to the append log for a revoked user
+TOMBSTONE = -2 ** 63
+
+
+class MMAPStore(IStore):
+    """
+    A compact store for millions of users.
+
+    Users are kept in a memory-mapped file as a sorted array of 16-byte `(user_id, expires)` records, so opening
+    the store doesn't parse anything and lookups are binary searches over the mapping. Recent writes go to a small
+    in-memory buffer, backed by an append-only log of records of the same format, and are merged into the array
+    once the buffer holds `merge_threshold` users.
+
+    Admins and scopes are few compared to users: they are kept in memory, and each change rewrites their own small
+    JSON file.
+    """
+
+    def __init__(self, authorized_admin_ids: List[int], filename:str="teleauth", merge_threshold:int=65536,
+                 fsync:bool=False):
+        """
+        Initializes a new instance of the MMAPStore class.
+
+        :param authorized_admin_ids: List of user ids that are authorized to use the bot as admins.
+        :param filename: storage filename
+        :param merge_threshold: The number of buffered writes that triggers a merge into the sorted array. Default: 65536
+        :param fsync: Whether to fsync the append log after each write, trading throughput for durability on power loss.
+        """
+        super().__init__(authorized_admin_ids, filename)
+        self.merge_threshold = merge_threshold
+        self.fsync = fsync
+        self.data_filename = f"{self.filename}.mmap"
+        self.log_filename = f"{self.filename}.mmap.log"
+        self.admins_filename = f"{self.filename}.mmap.admins"
+        self.scopes_filename = f"{self.filename}.mmap.scopes"
+        # user_id -> expiration timestamp, or None for a revoked user that may still be in the array
+        self._buffer = {}
+        self._lock = threading.RLock()
+        # The array is sorted by user ID: range queries over expiration dates use a sorted index built on demand
+        self._index = ExpiryIndex(self.get_authorized_users, self._lookup)
+
+        if not os.path.exists(self.data_filename):
+            self._write_array(self.data_filename, 0, b"")
+        self._base = self._map()
+        self._replay()
+        self._log = open(self.log_filename, "ab")
+
+        try:
+            with open(self.admins_filename, "r") as f:
+                self.admins = set(json.load(f))
+        except FileNotFoundError:
+            self.admins = set()
+        self.authorized_admin_ids.update(self.admins)
+
+        # user_id -> scopes
+        self.scopes: Dict[int, Scopes] = {}
+        try:
+            with open(self.scopes_filename, "r") as f:
+                # JSON object keys are always strings
+                self.scopes = {int(user_id): (mask, {int(scope): expires for scope, expires in expiries.items()})
+                               for user_id, (mask, expiries) in json.load(f).items()}
+        except FileNotFoundError:
+            pass
+
+    def _map(self) -> Tuple[Optional[mmap.mmap], int]:
+        """
+        Maps the data file.
+
+        :return: A tuple containing the mapping and the number of records in it.
+        """
+        with open(self.data_filename, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = HEADER.unpack_from(mapping, 0)
+        if magic != MAGIC:
+            mapping.close()
+            raise ValueError(f"{self.data_filename} is not a teleauth MMAP store")
+        return mapping, count
+
+    def _replay(self):
+        """
+        Loads the writes recorded in the append log into the buffer, dropping a partially written last record.
+        """
+        try:
+            with open(self.log_filename, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        complete = len(data) - len(data) % RECORD.size
+        for user_id, expires in RECORD.iter_unpack(data[:complete]):
+            self._buffer[user_id] = None if expires == TOMBSTONE else expires
+        if complete != len(data):
+            with open(self.log_filename, "r+b") as f:
+                f.truncate(complete)
+
+    @staticmethod
+    def _write_array(filename: str, count: int, records: bytes):
+        """
+        Writes a data file atomically: to a temporary file first, which then replaces the previous one.
+        """
+        tmp_filename = f"{filename}.tmp"
+        with open(tmp_filename, "wb") as f:
+            f.write(HEADER.pack(MAGIC, count))
+            f.write(records)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, filename)
+
+    def _search(self, user_id: int) -> Optional[int]:
+        """
+        Binary search of the sorted array.
+
+        :param user_id: The ID of the user to find.
+        :return: The expiration timestamp of the user, or None if the user is not in the array.
+        """
+        mapping, count = self._base
+        low, high = 0, count - 1
+        unpack_from = RECORD.unpack_from
+        while low <= high:
+            middle = (low + high) // 2
+            found_id, expires = unpack_from(mapping, HEADER.size + middle * RECORD.size)
+            if found_id < user_id:
+                low = middle + 1
+            elif found_id > user_id:
+                high = middle - 1
+            else:
+                return expires
+        return None
+
+    def _lookup(self, user_id: int) -> Optional[int]:
+        """
+        Returns the expiration timestamp of the specified user, looking at the recent writes first.
+
+        :param user_id: The user's ID
+        :return: The expiration timestamp, or None if the user is not in the store.
+        """
+        buffer = self._buffer
+        if user_id in buffer:
+            return buffer[user_id]
+        return self._search(user_id)
+
+    def _iter_array(self) -> Iterator[Tuple[int, int]]:
+        mapping, count = self._base
+        return RECORD.iter_unpack(mapping[HEADER.size:HEADER.size + count * RECORD.size])
+
+    def _write(self, users: Iterable[Tuple[int, Optional[int]]]):
+        """
+        Records writes in the append log and the buffer, merging the buffer into the array if it is full.
+
+        :param users: Tuples containing the user IDs and their expiration timestamps (None to revoke the user).
+        """
+        with self._lock:
+            data = bytearray()
+            for user_id, expires in users:
+                data += RECORD.pack(user_id, TOMBSTONE if expires is None else expires)
+                self._index.changed((user_id,))
+                self._buffer[user_id] = expires
+            if not data:
+                return
+            self._log.write(data)
+            self._log.flush()
+            if self.fsync:
+                os.fsync(self._log.fileno())
+            if self.stats is not None:
+                self.stats.incr("commits")
+                self.stats.incr("bytes_written", len(data))
+
+            if len(self._buffer) >= self.merge_threshold:
+                self.merge()
+
+    def merge(self):
+        """
+        Merges the buffered writes into a new sorted array, which replaces the previous one, and empties the log.
+        """
+        with self._lock:
+            if not self._buffer:
+                return
+
+            updates = iter(sorted(self._buffer.items()))
+            update = next(updates, None)
+            records = bytearray()
+            count = 0
+            pack = RECORD.pack
+            for user_id, expires in self._iter_array():
+                while update is not None and update[0] < user_id:
+                    if update[1] is not None:
+                        records += pack(*update)
+                        count += 1
+                    update = next(updates, None)
+                if update is not None and update[0] == user_id:
+                    user_id, expires = update
+                    update = next(updates, None)
+                    if expires is None:
+                        continue
+                records += pack(user_id, expires)
+                count += 1
+            while update is not None:
+                if update[1] is not None:
+                    records += pack(*update)
+                    count += 1
+                update = next(updates, None)
+
+            self._write_array(self.data_filename, count, records)
+            # Readers hold a reference to the previous mapping until they're done with it
+            self._base = self._map()
+            self._buffer = {}
+            self._log.close()
+            self._log = open(self.log_filename, "wb")
+            if self.stats is not None:
+                self.stats.incr("bytes_written", HEADER.size + len(records))
+
+    def flush(self):
+        with self._lock:
+            if not self.fsync:
+                os.fsync(self._log.fileno())
+
+    def close(self):
+        with self._lock:
+            self.merge()
+            self._log.close()
+
+    def _save_admin(self, user_id: int):
+        with self._lock:
+            self.admins.add(user_id)
+            self._write_admins()
+
+    def _delete_admin(self, user_id: int):
+        with self._lock:
+            if user_id in self.admins:
+                self.admins.discard(user_id)
+                self._write_admins()
+
+    def _write_admins(self):
+        tmp_filename = f"{self.admins_filename}.tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(sorted(self.admins), f)
+        os.replace(tmp_filename, self.admins_filename)
+
+    def _write_scopes(self):
+        tmp_filename = f"{self.scopes_filename}.tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump({user_id: [mask, expiries] for user_id, (mask, expiries) in self.scopes.items()}, f)
+        os.replace(tmp_filename, self.scopes_filename)
+
+    def get_scopes(self, user_id: int) -> Optional[Scopes]:
+        return self.scopes.get(user_id)
+
+    def iter_scopes(self) -> Iterator[Tuple[int, Scopes]]:
+        # Copying the items is atomic, iterating over the dict while another thread writes is not
+        return iter(list(self.scopes.items()))
+
+    def grant_scopes(self, user_id: int, scopes: int, expires: Optional[int]):
+        with self._lock:
+            super().grant_scopes(user_id, scopes, expires)
+
+    def revoke_scopes(self, user_id: int, scopes: int):
+        with self._lock:
+            super().revoke_scopes(user_id, scopes)
+
+    def _set_scopes(self, user_id: int, scopes: Optional[Scopes]):
+        if scopes is None:
+            if self.scopes.pop(user_id, None) is None:
+                return
+        else:
+            self.scopes[user_id] = scopes
+        self._write_scopes()
+
+    def upsert_scopes_many(self, scopes: Iterable[Tuple[int, Scopes]]):
+        scopes = list(scopes)
+        with self._lock:
+            self.scopes.update(scopes)
+            self._write_scopes()
+
+    def is_authenticated(self, user_id: int) -> bool:
+        if self.is_admin(user_id):
+            return True
+
+        expires = self._lookup(user_id)
+        return expires is not None and expires > time()
+
+    def authorize_user(self, user_id: int, days: int, hours: int):
+        self.update_user(user_id, int(time()) + days * 86400 + hours * 3600)
+
+    def revoke_access(self, user_id: int):
+        if self._lookup(user_id) is not None:
+            self._write([(user_id, None)])
+
+    def get_authorized_user(self, user_id: int) -> Tuple[int, int]:
+        expires = self._lookup(user_id)
+        if expires is None:
+            return None
+        return (user_id, expires)
+
+    def get_authorized_users(self) -> List[Tuple[int, int]]:
+        buffer = dict(self._buffer)
+        users = [(expires, user_id) for user_id, expires in self._iter_array() if user_id not in buffer]
+        users.extend((expires, user_id) for user_id, expires in buffer.items() if expires is not None)
+        if self.stats is not None:
+            self.stats.incr("rows_scanned", len(users))
+        users.sort()
+        return [(user_id, expires) for expires, user_id in users]
+
+    def iter_expiring_between(self, start: Optional[int]=None, end: Optional[int]=None,
+                              batch_size: int=1000) -> Iterator[Tuple[int, int]]:
+        with self._lock:
+            return iter(self._index.between(start, end))
+
+    def count_expiring_between(self, start: Optional[int]=None, end: Optional[int]=None) -> int:
+        with self._lock:
+            return self._index.count_between(start, end)
+
+    def insert_user(self, user_id: int, expires: int):
+        self._write([(user_id, expires)])
+
+    def update_user(self, user_id: int, expires: int):
+        self.insert_user(user_id, expires)
+
+    def revoke_many(self, user_ids: Iterable[int]):
+        self._write((user_id, None) for user_id in user_ids if self._lookup(user_id) is not None)
+
+    def upsert_users_many(self, users: Iterable[Tuple[int, int]]):
+        self._write(users)
@@ -0,0 +1,244 @@
+import heapq
+import os
+from collections import defaultdict
+from time import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from teleauth.sqlite_store import SQLiteStore
+from teleauth.store import Cursor, IStore, Scopes, _next_cursor
+
+# Files of a SQLite database in WAL mode
+DATABASE_SUFFIXES = (".db", ".db-wal", ".db-shm")
+
+
+def _by_expires(user: Tuple[int, int]) -> Tuple[int, int]:
+    user_id, expires = user
+    return (expires, user_id)
+
+
+class ShardedSQLiteStore(IStore):
+    """
+    A store that partitions the users across `shards` SQLite databases (`teleauth.0.db`, `teleauth.1.db`...)
+    by `user_id % shards`, so writes to different shards don't contend for the same lock and write throughput
+    grows with the number of shards.
+
+    Single-user operations go to one shard, batches are split per shard, and listings merge the shards on the
+    expiration timestamp. Admins are kept in the first shard. The number of shards is recorded in every database;
+    use `reshard` to change it.
+    """
+
+    def __init__(self, authorized_admin_ids: List[int], filename:str="teleauth", shards:int=4, **shard_options):
+        """
+        Initializes a new instance of the ShardedSQLiteStore class.
+
+        :param authorized_admin_ids: List of user ids that are authorized to use the bot as admins.
+        :param filename: storage filename, suffixed with the shard number
+        :param shards: The number of databases the users are partitioned across. Default: 4
+        :param shard_options: Extra keyword arguments for the `SQLiteStore` of each shard, such as `group_commit_interval`.
+        """
+        if shards < 1:
+            raise ValueError(f"Invalid number of shards: {shards}")
+        super().__init__(authorized_admin_ids, filename)
+        self.shards = [SQLiteStore(authorized_admin_ids if i == 0 else [], f"{filename}.{i}", **shard_options)
+                       for i in range(shards)]
+        for i, shard in enumerate(self.shards):
+            with shard._transaction() as conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS shard_info (shard INTEGER NOT NULL, shards INTEGER NOT NULL)")
+                row = conn.execute("SELECT shard, shards FROM shard_info").fetchone()
+                if row is None:
+                    conn.execute("INSERT INTO shard_info (shard, shards) VALUES (?, ?)", (i, shards))
+            if row is not None and row != (i, shards):
+                self.close()
+                raise ValueError(f"{shard.filename}.db is shard {row[0]} of {row[1]}, not {i} of {shards}; "
+                                 f"use teleauth.sharded_store.reshard to change the number of shards")
+        self.authorized_admin_ids = self.shards[0].authorized_admin_ids
+
+    @property
+    def stats(self):
+        return self.shards[0].stats
+
+    @stats.setter
+    def stats(self, stats):
+        # The shards count commits and scanned rows on it
+        for shard in self.shards:
+            shard.stats = stats
+
+    def _shard(self, user_id: int) -> SQLiteStore:
+        return self.shards[user_id % len(self.shards)]
+
+    def _split(self, items: Iterable, user_id: Callable = lambda item: item) -> Dict[SQLiteStore, list]:
+        """
+        Groups the items of a batch by the shard of their user.
+        """
+        groups = defaultdict(list)
+        for item in items:
+            groups[self._shard(user_id(item))].append(item)
+        return groups
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    def flush(self):
+        for shard in self.shards:
+            shard.flush()
+
+    def _save_admin(self, user_id: int):
+        self.shards[0]._save_admin(user_id)
+
+    def _delete_admin(self, user_id: int):
+        self.shards[0]._delete_admin(user_id)
+
+    def is_authenticated(self, user_id: int) -> bool:
+        if self.is_admin(user_id):
+            return True
+        return self._shard(user_id).is_authenticated(user_id)
+
+    def authorize_user(self, user_id: int, days: int, hours: int):
+        self._shard(user_id).authorize_user(user_id, days, hours)
+
+    def revoke_access(self, user_id: int):
+        self._shard(user_id).revoke_access(user_id)
+
+    def get_authorized_user(self, user_id: int) -> Tuple[int, int]:
+        return self._shard(user_id).get_authorized_user(user_id)
+
+    def get_authorized_users(self) -> List[Tuple[int, int]]:
+        # Each shard is already sorted by expiration
+        return list(heapq.merge(*(shard.get_authorized_users() for shard in self.shards), key=_by_expires))
+
+    def insert_user(self, user_id: int, expires: int):
+        self._shard(user_id).insert_user(user_id, expires)
+
+    def update_user(self, user_id: int, expires: int):
+        self._shard(user_id).update_user(user_id, expires)
+
+    def is_authenticated_many(self, user_ids: Iterable[int]) -> Dict[int, bool]:
+        result = {}
+        pending = []
+        for user_id in user_ids:
+            # Admins are only persisted in the first shard, so other shards don't know them
+            if self.is_admin(user_id):
+                result[user_id] = True
+            else:
+                pending.append(user_id)
+        for shard, group in self._split(pending).items():
+            result.update(shard.is_authenticated_many(group))
+        return result
+
+    def authorize_users_many(self, user_ids: Iterable[int], days: int, hours: int):
+        expires = int(time()) + days * 86400 + hours * 3600
+        self.upsert_users_many((user_id, expires) for user_id in user_ids)
+
+    def revoke_many(self, user_ids: Iterable[int]):
+        for shard, group in self._split(user_ids).items():
+            shard.revoke_many(group)
+
+    def upsert_users_many(self, users: Iterable[Tuple[int, int]]):
+        for shard, group in self._split(users, lambda user: user[0]).items():
+            shard.upsert_users_many(group)
+
+    def get_authorized_users_page(self, after_cursor: Optional[Cursor]=None, limit: int=100) -> Tuple[List[Tuple[int, int]], Optional[Cursor]]:
+        # The page is among the first `limit` users of each shard after the cursor
+        pages = (shard.get_authorized_users_page(after_cursor, limit)[0] for shard in self.shards)
+        page = list(heapq.merge(*pages, key=_by_expires))[:limit]
+        return page, _next_cursor(page, limit)
+
+    def iter_authorized_users(self, batch_size: int=1000) -> Iterator[Tuple[int, int]]:
+        return heapq.merge(*(shard.iter_authorized_users(batch_size) for shard in self.shards), key=_by_expires)
+
+    def iter_expiring_between(self, start: Optional[int]=None, end: Optional[int]=None,
+                              batch_size: int=1000) -> Iterator[Tuple[int, int]]:
+        return heapq.merge(*(shard.iter_expiring_between(start, end, batch_size) for shard in self.shards),
+                           key=_by_expires)
+
+    def count_expiring_between(self, start: Optional[int]=None, end: Optional[int]=None) -> int:
+        return sum(shard.count_expiring_between(start, end) for shard in self.shards)
+
+    def get_scopes(self, user_id: int) -> Optional[Scopes]:
+        return self._shard(user_id).get_scopes(user_id)
+
+    def iter_scopes(self) -> Iterator[Tuple[int, Scopes]]:
+        return heapq.merge(*(shard.iter_scopes() for shard in self.shards), key=lambda item: item[0])
+
+    def upsert_scopes_many(self, scopes: Iterable[Tuple[int, Scopes]]):
+        for shard, group in self._split(scopes, lambda item: item[0]).items():
+            shard.upsert_scopes_many(group)
+
+    def grant_scopes(self, user_id: int, scopes: int, expires: Optional[int]):
+        self._shard(user_id).grant_scopes(user_id, scopes, expires)
+
+    def revoke_scopes(self, user_id: int, scopes: int):
+        self._shard(user_id).revoke_scopes(user_id, scopes)
+
+    def next_expiry(self) -> Optional[int]:
+        return min((expires for expires in (shard.next_expiry() for shard in self.shards) if expires is not None),
+                   default=None)
+
+    def purge_expired(self, before: int, limit: int) -> List[int]:
+        # Each shard purges its share of the `limit` oldest expired users across all shards
+        pages = (shard.get_authorized_users_page(None, limit)[0] for shard in self.shards)
+        oldest = [user_id for user_id, expires in heapq.merge(*pages, key=_by_expires) if expires <= before][:limit]
+        purged = set()
+        for shard, group in self._split(oldest).items():
+            purged.update(shard.purge_expired(before, len(group)))
+        return [user_id for user_id in oldest if user_id in purged]
+
+def reshard(filename: str="teleauth", shards: int=4, new_shards: int=8, batch_size: int=10000,
+            progress: Optional[Callable[[int], None]]=None) -> int:
+    """
+    Changes the number of shards of a `ShardedSQLiteStore`, offline: no process may use the store meanwhile.
+
+    The users are copied in batches to new databases, which replace the old ones once every user was copied.
+    Their scopes are copied last, one transaction per shard.
+    If the copy is interrupted, the old databases are left untouched and resharding can simply be started again.
+    Back up the databases first: a crash while they are being replaced leaves a mix of old and new shards.
+
+    :param filename: storage filename
+    :param shards: The current number of shards.
+    :param new_shards: The new number of shards.
+    :param batch_size: The number of users copied per transaction. Default: 10000
+    :param progress: A function called with the number of users copied so far after each batch.
+    :return: The number of users copied.
+    """
+    tmp_filename = f"{filename}.resharding"
+    for i in range(new_shards):
+        for suffix in DATABASE_SUFFIXES:
+            if os.path.exists(f"{tmp_filename}.{i}{suffix}"):
+                os.remove(f"{tmp_filename}.{i}{suffix}")
+
+    source = ShardedSQLiteStore([], filename, shards)
+    try:
+        target = ShardedSQLiteStore(source.authorized_admin_ids, tmp_filename, new_shards)
+        try:
+            for user_id in source.authorized_admin_ids:
+                target._save_admin(user_id)
+            copied = 0
+            cursor = None
+            while True:
+                page, cursor = source.get_authorized_users_page(cursor, batch_size)
+                target.upsert_users_many(page)
+                copied += len(page)
+                if progress is not None and page:
+                    progress(copied)
+                if cursor is None:
+                    break
+            for shard in source.shards:
+                rows = shard.conn.execute("SELECT user_id, mask, expiries FROM scopes").fetchall()
+                for target_shard, group in target._split(rows, lambda row: row[0]).items():
+                    with target_shard._transaction() as conn:
+                        conn.executemany("INSERT INTO scopes (user_id, mask, expiries) VALUES (?, ?, ?)", group)
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+    # The old WAL files must go before the databases are replaced, or SQLite would apply them to the new ones
+    for i in range(shards):
+        for suffix in reversed(DATABASE_SUFFIXES):
+            if os.path.exists(f"{filename}.{i}{suffix}"):
+                os.remove(f"{filename}.{i}{suffix}")
+    for i in range(new_shards):
+        for suffix in DATABASE_SUFFIXES:
+            if os.path.exists(f"{tmp_filename}.{i}{suffix}"):
+                os.replace(f"{tmp_filename}.{i}{suffix}", f"{filename}.{i}{suffix}")
+    return copied
@@ -0,0 +1,560 @@
+import struct
+import threading
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from time import monotonic, sleep, time
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from teleauth.store import Cursor, IStore, Scopes, StoreType, STORE_CLASSES, _grant_scopes, _revoke_scopes
+
+# Segment header: magic number, sequence number, number of slots, live users, used slots (live or deleted), admins
+HEADER = struct.Struct("<8sQQQQQ")
+MAGIC = b"TAUTHSM1"
+SEQUENCE = struct.Struct("<Q")
+SEQUENCE_OFFSET = 8
+# Admins are stored right after the header, as a plain array of int64
+ADMIN = struct.Struct("<q")
+MAX_ADMINS = 256
+# Users are stored in an open-addressing hash table of (int64 user_id, int64 expires) slots
+SLOT = struct.Struct("<qq")
+TABLE_OFFSET = HEADER.size + MAX_ADMINS * ADMIN.size
+EMPTY = -2 ** 63
+DELETED = EMPTY + 1
+# Fibonacci hashing multiplier
+MULTIPLIER = 0x9E3779B97F4A7C15
+# The scopes follow the table: a version bumped on every change and the length of the records, then for each user
+# with scopes a (user_id, mask, number of expiring scopes) record followed by that many (scope, expires) records
+SCOPES_HEADER = struct.Struct("<QQ")
+SCOPE_USER = struct.Struct("<qqq")
+SCOPE_EXPIRY = struct.Struct("<qq")
+
+
+def _pack_scopes(scopes: Dict[int, Scopes]) -> bytes:
+    data = bytearray()
+    for user_id, (mask, expiries) in scopes.items():
+        data += SCOPE_USER.pack(user_id, mask, len(expiries))
+        for scope, expires in expiries.items():
+            data += SCOPE_EXPIRY.pack(scope, expires)
+    return bytes(data)
+
+
+def _unpack_scopes(data: bytes) -> Dict[int, Scopes]:
+    scopes = {}
+    offset = 0
+    while offset < len(data):
+        user_id, mask, count = SCOPE_USER.unpack_from(data, offset)
+        offset += SCOPE_USER.size
+        expiries = dict(SCOPE_EXPIRY.unpack_from(data, offset + i * SCOPE_EXPIRY.size) for i in range(count))
+        offset += count * SCOPE_EXPIRY.size
+        scopes[user_id] = (mask, expiries)
+    return scopes
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    Attaches to an existing segment without registering it with the resource tracker, which would otherwise
+    unlink it as soon as this process exits, even though other processes are still using it.
+    """
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # Python < 3.13
+        segment = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+def _unlink(segment: shared_memory.SharedMemory):
+    """
+    Removes a segment that isn't registered with the resource tracker (see `_attach`).
+    """
+    # `unlink` unregisters the segment, which the resource tracker reports as an error if it wasn't registered
+    resource_tracker.register(segment._name, "shared_memory")
+    segment.unlink()
+
+
+class SharedMemoryStore(IStore):
+    """
+    Shares the authentication state of several processes through a shared-memory segment.
+
+    Exactly one process opens the store with `owner=True`: it persists every change in a backing store and mirrors
+    it into the segment. Every other process opens it with `owner=False` and only reads the segment, so
+    `is_authenticated` is a lock-free memory read: readers never block the owner and retry if they raced a write
+    (a seqlock). Writes made in a reader process raise `PermissionError`.
+
+    Scopes are mirrored in the segment too, after the users, within `scopes_bytes` bytes. Scope changes are rare, so
+    each one rewrites them all, and readers only parse them again when they changed.
+
+    The segment is a hash table sized for `capacity` users, and outlives the processes using it, so an owner restart
+    doesn't disturb the readers, even if the previous owner died in the middle of a write. Readers give up with
+    `TimeoutError` if the segment stays locked for `read_timeout` seconds. Call `unlink` to remove it when
+    the deployment shuts down.
+    """
+
+    def __init__(self, authorized_admin_ids: List[int], filename:str="teleauth", name:str="teleauth",
+                 owner:bool=True, capacity:int=1000000, backend:StoreType=StoreType.SQLITE,
+                 backend_options:Optional[dict]=None, read_timeout:float=10.0, scopes_bytes:int=1024 * 1024):
+        """
+        Initializes a new instance of the SharedMemoryStore class.
+
+        :param authorized_admin_ids: List of user ids that are authorized to use the bot as admins.
+        :param filename: storage filename of the backing store (owner only)
+        :param name: The name of the shared-memory segment, which must be the same in every process.
+        :param owner: Whether this process writes. Readers must be started after the owner.
+        :param capacity: The maximum number of users (owner only). Default: 1000000
+        :param backend: The store type that persists the users (owner only). Default: `SQLITE`
+        :param backend_options: Extra keyword arguments for the backing store (owner only).
+        :param read_timeout: The maximum time, in seconds, a read waits for a write to finish, e.g. while the owner
+                             loads the users on startup. Default: 10
+        :param scopes_bytes: The space reserved for the scopes (owner only), 24 bytes per user with scopes plus
+                             16 bytes per scope that expires. Default: 1 MiB
+        """
+        self.filename = filename
+        self.name = name
+        self.owner = owner
+        self.read_timeout = read_timeout
+        self._local_admins = set(authorized_admin_ids)
+        # Serializes the owner's writes; readers never take it
+        self._lock = threading.RLock()
+        # The scopes last parsed by a reader, and their version
+        self._scopes_version = None
+        self._scopes = {}
+
+        if owner:
+            self.backend = STORE_CLASSES[backend](authorized_admin_ids, filename=filename, **(backend_options or {}))
+            slots = 1 << max(4, (2 * capacity - 1).bit_length())
+            self.capacity = capacity
+            self._segment = self._create(slots, scopes_bytes)
+            self._buf = self._segment.buf
+            self._slots = slots
+            self._shift = 64 - (slots.bit_length() - 1)
+            self._locate_scopes()
+            # A previous owner that died in the middle of a write left the sequence number odd: make it even again,
+            # or every write from now on would leave it odd too
+            sequence = SEQUENCE.unpack_from(self._buf, SEQUENCE_OFFSET)[0]
+            if sequence & 1:
+                SEQUENCE.pack_into(self._buf, SEQUENCE_OFFSET, sequence + 1)
+            self._load()
+        else:
+            self.backend = None
+            self._segment = _attach(name)
+            self._buf = self._segment.buf
+            magic, _, self._slots, _, _, _ = HEADER.unpack_from(self._buf, 0)
+            if magic != MAGIC:
+                raise ValueError(f"Shared memory segment {name} is not a teleauth store")
+            self.capacity = self._slots // 2
+            self._shift = 64 - (self._slots.bit_length() - 1)
+            self._locate_scopes()
+
+    def _locate_scopes(self):
+        self._scopes_offset = TABLE_OFFSET + self._slots * SLOT.size
+        # The segment may be larger than requested (e.g. rounded up to a page, or left by an owner that reserved more)
+        self.scopes_bytes = self._segment.size - self._scopes_offset - SCOPES_HEADER.size
+
+    def _create(self, slots: int, scopes_bytes: int) -> shared_memory.SharedMemory:
+        """
+        Creates the segment, or reuses the one left by a previous owner if it has the same number of slots (and room
+        for the scopes), so readers that are already attached keep seeing the changes.
+        """
+        size = TABLE_OFFSET + slots * SLOT.size + SCOPES_HEADER.size + scopes_bytes
+        try:
+            segment = shared_memory.SharedMemory(self.name, create=True, size=size)
+        except FileExistsError:
+            segment = _attach(self.name)
+            if segment.size >= size and HEADER.unpack_from(segment.buf, 0)[2] == slots:
+                return segment
+            segment.close()
+            _unlink(segment)
+            segment = shared_memory.SharedMemory(self.name, create=True, size=size)
+        # The segment must survive this process, e.g. while the owner restarts
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+    def _load(self):
+        """
+        Copies the users, admins and scopes of the backing store into the segment.
+        """
+        scopes = dict(self.backend.iter_scopes())
+        data = self._check_scopes(scopes)
+        admins = self._check_admins(self.backend.authorized_admin_ids)
+        users = self.backend.get_authorized_users()
+        with self._writing():
+            HEADER.pack_into(self._buf, 0, MAGIC, SEQUENCE.unpack_from(self._buf, SEQUENCE_OFFSET)[0],
+                             self._slots, 0, 0, 0)
+            self._buf[TABLE_OFFSET:TABLE_OFFSET + self._slots * SLOT.size] = SLOT.pack(EMPTY, 0) * self._slots
+            self._write_admins(admins)
+            self._set_many(users)
+            self._write_scopes(data)
+        self._scopes = scopes
+
+    @contextmanager
+    def _writing(self):
+        """
+        Makes the sequence number odd for the duration of a write, so readers retry instead of reading a half-written state.
+        Only changes to the segment itself go in it: the backing store is written before, so readers never wait for
+        the disk.
+        """
+        with self._lock:
+            sequence = SEQUENCE.unpack_from(self._buf, SEQUENCE_OFFSET)[0]
+            SEQUENCE.pack_into(self._buf, SEQUENCE_OFFSET, sequence + 1)
+            try:
+                yield
+            finally:
+                SEQUENCE.pack_into(self._buf, SEQUENCE_OFFSET, sequence + 2)
+
+    def _read(self, func, *args):
+        """
+        Calls `func` until it ran without any write happening at the same time.
+        """
+        buf = self._buf
+        unpack_from = SEQUENCE.unpack_from
+        deadline = None
+        while True:
+            sequence = unpack_from(buf, SEQUENCE_OFFSET)[0]
+            if not sequence & 1:
+                result = func(*args)
+                if unpack_from(buf, SEQUENCE_OFFSET)[0] == sequence:
+                    return result
+            # Only look at the clock once a read had to be retried, so the common case stays a plain memory read
+            if deadline is None:
+                deadline = monotonic() + self.read_timeout
+            elif monotonic() > deadline:
+                raise TimeoutError(f"The shared memory store {self.name} has been locked for more than "
+                                   f"{self.read_timeout} seconds, its owner may have died in the middle of a write")
+            sleep(0)
+
+    def _check_owner(self):
+        if not self.owner:
+            raise PermissionError(f"Only the owner of the shared memory store {self.name} can write to it")
+
+    def _probe(self, user_id: int) -> Tuple[int, Optional[int]]:
+        """
+        Finds the slot of a user.
+
+        :param user_id: The user's ID
+        :return: The index of the slot holding the user, or of the first free slot, and the user's expiration timestamp
+                 (None if the user isn't in the table).
+        """
+        buf = self._buf
+        mask = self._slots - 1
+        index = ((user_id * MULTIPLIER) & 0xFFFFFFFFFFFFFFFF) >> self._shift
+        free = None
+        unpack_from = SLOT.unpack_from
+        # Bounded, in case a concurrent write left the table in an inconsistent state
+        for _ in range(self._slots):
+            found_id, expires = unpack_from(buf, TABLE_OFFSET + index * SLOT.size)
+            if found_id == user_id:
+                return index, expires
+            if found_id == EMPTY:
+                return (index if free is None else free), None
+            if found_id == DELETED and free is None:
+                free = index
+            index = (index + 1) & mask
+        return free, None
+
+    def _expires(self, user_id: int) -> Optional[int]:
+        return self._probe(user_id)[1]
+
+    def _set_many(self, users: Iterable[Tuple[int, Optional[int]]], only_existing: bool=False):
+        """
+        Writes users into the table. Must be called within `_writing`.
+
+        :param users: Tuples containing the user IDs and their expiration timestamps (None to remove the user).
+        :param only_existing: Whether to skip users that aren't already in the table.
+        """
+        buf = self._buf
+        _, _, slots, count, used, admins = HEADER.unpack_from(buf, 0)
+        for user_id, expires in users:
+            index, current = self._probe(user_id)
+            if expires is None:
+                if current is not None:
+                    SLOT.pack_into(buf, TABLE_OFFSET + index * SLOT.size, DELETED, 0)
+                    count -= 1
+            elif current is not None:
+                SLOT.pack_into(buf, TABLE_OFFSET + index * SLOT.size, user_id, expires)
+            elif not only_existing:
+                if used >= self.capacity:
+                    HEADER.pack_into(buf, 0, MAGIC, SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)[0], slots, count, used, admins)
+                    self._rehash()
+                    _, _, slots, count, used, admins = HEADER.unpack_from(buf, 0)
+                    if used >= self.capacity:
+                        raise ValueError(f"The shared memory store {self.name} is full ({self.capacity} users)")
+                    index, _ = self._probe(user_id)
+                if SLOT.unpack_from(buf, TABLE_OFFSET + index * SLOT.size)[0] == EMPTY:
+                    used += 1
+                SLOT.pack_into(buf, TABLE_OFFSET + index * SLOT.size, user_id, expires)
+                count += 1
+        HEADER.pack_into(buf, 0, MAGIC, SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)[0], slots, count, used, admins)
+
+    def _check_capacity(self, users: Iterable[Tuple[int, int]]):
+        """
+        Raises `ValueError` if the users that aren't in the table yet don't fit in it, before anything is written to
+        the backing store. Must be called with the lock held.
+        """
+        count = HEADER.unpack_from(self._buf, 0)[3]
+        new = {user_id for user_id, _ in users if self._expires(user_id) is None}
+        if count + len(new) > self.capacity:
+            raise ValueError(f"The shared memory store {self.name} is full ({self.capacity} users)")
+
+    def _rehash(self):
+        """
+        Rebuilds the table without the slots of removed users. Must be called within `_writing`.
+        """
+        users = self._users()
+        self._buf[TABLE_OFFSET:TABLE_OFFSET + self._slots * SLOT.size] = SLOT.pack(EMPTY, 0) * self._slots
+        _, sequence, slots, _, _, admins = HEADER.unpack_from(self._buf, 0)
+        HEADER.pack_into(self._buf, 0, MAGIC, sequence, slots, 0, 0, admins)
+        self._set_many(users)
+
+    def _users(self) -> List[Tuple[int, int]]:
+        table = bytes(self._buf[TABLE_OFFSET:TABLE_OFFSET + self._slots * SLOT.size])
+        return [(user_id, expires) for user_id, expires in SLOT.iter_unpack(table) if user_id > DELETED]
+
+    def _check_admins(self, admins: Iterable[int]) -> List[int]:
+        """
+        Sorts the admins, raising `ValueError` if they don't fit in the segment.
+        """
+        admins = sorted(admins)
+        if len(admins) > MAX_ADMINS:
+            raise ValueError(f"The shared memory store {self.name} can't hold more than {MAX_ADMINS} admins")
+        return admins
+
+    def _write_admins(self, admins: List[int]):
+        """
+        Replaces the admins of the segment. Must be called within `_writing`.
+        """
+        for i, user_id in enumerate(admins):
+            ADMIN.pack_into(self._buf, HEADER.size + i * ADMIN.size, user_id)
+        fields = list(HEADER.unpack_from(self._buf, 0))
+        fields[-1] = len(admins)
+        HEADER.pack_into(self._buf, 0, *fields)
+
+    def _check_scopes(self, scopes: Dict[int, Scopes]) -> bytes:
+        """
+        Packs the scopes, raising `ValueError` if they don't fit in the segment.
+        """
+        data = _pack_scopes(scopes)
+        if len(data) > self.scopes_bytes:
+            raise ValueError(f"The scopes don't fit in the shared memory store {self.name} ({self.scopes_bytes} bytes)")
+        return data
+
+    def _write_scopes(self, data: bytes):
+        """
+        Replaces the scopes of the segment. Must be called within `_writing`.
+        """
+        version = SCOPES_HEADER.unpack_from(self._buf, self._scopes_offset)[0]
+        SCOPES_HEADER.pack_into(self._buf, self._scopes_offset, version + 1, len(data))
+        start = self._scopes_offset + SCOPES_HEADER.size
+        self._buf[start:start + len(data)] = data
+
+    def _scopes_header(self) -> Tuple[int, int]:
+        return SCOPES_HEADER.unpack_from(self._buf, self._scopes_offset)
+
+    def _scopes_data(self) -> Tuple[int, bytes]:
+        version, length = SCOPES_HEADER.unpack_from(self._buf, self._scopes_offset)
+        start = self._scopes_offset + SCOPES_HEADER.size
+        return version, bytes(self._buf[start:start + min(length, self.scopes_bytes)])
+
+    def _reader_scopes(self) -> Dict[int, Scopes]:
+        """
+        Returns the scopes of the segment, parsing them again only if they changed since the last call.
+        """
+        if self._read(self._scopes_header)[0] != self._scopes_version:
+            version, data = self._read(self._scopes_data)
+            self._scopes = _unpack_scopes(data)
+            self._scopes_version = version
+        return self._scopes
+
+    def _admins(self) -> Set[int]:
+        count = HEADER.unpack_from(self._buf, 0)[-1]
+        return {ADMIN.unpack_from(self._buf, HEADER.size + i * ADMIN.size)[0] for i in range(count)}
+
+    @property
+    def authorized_admin_ids(self) -> Set[int]:
+        if self.owner:
+            return self.backend.authorized_admin_ids
+        return self._local_admins | self._read(self._admins)
+
+    def close(self):
+        """
+        Closes the backing store and detaches from the segment, which is left for the other processes.
+        """
+        with self._lock:
+            if self.backend is not None:
+                self.backend.close()
+            self._buf = None
+            self._segment.close()
+
+    def flush(self):
+        if self.backend is not None:
+            self.backend.flush()
+
+    def unlink(self):
+        """
+        Removes the shared-memory segment. Processes that are still attached keep their mapping until they close it.
+        """
+        _unlink(self._segment)
+
+    def is_admin(self, user_id: int) -> bool:
+        if self.owner:
+            return self.backend.is_admin(user_id)
+        return user_id in self._local_admins or user_id in self._read(self._admins)
+
+    def authorize_admin(self, user_id):
+        self._check_owner()
+        with self._lock:
+            admins = self._check_admins(self.backend.authorized_admin_ids | {user_id})
+            self.backend.authorize_admin(user_id)
+            with self._writing():
+                self._write_admins(admins)
+
+    def revoke_admin(self, user_id):
+        self._check_owner()
+        with self._lock:
+            self.backend.revoke_admin(user_id)
+            admins = self._check_admins(self.backend.authorized_admin_ids)
+            with self._writing():
+                self._write_admins(admins)
+
+    def is_authenticated(self, user_id: int) -> bool:
+        if self.is_admin(user_id):
+            return True
+
+        expires = self._read(self._expires, user_id)
+        return expires is not None and expires > time()
+
+    def is_authenticated_many(self, user_ids: Iterable[int]) -> Dict[int, bool]:
+        return {user_id: self.is_authenticated(user_id) for user_id in user_ids}
+
+    def authorize_user(self, user_id: int, days: int, hours: int):
+        self.upsert_users_many([(user_id, int(time()) + days * 86400 + hours * 3600)])
+
+    def authorize_users_many(self, user_ids: Iterable[int], days: int, hours: int):
+        expires = int(time()) + days * 86400 + hours * 3600
+        self.upsert_users_many((user_id, expires) for user_id in user_ids)
+
+    def revoke_access(self, user_id: int):
+        self.revoke_many([user_id])
+
+    def revoke_many(self, user_ids: Iterable[int]):
+        self._check_owner()
+        user_ids = list(user_ids)
+        with self._lock:
+            self.backend.revoke_many(user_ids)
+            with self._writing():
+                self._set_many((user_id, None) for user_id in user_ids)
+
+    def insert_user(self, user_id: int, expires: int):
+        self._check_owner()
+        # The lock is reentrant: the capacity can't change between the check and the write
+        with self._lock:
+            self._check_capacity([(user_id, expires)])
+            self.backend.insert_user(user_id, expires)
+            with self._writing():
+                self._set_many([(user_id, expires)])
+
+    def update_user(self, user_id: int, expires: int):
+        self._check_owner()
+        with self._lock:
+            self.backend.update_user(user_id, expires)
+            with self._writing():
+                self._set_many([(user_id, expires)], only_existing=True)
+
+    def upsert_users_many(self, users: Iterable[Tuple[int, int]]):
+        self._check_owner()
+        users = list(users)
+        with self._lock:
+            self._check_capacity(users)
+            self.backend.upsert_users_many(users)
+            with self._writing():
+                self._set_many(users)
+
+    def purge_expired(self, before: int, limit: int) -> List[int]:
+        self._check_owner()
+        with self._lock:
+            purged = self.backend.purge_expired(before, limit)
+            with self._writing():
+                self._set_many((user_id, None) for user_id in purged)
+        return purged
+
+    def get_scopes(self, user_id: int) -> Optional[Scopes]:
+        if self.owner:
+            return self.backend.get_scopes(user_id)
+        return self._reader_scopes().get(user_id)
+
+    def iter_scopes(self) -> Iterator[Tuple[int, Scopes]]:
+        if self.owner:
+            return self.backend.iter_scopes()
+        return iter(list(self._reader_scopes().items()))
+
+    def grant_scopes(self, user_id: int, scopes: int, expires: Optional[int]):
+        self._check_owner()
+        with self._lock:
+            granted = _grant_scopes(self.backend.get_scopes(user_id), scopes, expires)
+            self._update_scopes({user_id: granted}, lambda: self.backend.grant_scopes(user_id, scopes, expires))
+
+    def revoke_scopes(self, user_id: int, scopes: int):
+        self._check_owner()
+        with self._lock:
+            remaining = _revoke_scopes(self.backend.get_scopes(user_id), scopes)
+            self._update_scopes({user_id: remaining}, lambda: self.backend.revoke_scopes(user_id, scopes))
+
+    def upsert_scopes_many(self, scopes: Iterable[Tuple[int, Scopes]]):
+        self._check_owner()
+        scopes = list(scopes)
+        with self._lock:
+            self._update_scopes(dict(scopes), lambda: self.backend.upsert_scopes_many(scopes))
+
+    def _update_scopes(self, changes: Dict[int, Optional[Scopes]], write):
+        """
+        Writes scopes to the backing store with `write`, then mirrors them in the segment. Checks that they fit first,
+        so the backing store never holds scopes the segment can't. Must be called with the lock held.
+
+        :param changes: The new scopes of each user, None for the users left without any.
+        """
+        mirrored = dict(self._scopes)
+        for user_id, scopes in changes.items():
+            if scopes is None:
+                mirrored.pop(user_id, None)
+            else:
+                mirrored[user_id] = scopes
+        data = self._check_scopes(mirrored)
+        write()
+        with self._writing():
+            self._write_scopes(data)
+        self._scopes = mirrored
+
+    def next_expiry(self) -> Optional[int]:
+        if self.owner:
+            return self.backend.next_expiry()
+        return super().next_expiry()
+
+    def iter_expiring_between(self, start: Optional[int]=None, end: Optional[int]=None,
+                              batch_size: int=1000) -> Iterator[Tuple[int, int]]:
+        if self.owner:
+            with self._lock:
+                return self.backend.iter_expiring_between(start, end, batch_size)
+        return super().iter_expiring_between(start, end, batch_size)
+
+    def count_expiring_between(self, start: Optional[int]=None, end: Optional[int]=None) -> int:
+        if self.owner:
+            with self._lock:
+                return self.backend.count_expiring_between(start, end)
+        return super().count_expiring_between(start, end)
+
+    def get_authorized_users_page(self, after_cursor: Optional[Cursor]=None, limit: int=100) -> Tuple[List[Tuple[int, int]], Optional[Cursor]]:
+        if self.owner:
+            return self.backend.get_authorized_users_page(after_cursor, limit)
+        return super().get_authorized_users_page(after_cursor, limit)
+
+    def get_authorized_user(self, user_id: int) -> Tuple[int, int]:
+        if self.owner:
+            return self.backend.get_authorized_user(user_id)
+        expires = self._read(self._expires, user_id)
+        if expires is None:
+            return None
+        return (user_id, expires)
+
+    def get_authorized_users(self) -> List[Tuple[int, int]]:
+        if self.owner:
+            return self.backend.get_authorized_users()
+        return sorted(self._read(self._users), key=lambda user: (user[1], user[0]))
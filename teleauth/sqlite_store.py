@@ -0,0 +1,553 @@
+import logging
+import sqlite3
+import struct
+import threading
+import weakref
+from contextlib import contextmanager
+from datetime import datetime
+from time import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from teleauth.store import Cursor, IStore, Scopes, _grant_scopes, _next_cursor, _range, _revoke_scopes
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of host parameters in a single statement (999 on older builds)
+SQLITE_MAX_VARIABLES = 900
+
+# Version 1 stored the expiration dates as TIMESTAMP strings in a rowid table.
+# Version 2 stores integer epoch seconds in a WITHOUT ROWID table, indexed on (expires, user_id).
+SCHEMA_VERSION = 2
+
+# (scope, expiration timestamp) pairs of the scopes that expire, packed in the `expiries` column
+SCOPE_EXPIRY = struct.Struct("<qq")
+
+
+def _schema_version(conn: sqlite3.Connection) -> int:
+    """
+    Returns the schema version of a database, 0 if it is empty.
+    """
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    if "schema_version" in tables:
+        return conn.execute("SELECT version FROM schema_version").fetchone()[0]
+    return 1 if "users" in tables else 0
+
+
+def _create_schema(conn: sqlite3.Connection):
+    conn.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, expires INTEGER NOT NULL) WITHOUT ROWID")
+    # Covers the scans ordered by expiration (listings, pagination, purges) without touching the table
+    conn.execute("CREATE INDEX IF NOT EXISTS users_expires ON users (expires, user_id)")
+    conn.execute("CREATE TABLE IF NOT EXISTS admins (user_id INTEGER PRIMARY KEY)")
+    # Added to version 2 without a migration, since older databases simply have no scopes yet
+    conn.execute("CREATE TABLE IF NOT EXISTS scopes (user_id INTEGER PRIMARY KEY, mask INTEGER NOT NULL, expiries BLOB) WITHOUT ROWID")
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    # Users changed by each write, read by the caches of other processes (see `SQLiteStore.changes_since`)
+    conn.execute("CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL)")
+    conn.execute("INSERT INTO schema_version (version) SELECT ? WHERE NOT EXISTS (SELECT 1 FROM schema_version)",
+                 (SCHEMA_VERSION,))
+
+
+def _to_epoch(expires) -> int:
+    """
+    Converts an expiration date written by schema version 1, a "YYYY-MM-DD HH:MM:SS[.ffffff]" local time.
+    """
+    if isinstance(expires, (int, float)):
+        return int(expires)
+    return int(datetime.fromisoformat(expires).timestamp())
+
+
+def _unpack_scopes(mask: int, expiries: Optional[bytes]) -> Scopes:
+    return (mask, {} if expiries is None else dict(SCOPE_EXPIRY.iter_unpack(expiries)))
+
+
+class _ThreadGuard:
+    """
+    Kept next to a connection in the thread-local data, which is dropped when its thread ends.
+    """
+
+
+def _close_connection(connections: Dict[int, sqlite3.Connection], lock: threading.RLock, conn: sqlite3.Connection):
+    with lock:
+        connections.pop(id(conn), None)
+    conn.close()
+
+
+def _pack_scopes(expiries: Dict[int, int]) -> Optional[bytes]:
+    return b"".join(SCOPE_EXPIRY.pack(scope, expires) for scope, expires in expiries.items()) or None
+
+
+def migrate(filename: str="teleauth", batch_size: int=10000, progress: Optional[Callable[[int], None]]=None) -> int:
+    """
+    Converts a database written by an older version of teleauth to the current schema, in place.
+    `SQLiteStore` does it when it opens an old database; call this first to migrate a large one ahead of time.
+
+    The users are copied to the new table in batches, each in its own transaction, so the migration never holds
+    the write lock for long, and resumes where it stopped if it was interrupted. Other processes must not write to
+    the database until it is done.
+
+    :param filename: storage filename
+    :param batch_size: The number of users converted per transaction. Default: 10000
+    :param progress: A function called with the number of users converted so far after each batch.
+    :return: The number of users converted (0 if the database was already up to date).
+    """
+    # Autocommit mode, so the transactions below are exactly the ones started explicitly
+    conn = sqlite3.connect(f"{filename}.db", isolation_level=None)
+    try:
+        if _schema_version(conn) in (0, SCHEMA_VERSION):
+            return 0
+
+        conn.execute("CREATE TABLE IF NOT EXISTS users_v2 (user_id INTEGER PRIMARY KEY, expires INTEGER NOT NULL) WITHOUT ROWID")
+        last = conn.execute("SELECT MAX(user_id) FROM users_v2").fetchone()[0]
+        migrated = 0
+        while True:
+            if last is None:
+                rows = conn.execute("SELECT user_id, expires FROM users ORDER BY user_id LIMIT ?", (batch_size,))
+            else:
+                rows = conn.execute("SELECT user_id, expires FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                                    (last, batch_size))
+            rows = rows.fetchall()
+            if not rows:
+                break
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("INSERT OR REPLACE INTO users_v2 (user_id, expires) VALUES (?, ?)",
+                             [(user_id, _to_epoch(expires)) for user_id, expires in rows if expires is not None])
+            conn.execute("COMMIT")
+            last = rows[-1][0]
+            migrated += len(rows)
+            if progress is not None:
+                progress(migrated)
+
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DROP TABLE users")
+        conn.execute("ALTER TABLE users_v2 RENAME TO users")
+        _create_schema(conn)
+        conn.execute("COMMIT")
+        return migrated
+    finally:
+        conn.close()
+
+
+class SQLiteStore(IStore):
+    """
+    A store backed by a SQLite database in WAL mode. Expiration timestamps are stored as integers, so rows are
+    fetched without any date parsing; databases written by older versions are migrated when opened (see `migrate`).
+
+    Each thread gets its own connection (with its own prepared statement cache), closed when the thread ends, so
+    concurrent readers never share a cursor and, thanks to WAL, don't block each other or the writer. Writes are serialized by a lock and committed
+    before it is released.
+
+    With `group_commit_interval` set, user grants and revocations are queued instead, and a background thread
+    commits them in a single fully synchronous transaction every `group_commit_interval` milliseconds, or as soon as
+    `group_commit_size` of them are queued. Lookups of a single user see the queued writes; listings flush them first.
+
+    With `change_log_size` set, every write also records the changed users in a `changes` table, so caches in other
+    processes can drop just those users (see `changes_since`). Every process writing to the database must set it.
+    """
+    
+    def __init__(self, authorized_admin_ids: List[int], filename:str="teleauth", cached_statements:int=128,
+                 busy_timeout:int=5000, group_commit_interval:float=0, group_commit_size:int=1000,
+                 wait_durable:bool=False, change_log_size:int=0):
+        """
+        Initializes a new instance of the SQLiteStore class.
+        
+        :param authorized_admin_ids: List of user ids that are authorized to use the bot as admins.
+        :param filename: storage filename
+        :param cached_statements: The number of prepared statements cached by each connection. Default: 128
+        :param busy_timeout: How long, in milliseconds, to wait for a lock held by another process. Default: 5000
+        :param group_commit_interval: The maximum time, in milliseconds, a write stays queued before being committed.
+                                      Default: 0 (no group commit, every write is committed right away)
+        :param group_commit_size: The number of queued writes that triggers a commit right away. Default: 1000
+        :param wait_durable: Whether writes wait until their group is committed before returning. Default: False
+        :param change_log_size: The number of most recent changes kept for the caches of other processes.
+                                Default: 0 (changes are not recorded)
+        """
+        super().__init__(authorized_admin_ids, filename)
+        self.cached_statements = cached_statements
+        self.busy_timeout = busy_timeout
+        self.group_commit_interval = group_commit_interval
+        self.group_commit_size = group_commit_size
+        self.wait_durable = wait_durable
+        self.change_log_size = change_log_size
+        self._local = threading.local()
+        # The open connection of each thread, by id
+        self._connections: Dict[int, sqlite3.Connection] = {}
+        # Reentrant, since a thread's connection may be closed while that thread holds it
+        self._connections_lock = threading.RLock()
+        self._write_lock = threading.RLock()
+        # Queued writes (user_id -> expiration timestamp, or None to delete the user), and the ones being committed.
+        # _pending is None when group commit is disabled.
+        self._pending = None
+        self._flushing = {}
+        self._pending_condition = threading.Condition()
+        # Number of the group being queued, and of the last committed group
+        self._group = 0
+        self._committed_group = -1
+        self._flusher = None
+        self._closing = threading.Event()
+
+        migrate(filename)
+        with self._transaction() as conn:
+            # WAL is persistent, it only needs to be set once per database file
+            conn.execute("PRAGMA journal_mode=WAL")
+            _create_schema(conn)
+        self.authorized_admin_ids.update(user_id for (user_id,) in self.conn.execute("SELECT user_id FROM admins"))
+
+        if group_commit_interval > 0:
+            self._pending = {}
+            self._flusher = threading.Thread(target=self._flush_loop, name="teleauth-group-commit", daemon=True)
+            self._flusher.start()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """
+        The connection of the current thread, opened on first use.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            # Closes the connection when the thread ends, so short-lived threads don't leave it open until `close`
+            guard = _ThreadGuard()
+            weakref.finalize(guard, _close_connection, self._connections, self._connections_lock, conn)
+            self._local.guard = guard
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        # check_same_thread=False only so that `close` can close the connections of every thread
+        conn = sqlite3.connect(f"{self.filename}.db", check_same_thread=False, timeout=self.busy_timeout / 1000,
+                               cached_statements=self.cached_statements)
+        # NORMAL is durable in WAL mode except for the last transactions on power loss. Group commits can afford
+        # a full sync, since it is paid once per group.
+        conn.execute("PRAGMA synchronous=FULL" if self.group_commit_interval > 0 else "PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-8000")
+        with self._connections_lock:
+            self._connections[id(conn)] = conn
+        return conn
+    
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Runs a write transaction on the connection of the current thread, holding the write lock until it is committed.
+        """
+        with self._write_lock, self.conn as conn:
+            yield conn
+        if self.stats is not None:
+            self.stats.incr("commits")
+
+    def _log_changes(self, conn: sqlite3.Connection, user_ids: Iterable[int]):
+        """
+        Records the users changed by a write, in the same transaction, trimming the log to `change_log_size` entries.
+        """
+        if self.change_log_size > 0:
+            conn.executemany("INSERT INTO changes (user_id) VALUES (?)", ((user_id,) for user_id in user_ids))
+            conn.execute("DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?", (self.change_log_size,))
+
+    def changes_since(self, seq: Optional[int]) -> Optional[Tuple[int, Optional[List[int]]]]:
+        if self.change_log_size <= 0:
+            return None
+        if seq is None:
+            row = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name='changes'").fetchone()
+            return (0 if row is None else row[0], [])
+        rows = self.conn.execute("SELECT seq, user_id FROM changes WHERE seq >? ORDER BY seq", (seq,)).fetchall()
+        if not rows:
+            return (seq, [])
+        # The log is trimmed from the oldest end, so a gap right after `seq` means changes were lost
+        if rows[0][0] != seq + 1:
+            return (rows[-1][0], None)
+        return (rows[-1][0], [user_id for _, user_id in rows])
+
+    def _enqueue(self, users: Iterable[Tuple[int, Optional[int]]]):
+        """
+        Queues writes for the next group commit, waiting until it is committed if `wait_durable` is set.
+
+        :param users: Tuples containing the user IDs and their expiration timestamps (None to delete the user).
+        """
+        with self._pending_condition:
+            self._pending.update(users)
+            group = self._group
+            if len(self._pending) >= self.group_commit_size:
+                self._pending_condition.notify_all()
+            if self.wait_durable:
+                self._pending_condition.wait_for(lambda: self._committed_group >= group)
+
+    def _queued(self, user_id: int) -> Tuple[bool, Optional[int]]:
+        """
+        Looks up a user in the writes that are not committed yet.
+
+        :return: A tuple (found, expiration timestamp), where the expiration timestamp is None for a queued deletion.
+        """
+        pending = self._pending
+        if user_id in pending:
+            return True, pending[user_id]
+        flushing = self._flushing
+        if user_id in flushing:
+            return True, flushing[user_id]
+        return False, None
+
+    def _flush_loop(self):
+        interval = self.group_commit_interval / 1000
+        while not self._closing.is_set():
+            with self._pending_condition:
+                self._pending_condition.wait_for(
+                    lambda: self._closing.is_set() or len(self._pending) >= self.group_commit_size, interval)
+            try:
+                self.flush()
+            except Exception:
+                # The writes are queued again and retried with the next group
+                logger.exception("Group commit failed")
+
+    def flush(self):
+        """
+        Commits the queued writes right away, in a single transaction.
+        """
+        if self._pending is None:
+            return
+
+        with self._write_lock:
+            with self._pending_condition:
+                if not self._pending:
+                    return
+                # Readers look at _pending first, so they see the writes in one of the dicts until they are committed
+                self._flushing, self._pending = self._pending, {}
+                group = self._group
+                self._group += 1
+
+            try:
+                with self._transaction() as conn:
+                    conn.executemany("INSERT INTO users (user_id, expires) VALUES (?, ?) "
+                                     "ON CONFLICT(user_id) DO UPDATE SET expires=excluded.expires",
+                                     [(user_id, expires) for user_id, expires in self._flushing.items() if expires is not None])
+                    conn.executemany("DELETE FROM users WHERE user_id=?",
+                                     [(user_id,) for user_id, expires in self._flushing.items() if expires is None])
+                    self._log_changes(conn, self._flushing)
+            except BaseException:
+                with self._pending_condition:
+                    for user_id, expires in self._flushing.items():
+                        self._pending.setdefault(user_id, expires)
+                    self._flushing = {}
+                raise
+
+            with self._pending_condition:
+                self._flushing = {}
+                self._committed_group = group
+                self._pending_condition.notify_all()
+
+    def close(self):
+        if self._flusher is not None:
+            self._closing.set()
+            with self._pending_condition:
+                self._pending_condition.notify_all()
+            self._flusher.join()
+            self._flusher = None
+            self.flush()
+        with self._connections_lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+    
+    def _save_admin(self, user_id: int):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO admins (user_id) VALUES (?)", (user_id,))
+
+    def _delete_admin(self, user_id: int):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM admins WHERE user_id=?", (user_id,))
+    
+    def is_authenticated(self, user_id: int) -> bool:
+        if self.is_admin(user_id):
+            return True
+
+        if self._pending is not None:
+            queued, expires = self._queued(user_id)
+            if queued:
+                return expires is not None and expires > time()
+        result = self.conn.execute("SELECT 1 FROM users WHERE user_id=? AND expires >?", (user_id, time())).fetchone()
+        if self.stats is not None:
+            self.stats.incr("rows_scanned", result is not None)
+        return result is not None
+    
+    def authorize_user(self, user_id: int, days: int, hours: int):
+        expires = int(time()) + days * 86400 + hours * 3600
+        if self._pending is not None:
+            self._enqueue([(user_id, expires)])
+            return
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO users (user_id, expires) VALUES (?, ?) "
+                         "ON CONFLICT(user_id) DO UPDATE SET expires=excluded.expires", (user_id, expires))
+            self._log_changes(conn, [user_id])
+    
+    def revoke_access(self, user_id: int):
+        if self._pending is not None:
+            self._enqueue([(user_id, None)])
+            return
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM users WHERE user_id=?", (user_id,))
+            self._log_changes(conn, [user_id])
+
+    def get_authorized_user(self, user_id: int) -> Tuple[int, int]:
+        if self._pending is not None:
+            queued, expires = self._queued(user_id)
+            if queued:
+                return None if expires is None else (user_id, expires)
+        result = self.conn.execute("SELECT user_id, expires FROM users WHERE user_id=?", (user_id,)).fetchone()
+        if self.stats is not None:
+            self.stats.incr("rows_scanned", result is not None)
+        return result
+    
+    def get_authorized_users(self) -> List[Tuple[int, int]]:
+        self.flush()
+        rows = self.conn.execute("SELECT user_id, expires FROM users ORDER BY expires ASC").fetchall()
+        if self.stats is not None:
+            self.stats.incr("rows_scanned", len(rows))
+        return [(row[0], row[1]) for row in rows]
+
+    def insert_user(self, user_id: int, expires: int):
+        if self._pending is not None:
+            self._enqueue([(user_id, expires)])
+            return
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO users (user_id, expires) VALUES (?, ?)", (user_id, expires))
+            self._log_changes(conn, [user_id])
+    
+    def update_user(self, user_id: int, expires: int):
+        if self._pending is not None:
+            # Serialized with the other writes, so the user can't be deleted between the check and the queuing
+            with self._pending_condition:
+                if self.get_authorized_user(user_id) is not None:
+                    self._enqueue([(user_id, expires)])
+            return
+        with self._transaction() as conn:
+            conn.execute("UPDATE users SET expires=? WHERE user_id=?", (expires, user_id))
+            self._log_changes(conn, [user_id])
+
+    def is_authenticated_many(self, user_ids: Iterable[int]) -> Dict[int, bool]:
+        result = {}
+        pending = []
+        now = time()
+        for user_id in user_ids:
+            result[user_id] = self.is_admin(user_id)
+            if not result[user_id]:
+                queued, expires = (False, None) if self._pending is None else self._queued(user_id)
+                if queued:
+                    result[user_id] = expires is not None and expires > now
+                else:
+                    pending.append(user_id)
+
+        conn = self.conn
+        for i in range(0, len(pending), SQLITE_MAX_VARIABLES):
+            chunk = pending[i:i + SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(f"SELECT user_id FROM users WHERE expires >? AND user_id IN ({placeholders})", (now, *chunk))
+            for (user_id,) in rows:
+                result[user_id] = True
+                if self.stats is not None:
+                    self.stats.incr("rows_scanned")
+        return result
+
+    def revoke_many(self, user_ids: Iterable[int]):
+        if self._pending is not None:
+            self._enqueue((user_id, None) for user_id in user_ids)
+            return
+        user_ids = list(user_ids)
+        with self._transaction() as conn:
+            conn.executemany("DELETE FROM users WHERE user_id=?", ((user_id,) for user_id in user_ids))
+            self._log_changes(conn, user_ids)
+
+    def upsert_users_many(self, users: Iterable[Tuple[int, int]]):
+        if self._pending is not None:
+            self._enqueue(users)
+            return
+        users = list(users)
+        with self._transaction() as conn:
+            conn.executemany("INSERT INTO users (user_id, expires) VALUES (?, ?) "
+                             "ON CONFLICT(user_id) DO UPDATE SET expires=excluded.expires", users)
+            self._log_changes(conn, (user_id for user_id, _ in users))
+
+    def get_authorized_users_page(self, after_cursor: Optional[Cursor]=None, limit: int=100) -> Tuple[List[Tuple[int, int]], Optional[Cursor]]:
+        self.flush()
+        if after_cursor is None:
+            rows = self.conn.execute("SELECT user_id, expires FROM users ORDER BY expires, user_id LIMIT ?", (limit,))
+        else:
+            rows = self.conn.execute("SELECT user_id, expires FROM users WHERE (expires, user_id) > (?, ?) "
+                                     "ORDER BY expires, user_id LIMIT ?", (*after_cursor, limit))
+        page = rows.fetchall()
+        if self.stats is not None:
+            self.stats.incr("rows_scanned", len(page))
+        return page, _next_cursor(page, limit)
+
+    def iter_expiring_between(self, start: Optional[int]=None, end: Optional[int]=None,
+                              batch_size: int=1000) -> Iterator[Tuple[int, int]]:
+        # Pages of the users_expires index, so nothing is held open between batches
+        start, end = _range(start, end)
+        self.flush()
+        rows = self.conn.execute("SELECT user_id, expires FROM users WHERE expires >=? AND expires <? "
+                                 "ORDER BY expires, user_id LIMIT ?", (start, end, batch_size)).fetchall()
+        while rows:
+            if self.stats is not None:
+                self.stats.incr("rows_scanned", len(rows))
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            user_id, expires = rows[-1]
+            rows = self.conn.execute("SELECT user_id, expires FROM users WHERE (expires, user_id) > (?, ?) AND expires <? "
+                                     "ORDER BY expires, user_id LIMIT ?", (expires, user_id, end, batch_size)).fetchall()
+
+    def count_expiring_between(self, start: Optional[int]=None, end: Optional[int]=None) -> int:
+        self.flush()
+        return self.conn.execute("SELECT COUNT(*) FROM users WHERE expires >=? AND expires <?", _range(start, end)).fetchone()[0]
+
+    def get_scopes(self, user_id: int) -> Optional[Scopes]:
+        row = self.conn.execute("SELECT mask, expiries FROM scopes WHERE user_id=?", (user_id,)).fetchone()
+        if self.stats is not None:
+            self.stats.incr("rows_scanned", row is not None)
+        return None if row is None else _unpack_scopes(*row)
+
+    def iter_scopes(self) -> Iterator[Tuple[int, Scopes]]:
+        # Scopes are few compared to users: no need to page through them
+        rows = self.conn.execute("SELECT user_id, mask, expiries FROM scopes ORDER BY user_id").fetchall()
+        return ((user_id, _unpack_scopes(mask, expiries)) for user_id, mask, expiries in rows)
+
+    def _update_scopes(self, user_id: int, update: Callable[[Optional[Scopes]], Optional[Scopes]]):
+        with self._transaction() as conn:
+            # Take the write lock up front, so no other process can change the scopes between the read and the write
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT mask, expiries FROM scopes WHERE user_id=?", (user_id,)).fetchone()
+            scopes = update(None if row is None else _unpack_scopes(*row))
+            if scopes is None:
+                conn.execute("DELETE FROM scopes WHERE user_id=?", (user_id,))
+            else:
+                conn.execute("INSERT INTO scopes (user_id, mask, expiries) VALUES (?, ?, ?) "
+                             "ON CONFLICT(user_id) DO UPDATE SET mask=excluded.mask, expiries=excluded.expiries",
+                             (user_id, scopes[0], _pack_scopes(scopes[1])))
+            self._log_changes(conn, [user_id])
+
+    def grant_scopes(self, user_id: int, scopes: int, expires: Optional[int]):
+        self._update_scopes(user_id, lambda current: _grant_scopes(current, scopes, expires))
+
+    def revoke_scopes(self, user_id: int, scopes: int):
+        self._update_scopes(user_id, lambda current: _revoke_scopes(current, scopes))
+
+    def upsert_scopes_many(self, scopes: Iterable[Tuple[int, Scopes]]):
+        scopes = list(scopes)
+        with self._transaction() as conn:
+            conn.executemany("INSERT INTO scopes (user_id, mask, expiries) VALUES (?, ?, ?) "
+                             "ON CONFLICT(user_id) DO UPDATE SET mask=excluded.mask, expiries=excluded.expiries",
+                             ((user_id, mask, _pack_scopes(expiries)) for user_id, (mask, expiries) in scopes))
+            self._log_changes(conn, (user_id for user_id, _ in scopes))
+
+    def next_expiry(self) -> Optional[int]:
+        self.flush()
+        row = self.conn.execute("SELECT expires FROM users ORDER BY expires ASC LIMIT 1").fetchone()
+        return None if row is None else row[0]
+
+    def purge_expired(self, before: int, limit: int) -> List[int]:
+        self.flush()
+        with self._transaction() as conn:
+            # Take the write lock up front, so no other process can renew a user between the SELECT and the DELETE
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("SELECT user_id FROM users WHERE expires <=? ORDER BY expires ASC LIMIT ?", (before, limit)).fetchall()
+            conn.executemany("DELETE FROM users WHERE user_id=?", rows)
+            self._log_changes(conn, (user_id for (user_id,) in rows))
+        return [user_id for (user_id,) in rows]
+        
@@ -0,0 +1,196 @@
+import threading
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter, time
+from typing import Callable, Dict, Optional
+from teleauth.store import IStore, StoreWrapper
+
+# Upper bounds, in seconds, of the latency histogram buckets: 1us, 2us, 4us, ... ~67s. Anything slower goes in a last bucket.
+BUCKET_BOUNDS = [2 ** i / 1_000_000 for i in range(27)]
+
+
+class Histogram:
+    """
+    A fixed-size latency histogram with power-of-two buckets, so recording is O(log buckets) and memory is constant.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+
+    def record(self, seconds: float):
+        """
+        Records a latency. Must be called with the owning `Stats` lock held.
+
+        :param seconds: The latency, in seconds.
+        """
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+
+    def percentile(self, q: float) -> float:
+        """
+        Estimates a percentile as the upper bound of the bucket it falls in.
+
+        :param q: The percentile, between 0 and 100.
+        :return: The estimated latency, in seconds.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return min(BUCKET_BOUNDS[i], self.max) if i < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": list(self.buckets),
+        }
+
+
+class Stats:
+    """
+    Collects per-operation latency histograms and counters, and optionally hands periodic snapshots to an exporter.
+    """
+
+    def __init__(self, exporter: Optional[Callable[[dict], None]]=None, export_interval: float=60.0):
+        """
+        Initializes a new instance of the Stats class.
+
+        :param exporter: A function called with a snapshot (see `snapshot`) every `export_interval` seconds,
+                         e.g. to push the numbers to a metrics system. It is called from the thread that recorded
+                         the last operation.
+        :param export_interval: The number of seconds between two exports. Default: 60
+        """
+        self.exporter = exporter
+        self.export_interval = export_interval
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        self.sources: Dict[str, Callable[[], dict]] = {}
+        self._lock = threading.Lock()
+        self._next_export = time() + export_interval
+
+    def record(self, name: str, seconds: float):
+        """
+        Records the latency of an operation.
+
+        :param name: The name of the operation, e.g. "auth.is_authenticated".
+        :param seconds: The latency, in seconds.
+        """
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(seconds)
+        if self.exporter is not None and time() >= self._next_export:
+            self.export()
+
+    def incr(self, name: str, value: int=1):
+        """
+        Increments a counter.
+
+        :param name: The name of the counter, e.g. "commits".
+        :param value: The amount to add.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_source(self, name: str, source: Callable[[], dict]):
+        """
+        Adds a section to the snapshots, computed when the snapshot is taken (e.g. the cache statistics).
+
+        :param name: The name of the section.
+        :param source: A function returning the content of the section.
+        """
+        self.sources[name] = source
+
+    def timed(self, name: str, func: Callable) -> Callable:
+        """
+        Wraps a function so that each call is recorded under `name`.
+
+        :param name: The name of the operation.
+        :param func: The function to time.
+        :return: The wrapped function.
+        """
+        record = self.record
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, perf_counter() - start)
+        return wrapper
+
+    def snapshot(self) -> dict:
+        """
+        Returns a copy of the collected data.
+
+        :return: A dict with an "operations" dict (operation name -> count, total, mean, max, p50, p90 and p99
+                 latencies in seconds, and the bucket counts), a "counters" dict, and one entry per source.
+        """
+        with self._lock:
+            snapshot = {
+                "operations": {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+                "counters": dict(self.counters),
+            }
+        for name, source in self.sources.items():
+            snapshot[name] = source()
+        return snapshot
+
+    def export(self):
+        """
+        Hands a snapshot to the exporter right away.
+        """
+        self._next_export = time() + self.export_interval
+        if self.exporter is not None:
+            self.exporter(self.snapshot())
+
+    def reset(self):
+        """
+        Drops every histogram and counter.
+        """
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+class InstrumentedStore(StoreWrapper):
+    """
+    Records the latency of every call made to the wrapped store, under "store.<method>".
+    Only used when instrumentation is enabled, so disabled instrumentation costs nothing.
+    """
+
+    METHODS = (
+        "is_authenticated", "authorize_user", "revoke_access", "get_authorized_user", "get_authorized_users",
+        "insert_user", "update_user", "authorize_admin", "revoke_admin", "is_authenticated_many",
+        "authorize_users_many", "revoke_many", "upsert_users_many", "get_authorized_users_page",
+        "next_expiry", "purge_expired", "count_expiring_between", "get_scopes", "grant_scopes", "revoke_scopes",
+        "upsert_scopes_many", "flush",
+    )
+
+    def __init__(self, store: IStore, stats: Stats):
+        """
+        Initializes a new instance of the InstrumentedStore class.
+
+        :param store: The store to instrument.
+        :param stats: Where to record the latencies.
+        """
+        super().__init__(store)
+        for name in self.METHODS:
+            setattr(self, name, stats.timed(f"store.{name}", getattr(store, name)))
@@ -1,24 +1,86 @@
+import threading
 from abc import ABC, abstractmethod
-from datetime import datetime, timedelta
-import json
-from typing import List, Tuple
-import sqlite3
+from bisect import bisect_right
 from enum import Enum
+from importlib import import_module
+from time import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
-STORE_CLASSES = {}
+# Expiration dates are integer epoch seconds everywhere below `Auth`, which converts them to datetimes for display
+
+# Position in the (expires, user_id) order of the users, used for keyset pagination
+Cursor = Tuple[int, int]
+
+# Scopes granted to a user: the bitmask of the scopes, and the expiration timestamp of each scope (a single bit)
+# that expires. Scopes without an entry never expire.
+Scopes = Tuple[int, Dict[int, int]]
+# Scopes are the bits of a 63-bit mask, so it fits in a SQLite integer
+ALL_SCOPES = (1 << 63) - 1
+
+# Bounds of the expiration timestamps (SQLite's 64-bit integers), standing for open ends of a range
+MIN_EXPIRES = -2 ** 63
+MAX_EXPIRES = 2 ** 63 - 1
 
 class StoreType(Enum):
     """
     An enum representing the types of stores that can be used for storing the authorized users.
     """
     SQLITE = 'SQLITE'
+    SQLITE_SHARDED = 'SQLITE_SHARDED'
     JSON = 'JSON'
+    JSON_JOURNAL = 'JSON_JOURNAL'
+    MMAP = 'MMAP'
+    SHARED_MEMORY = 'SHARED_MEMORY'
+
+# Module and class implementing each StoreType. Backends are only imported when their store type is used,
+# so `import teleauth` doesn't pay for sqlite3 or json.
+STORE_MODULES: Dict[StoreType, Tuple[str, str]] = {
+    StoreType.SQLITE: ("teleauth.sqlite_store", "SQLiteStore"),
+    StoreType.SQLITE_SHARDED: ("teleauth.sharded_store", "ShardedSQLiteStore"),
+    StoreType.JSON: ("teleauth.json_store", "JSONStore"),
+    StoreType.JSON_JOURNAL: ("teleauth.json_store", "JournaledJSONStore"),
+    StoreType.MMAP: ("teleauth.mmap_store", "MMAPStore"),
+    StoreType.SHARED_MEMORY: ("teleauth.shm_store", "SharedMemoryStore"),
+}
+
+class _StoreClasses(dict):
+    """
+    Maps each StoreType to its store class, importing the backend module on first lookup.
+    Other classes can still be registered with `STORE_CLASSES[store_type] = store_class`.
+    """
+
+    def __missing__(self, store_type: StoreType) -> type:
+        if store_type not in STORE_MODULES:
+            raise KeyError(store_type)
+        module, name = STORE_MODULES[store_type]
+        store_class = self[store_type] = getattr(import_module(module), name)
+        return store_class
+
+    def get(self, store_type: StoreType, default=None):
+        try:
+            return self[store_type]
+        except KeyError:
+            return default
+
+STORE_CLASSES = _StoreClasses()
+
+def __getattr__(name: str):
+    # The store classes used to live in this module
+    for module, class_name in STORE_MODULES.values():
+        if class_name == name:
+            return getattr(import_module(module), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 class IStore(ABC):
     """
     Abstract base class for stores.
+
+    Expiration timestamps are integer epoch seconds.
     """
 
+    # Set by `Auth` when instrumentation is enabled; stores then increment counters such as "commits" on it
+    stats = None
+
     @abstractmethod
     def __init__(self, authorized_admin_ids: List[int], filename:str="teleauth"):
         """
@@ -28,7 +90,8 @@ class IStore(ABC):
         :param filename: storage filename
         """
         self.filename = filename
-        self.authorized_admin_ids = authorized_admin_ids
+        # Admins granted at runtime are persisted by the store and added to this set when it is opened
+        self.authorized_admin_ids = set(authorized_admin_ids)
 
     @abstractmethod
     def close(self):
@@ -37,6 +100,12 @@ class IStore(ABC):
         """
         pass
 
+    def flush(self):
+        """
+        Makes every write made so far durable. Stores that write synchronously have nothing to do.
+        """
+        pass
+
     def is_admin(self, user_id: int) -> bool:
         """
         Determines whether the specified user is an admin.
@@ -52,7 +121,9 @@ class IStore(ABC):
         
         param user_id: The user id to authorize
         """
-        self.authorized_admin_ids.append(user_id)
+        if not self.is_admin(user_id):
+            self._save_admin(user_id)
+            self.authorized_admin_ids.add(user_id)
         
     def revoke_admin(self, user_id):
         """
@@ -61,7 +132,24 @@ class IStore(ABC):
         param user_id: The ID of the user to revoke access from.
         """
         if self.is_admin(user_id):
-            self.authorized_admin_ids.remove(user_id)
+            self._delete_admin(user_id)
+            self.authorized_admin_ids.discard(user_id)
+
+    def _save_admin(self, user_id: int):
+        """
+        Persists a newly authorized admin. Stores that can't persist admins keep them in memory only.
+        
+        :param user_id: The ID of the admin.
+        """
+        pass
+
+    def _delete_admin(self, user_id: int):
+        """
+        Removes a persisted admin.
+        
+        :param user_id: The ID of the admin.
+        """
+        pass
     
     @abstractmethod
     def is_authenticated(self, user_id: int) -> bool:
@@ -94,144 +182,477 @@ class IStore(ABC):
         pass
 
     @abstractmethod
-    def get_authorized_user(self, user_id: int) -> Tuple[int, datetime]:
+    def get_authorized_user(self, user_id: int) -> Tuple[int, int]:
         """
         Get the authorized user with the specified ID.
         
         :param user_id: The ID of the user to get.
-        :return: A tuple containing the user ID and the expiration date of the user's access.
+        :return: A tuple containing the user ID and the expiration timestamp of the user's access.
         """
         pass
 
     @abstractmethod
-    def get_authorized_users(self) -> List[Tuple[int, datetime]]:
+    def get_authorized_users(self) -> List[Tuple[int, int]]:
         """
         Get a list of all authorized users.
         
-        :return: A list of tuples containing the user IDs and expiration dates of all authorized users.
+        :return: A list of tuples containing the user IDs and expiration timestamps of all authorized users.
         """
         pass
 
     @abstractmethod
-    def insert_user(self, user_id: int, expires: datetime):
+    def insert_user(self, user_id: int, expires: int):
         """
         Insert a new authorized user into the store.
         
         :param user_id: The ID of the user to insert.
-        :param expires: The expiration date of the user's access.
+        :param expires: The expiration timestamp of the user's access.
         """
         pass
     
     @abstractmethod
-    def update_user(self, user_id: int, expires: datetime):
+    def update_user(self, user_id: int, expires: int):
         """
-        Update the expiration date of an authorized user.
+        Update the expiration timestamp of an authorized user.
         
         :param user_id: The ID of the user to update.
-        :param expires: The new expiration date of the user's access.
+        :param expires: The new expiration timestamp of the user's access.
         """
         pass
 
+    def is_authenticated_many(self, user_ids: Iterable[int]) -> Dict[int, bool]:
+        """
+        Determines whether each of the specified users is authenticated.
+        
+        :param user_ids: The user ids to check.
+        :return: A dict mapping each user id to True if the user is authenticated, False otherwise.
+        """
+        return {user_id: self.is_authenticated(user_id) for user_id in user_ids}
 
-class SQLiteStore(IStore):
-    
-    def __init__(self, authorized_admin_ids: List[int], filename:str="teleauth"):
-        super().__init__(authorized_admin_ids, filename)
-        self.conn = sqlite3.connect(f"{self.filename}.db", check_same_thread=False,
-                                    detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-        self.cursor = self.conn.cursor()
-        self.cursor.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, expires TIMESTAMP)")
-    
-    def close(self):
-        self.conn.close()
-    
-    def is_authenticated(self, user_id: int) -> bool:
-        if self.is_admin(user_id):
-            return True
+    def authorize_users_many(self, user_ids: Iterable[int], days: int, hours: int):
+        """
+        Authorizes all the specified users for the same amount of time.
+        
+        :param user_ids: The user ids to authorize.
+        :param days: The number of days the users will be authorized for.
+        :param hours: The number of hours the users will be authorized for.
+        """
+        expires = int(time()) + days * 86400 + hours * 3600
+        self.upsert_users_many((user_id, expires) for user_id in user_ids)
 
-        self.cursor.execute("SELECT * FROM users WHERE user_id=? AND expires >?", (user_id, datetime.now()))
-        result = self.cursor.fetchone()
-        return result is not None
-    
-    def authorize_user(self, user_id: int, days: int, hours: int):
-        expires = datetime.now() + timedelta(days=days, hours=hours)
-        user = self.get_authorized_user(user_id)
-        if user is None:
-            self.insert_user(user_id, expires)
-        else:
-            self.update_user(user_id, expires)
-        self.conn.commit()
-    
-    def revoke_access(self, user_id: int):
-        self.cursor.execute("DELETE FROM users WHERE user_id=?", (user_id,))
-        self.conn.commit()
+    def revoke_many(self, user_ids: Iterable[int]):
+        """
+        Revoke access to all the specified users.
+        
+        :param user_ids: The IDs of the users to revoke access from.
+        """
+        for user_id in user_ids:
+            self.revoke_access(user_id)
 
-    def get_authorized_user(self, user_id: int) -> Tuple[int, datetime]:
-        self.cursor.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
-        result = self.cursor.fetchone()
-        return result
-    
-    def get_authorized_users(self) -> List[Tuple[int, datetime]]:
-        self.cursor.execute("SELECT user_id, expires FROM users ORDER BY expires ASC")
-        rows = self.cursor.fetchall()
-        return [(row[0], row[1]) for row in rows]
+    def upsert_users_many(self, users: Iterable[Tuple[int, int]]):
+        """
+        Insert the specified users into the store, updating the expiration timestamp of the ones already in it.
+        
+        :param users: Tuples containing the user IDs and the expiration timestamps of their access.
+        """
+        for user_id, expires in users:
+            if self.get_authorized_user(user_id) is None:
+                self.insert_user(user_id, expires)
+            else:
+                self.update_user(user_id, expires)
 
-    def insert_user(self, user_id: int, expires: datetime):
-        self.cursor.execute("INSERT INTO users (user_id, expires) VALUES (?, ?)", (user_id, expires))
-    
-    def update_user(self, user_id: int, expires: datetime):
-        self.cursor.execute("UPDATE users SET expires=? WHERE user_id=?", (expires, user_id))
+    def get_authorized_users_page(self, after_cursor: Optional[Cursor]=None, limit: int=100) -> Tuple[List[Tuple[int, int]], Optional[Cursor]]:
+        """
+        Get a page of authorized users, ordered by expiration timestamp and then user ID.
         
+        :param after_cursor: The cursor returned with the previous page, or None to get the first page.
+        :param limit: The maximum number of users in the page.
+        :return: A tuple containing the users of the page and the cursor of the next page (None if this is the last one).
+        """
+        users = sorted((expires, user_id) for user_id, expires in self.get_authorized_users())
+        start = 0 if after_cursor is None else bisect_right(users, after_cursor)
+        page = [(user_id, expires) for expires, user_id in users[start:start + limit]]
+        return page, _next_cursor(page, limit)
 
+    def iter_authorized_users(self, batch_size: int=1000) -> Iterator[Tuple[int, int]]:
+        """
+        Iterate over all authorized users, ordered by expiration timestamp, loading `batch_size` users at a time.
+        
+        :param batch_size: The number of users loaded at a time.
+        :return: An iterator of tuples containing the user IDs and expiration timestamps.
+        """
+        cursor = None
+        while True:
+            page, cursor = self.get_authorized_users_page(cursor, batch_size)
+            yield from page
+            if cursor is None:
+                return
 
-class JSONStore(IStore):
-    def __init__(self, authorized_admin_ids: List[int], filename:str="teleauth"):
-        super().__init__(authorized_admin_ids, filename)
-        self.store = {}
-        try:
-            with open(f"{self.filename}.json", "r") as f:
-                self.store = json.load(f)
-        except FileNotFoundError:
-            # Create an empty JSON file if it does not exist
-            with open(f"{self.filename}.json", "w") as f:
-                json.dump({}, f)
+    def next_expiry(self) -> Optional[int]:
+        """
+        Get the earliest expiration timestamp in the store.
+        
+        :return: The earliest expiration timestamp, or None if the store is empty.
+        """
+        return min((expires for _, expires in self.get_authorized_users()), default=None)
+
+    def purge_expired(self, before: int, limit: int) -> List[int]:
+        """
+        Remove the users whose access expired, oldest first.
+        
+        :param before: Users whose access expires at or before this timestamp (in epoch seconds) are removed.
+        :param limit: The maximum number of users to remove.
+        :return: The IDs of the removed users.
+        """
+        expired = sorted((expires, user_id) for user_id, expires in self.get_authorized_users() if expires <= before)
+        user_ids = [user_id for _, user_id in expired[:limit]]
+        if user_ids:
+            self.revoke_many(user_ids)
+        return user_ids
+
+    def iter_expiring_between(self, start: Optional[int]=None, end: Optional[int]=None,
+                              batch_size: int=1000) -> Iterator[Tuple[int, int]]:
+        """
+        Iterate over the users whose access expires in a range, ordered by expiration timestamp.
+        
+        :param start: The start of the range, included, in epoch seconds. None for no lower bound.
+        :param end: The end of the range, excluded, in epoch seconds. None for no upper bound.
+        :param batch_size: The number of users loaded at a time.
+        :return: An iterator of tuples containing the user IDs and expiration timestamps.
+        """
+        start, end = _range(start, end)
+        users = sorted((expires, user_id) for user_id, expires in self.get_authorized_users() if start <= expires < end)
+        return ((user_id, expires) for expires, user_id in users)
+
+    def count_expiring_between(self, start: Optional[int]=None, end: Optional[int]=None) -> int:
+        """
+        Count the users whose access expires in a range.
+        
+        :param start: The start of the range, included, in epoch seconds. None for no lower bound.
+        :param end: The end of the range, excluded, in epoch seconds. None for no upper bound.
+        :return: The number of users.
+        """
+        start, end = _range(start, end)
+        return sum(1 for _, expires in self.get_authorized_users() if start <= expires < end)
+
+    def count_active(self) -> int:
+        """
+        Count the users whose access hasn't expired. Admins are not counted, unless they are users too.
+        """
+        return self.count_expiring_between(int(time()) + 1, None)
+
+    def count_expired(self, since: Optional[int]=None) -> int:
+        """
+        Count the users whose access expired, and who are still in the store.
+        
+        :param since: Only count the users whose access expired at or after this timestamp (in epoch seconds).
+        """
+        return self.count_expiring_between(since, int(time()) + 1)
+
+    def get_scopes(self, user_id: int) -> Optional[Scopes]:
+        """
+        Get the scopes granted to a user, expired or not, with a single lookup.
+        
+        :param user_id: The user's ID
+        :return: A tuple containing the bitmask of the scopes and the expiration timestamp of the ones that expire,
+                 or None if the user has no scopes.
+        """
+        raise NotImplementedError(f"{type(self).__name__} doesn't store scopes")
+
+    def iter_scopes(self) -> Iterator[Tuple[int, Scopes]]:
+        """
+        Iterate over the scopes of every user that has some, expired or not, e.g. to copy them to another store.
+        
+        :return: An iterator of tuples containing the user IDs and their scopes.
+        """
+        raise NotImplementedError(f"{type(self).__name__} doesn't store scopes")
+
+    def grant_scopes(self, user_id: int, scopes: int, expires: Optional[int]):
+        """
+        Grant scopes to a user, replacing the expiration of the ones already granted.
+        
+        :param user_id: The user's ID
+        :param scopes: The bitmask of the scopes to grant.
+        :param expires: The expiration timestamp of the scopes, or None if they don't expire.
+        """
+        self._set_scopes(user_id, _grant_scopes(self.get_scopes(user_id), scopes, expires))
+
+    def revoke_scopes(self, user_id: int, scopes: int):
+        """
+        Revoke scopes from a user.
+        
+        :param user_id: The user's ID
+        :param scopes: The bitmask of the scopes to revoke.
+        """
+        self._set_scopes(user_id, _revoke_scopes(self.get_scopes(user_id), scopes))
+
+    def upsert_scopes_many(self, scopes: Iterable[Tuple[int, Scopes]]):
+        """
+        Replace the scopes of the specified users, e.g. when copying them from another store.
+        
+        :param scopes: Tuples containing the user IDs and their scopes, as returned by `iter_scopes`.
+        """
+        for user_id, user_scopes in scopes:
+            if self.get_scopes(user_id) is not None:
+                self.revoke_scopes(user_id, ALL_SCOPES)
+            for grant, expires in _scope_grants(user_scopes):
+                self.grant_scopes(user_id, grant, expires)
+
+    def _set_scopes(self, user_id: int, scopes: Optional[Scopes]):
+        """
+        Persists the scopes of a user, as updated by `grant_scopes` or `revoke_scopes`.
+        
+        :param user_id: The user's ID
+        :param scopes: The new scopes, or None if the user has none left.
+        """
+        raise NotImplementedError(f"{type(self).__name__} doesn't store scopes")
+
+    def changes_since(self, seq: Optional[int]) -> Optional[Tuple[int, Optional[List[int]]]]:
+        """
+        Get the users changed by other processes, so their caches can be kept coherent.
+        
+        :param seq: The sequence number returned by the previous call, or None to get the current one.
+        :return: None if the store doesn't track changes. Otherwise a tuple containing the new sequence number and
+                 the IDs of the users changed since `seq`, or None instead of the IDs if they are no longer known.
+        """
+        return None
+
+
+def _active_scopes(scopes: Optional[Scopes], now: float) -> int:
+    """
+    Returns the bitmask of the scopes that haven't expired.
+    """
+    if scopes is None:
+        return 0
+    mask, expiries = scopes
+    for scope, expires in expiries.items():
+        if expires <= now:
+            mask &= ~scope
+    return mask
+
+
+def _grant_scopes(scopes: Optional[Scopes], grant: int, expires: Optional[int]) -> Scopes:
+    """
+    Returns the scopes of a user after a grant, dropping the scopes that expired.
+    """
+    if not 0 < grant <= ALL_SCOPES:
+        raise ValueError(f"Invalid scopes: {grant}")
+    mask = _active_scopes(scopes, time())
+    expiries = {} if scopes is None else {scope: date for scope, date in scopes[1].items() if scope & mask}
+    for bit in range(grant.bit_length()):
+        scope = 1 << bit
+        if grant & scope:
+            if expires is None:
+                expiries.pop(scope, None)
+            else:
+                expiries[scope] = expires
+    return (mask | grant, expiries)
+
+
+def _revoke_scopes(scopes: Optional[Scopes], revoke: int) -> Optional[Scopes]:
+    """
+    Returns the scopes of a user after a revocation, dropping the scopes that expired, or None if none are left.
+    """
+    mask = _active_scopes(scopes, time()) & ~revoke
+    if not mask:
+        return None
+    return (mask, {scope: date for scope, date in scopes[1].items() if scope & mask})
+
+
+def _scope_grants(scopes: Scopes) -> List[Tuple[int, Optional[int]]]:
+    """
+    Returns the grants (bitmask and expiration timestamp, None for the scopes that don't expire) that give a user
+    these scopes, one per expiration.
+    """
+    mask, expiries = scopes
+    grants: Dict[Optional[int], int] = {}
+    for scope, expires in expiries.items():
+        grants[expires] = grants.get(expires, 0) | scope
+    permanent = mask & ~sum(grants.values())
+    if permanent:
+        grants[None] = permanent
+    return [(grant, expires) for expires, grant in grants.items()]
+
+
+def _range(start: Optional[int], end: Optional[int]) -> Tuple[int, int]:
+    """
+    Replaces the open ends of a range of expiration timestamps with the bounds of the timestamps.
+    """
+    return (MIN_EXPIRES if start is None else start, MAX_EXPIRES if end is None else end)
+
+
+def _next_cursor(page: List[Tuple[int, int]], limit: int) -> Optional[Cursor]:
+    """
+    Returns the cursor that follows a page, or None if the page is the last one.
     
+    :param page: The users of the page, ordered by expiration timestamp and user ID.
+    :param limit: The page size that was requested.
+    """
+    if len(page) < limit:
+        return None
+    user_id, expires = page[-1]
+    return (expires, user_id)
+
+
+class StoreWrapper(IStore):
+    """
+    Base class for stores that wrap another store. Every call is delegated to the wrapped store,
+    so subclasses only need to override the methods they want to intercept.
+    """
+
+    def __init__(self, store: IStore):
+        """
+        Initializes a new instance of the StoreWrapper class.
+
+        :param store: The store to wrap.
+        """
+        self.store = store
+
+    @property
+    def filename(self) -> str:
+        return self.store.filename
+
+    @property
+    def authorized_admin_ids(self) -> Set[int]:
+        return self.store.authorized_admin_ids
+
     def close(self):
-        with open(f"{self.filename}.json", "w") as f:
-            json.dump(self.store, f)
-    
+        self.store.close()
+
+    def flush(self):
+        self.store.flush()
+
+    def is_admin(self, user_id: int) -> bool:
+        return self.store.is_admin(user_id)
+
+    def authorize_admin(self, user_id):
+        self.store.authorize_admin(user_id)
+
+    def revoke_admin(self, user_id):
+        self.store.revoke_admin(user_id)
+
     def is_authenticated(self, user_id: int) -> bool:
-        if self.is_admin(user_id):
-            return True
+        return self.store.is_authenticated(user_id)
 
-        return user_id in self.store and self.store[user_id]["expires"] > datetime.now()
-    
     def authorize_user(self, user_id: int, days: int, hours: int):
-        expires = datetime.now() + timedelta(days=days, hours=hours)  
-        self.update_user(user_id, expires)
-    
+        self.store.authorize_user(user_id, days, hours)
+
     def revoke_access(self, user_id: int):
-        if user_id in self.store.keys():
-            del self.store[user_id]
-            self.close()
+        self.store.revoke_access(user_id)
 
-    def get_authorized_user(self, user_id: int) -> Tuple[int, datetime]:
-        if user_id in self.store:
-            return (user_id, self.store[user_id]['expires'])
-        return None
+    def get_authorized_user(self, user_id: int) -> Tuple[int, int]:
+        return self.store.get_authorized_user(user_id)
 
-    def get_authorized_users(self) -> List[Tuple[int, datetime]]:
-        return [(user_id, datetime.fromisoformat(self.store[user_id]["expires"])) for user_id in self.store]
+    def get_authorized_users(self) -> List[Tuple[int, int]]:
+        return self.store.get_authorized_users()
 
-    def insert_user(self, user_id: int, expires: datetime):
-        self.store[user_id] = {"expires": expires.isoformat()}
-        self.close()
-    
-    def update_user(self, user_id: int, expires: datetime):
-        self.insert_user(user_id, expires)
-        
+    def insert_user(self, user_id: int, expires: int):
+        self.store.insert_user(user_id, expires)
+
+    def update_user(self, user_id: int, expires: int):
+        self.store.update_user(user_id, expires)
+
+    def is_authenticated_many(self, user_ids: Iterable[int]) -> Dict[int, bool]:
+        return self.store.is_authenticated_many(user_ids)
+
+    def authorize_users_many(self, user_ids: Iterable[int], days: int, hours: int):
+        self.store.authorize_users_many(user_ids, days, hours)
+
+    def revoke_many(self, user_ids: Iterable[int]):
+        self.store.revoke_many(user_ids)
+
+    def upsert_users_many(self, users: Iterable[Tuple[int, int]]):
+        self.store.upsert_users_many(users)
+
+    def get_authorized_users_page(self, after_cursor: Optional[Cursor]=None, limit: int=100) -> Tuple[List[Tuple[int, int]], Optional[Cursor]]:
+        return self.store.get_authorized_users_page(after_cursor, limit)
+
+    def iter_authorized_users(self, batch_size: int=1000) -> Iterator[Tuple[int, int]]:
+        return self.store.iter_authorized_users(batch_size)
+
+    def next_expiry(self) -> Optional[int]:
+        return self.store.next_expiry()
 
+    def purge_expired(self, before: int, limit: int) -> List[int]:
+        return self.store.purge_expired(before, limit)
+
+    def iter_expiring_between(self, start: Optional[int]=None, end: Optional[int]=None,
+                              batch_size: int=1000) -> Iterator[Tuple[int, int]]:
+        return self.store.iter_expiring_between(start, end, batch_size)
+
+    def count_expiring_between(self, start: Optional[int]=None, end: Optional[int]=None) -> int:
+        return self.store.count_expiring_between(start, end)
+
+    def get_scopes(self, user_id: int) -> Optional[Scopes]:
+        return self.store.get_scopes(user_id)
+
+    def iter_scopes(self) -> Iterator[Tuple[int, Scopes]]:
+        return self.store.iter_scopes()
+
+    def upsert_scopes_many(self, scopes: Iterable[Tuple[int, Scopes]]):
+        self.store.upsert_scopes_many(scopes)
+
+    def grant_scopes(self, user_id: int, scopes: int, expires: Optional[int]):
+        self.store.grant_scopes(user_id, scopes, expires)
+
+    def revoke_scopes(self, user_id: int, scopes: int):
+        self.store.revoke_scopes(user_id, scopes)
+
+    def changes_since(self, seq: Optional[int]) -> Optional[Tuple[int, Optional[List[int]]]]:
+        return self.store.changes_since(seq)
+
+
+class LazyStore(StoreWrapper):
+    """
+    Defers opening a store (connecting to the database, loading the file...) until it is first used,
+    so constructing `Auth` costs nothing until the first update comes in.
+    """
+
+    def __init__(self, open_store: Callable[[], IStore]):
+        """
+        Initializes a new instance of the LazyStore class.
+
+        :param open_store: A function that opens the store, called once on first use.
+        """
+        self._open_store = open_store
+        self._store = None
+        self._stats = None
+        self._lock = threading.Lock()
+
+    @property
+    def store(self) -> IStore:
+        store = self._store
+        if store is None:
+            with self._lock:
+                if self._store is None:
+                    store = self._open_store()
+                    store.stats = self._stats
+                    self._store = store
+                store = self._store
+        return store
+
+    @property
+    def opened(self) -> bool:
+        """
+        Whether the store was opened already.
+        """
+        return self._store is not None
+
+    @property
+    def stats(self):
+        return self._stats
+
+    @stats.setter
+    def stats(self, stats):
+        # Passed on to the store, which counts commits and scanned rows on it
+        self._stats = stats
+        if self._store is not None:
+            self._store.stats = stats
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
 
-# add support for each StoreType
-STORE_CLASSES[StoreType.SQLITE] = SQLiteStore
-STORE_CLASSES[StoreType.JSON] = JSONStore
\ No newline at end of file
+    def flush(self):
+        if self._store is not None:
+            self._store.flush()
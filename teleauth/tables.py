@@ -0,0 +1,335 @@
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime
+from time import time
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+from teleauth.store import IStore, StoreWrapper
+
+# Maximum number of rendered tables kept, one per combination of field names, date format and chunk size
+MAX_TABLES = 16
+
+
+def _user_row(user_id: int, expires_str: str, expired: bool) -> list:
+    if expired:
+        # Highlight expired users
+        return [f"{user_id}", f"{expires_str} ⚠️"]
+    return [user_id, expires_str]
+
+
+def _users_rows(users: Iterable[Tuple[int, int]], datetime_format: str) -> Iterator[list]:
+    """
+    Formats the authorized users as table rows, highlighting expired users with a warning symbol.
+
+    :param users: Tuples containing the user IDs and expiration timestamps, as returned by the store.
+    :param datetime_format: The format for the expiration date.
+    :return: An iterator of rows.
+    """
+    now = time()
+    for user_id, expires in users:
+        yield _user_row(user_id, datetime.fromtimestamp(expires).strftime(datetime_format), expires < now)
+
+
+def _render_table(rows: Iterable[list], field_names: List[str]) -> str:
+    """
+    Renders rows as a prettytable string.
+
+    :param rows: The rows of the table.
+    :param field_names: The field names to be displayed in the table.
+    :return: The table as a string
+    """
+    # Imported here, so bots that never render a table don't pay for it at startup
+    from prettytable import PrettyTable
+
+    table = PrettyTable(border=False, padding_width=0, preserve_internal_border=True)
+    table.field_names = field_names
+
+    for row in rows:
+        table.add_row(row)
+
+    return str(table)
+
+
+def _users_table(users: Iterable[Tuple[int, int]], field_names: List[str], datetime_format: str) -> str:
+    """
+    Renders the authorized users as a prettytable string, highlighting expired users with a warning symbol.
+
+    :param users: Tuples containing the user IDs and expiration timestamps, as returned by the store.
+    :param field_names: The field names to be displayed in the table.
+    :param datetime_format: The format for the expiration date.
+    :return: The table as a string
+    """
+    return _render_table(_users_rows(users, datetime_format), field_names)
+
+
+def _users_tables(rows: Iterable[list], field_names: List[str], max_length: int) -> Iterator[str]:
+    """
+    Renders table rows as a sequence of prettytable strings, each one at most `max_length` characters long.
+
+    :param rows: The rows of the tables, as returned by `_users_rows`.
+    :param field_names: The field names to be displayed in the tables.
+    :param max_length: The maximum length of each table.
+    :return: An iterator of tables, with at least one (possibly empty) table.
+    """
+    header_widths = [len(name) for name in field_names]
+    chunk, widths = [], header_widths
+    for row in rows:
+        row_widths = [max(width, len(str(cell))) for width, cell in zip(widths, row)]
+        # Every line is padded to the table width (plus a trailing space and the newline), so the size of the table
+        # is known without rendering it. len() is never smaller than the display width PrettyTable pads to.
+        lines = len(chunk) + 3
+        if chunk and lines * (sum(row_widths) + len(row_widths) + 1) > max_length:
+            yield _render_table(chunk, field_names)
+            chunk = []
+            row_widths = [max(width, len(str(cell))) for width, cell in zip(header_widths, row)]
+        chunk.append(row)
+        widths = row_widths
+
+    yield _render_table(chunk, field_names)
+
+
+def _admins_table(admins: Iterable[int], field_names: List[str]) -> str:
+    """
+    Renders the authorized admins as a prettytable string.
+
+    :param admins: The user IDs of the admins.
+    :param field_names: The field names to be displayed in the table.
+    :return: The table as a string
+    """
+    return _render_table(([user_id] for user_id in sorted(admins)), field_names)
+
+
+class TableCache(StoreWrapper):
+    """
+    Keeps the rendered users and admins tables, so asking for them again costs a dictionary lookup instead of
+    a full scan of the store, a `strftime` per user and a new PrettyTable layout.
+
+    Every user is kept in memory, sorted by expiration date, with their formatted expiration dates. Writes made
+    through this wrapper only mark the changed users and bump a version; the next render fetches those users again
+    and moves their rows, then lays the table out once and caches it for that version. Expired users are always
+    the first rows, so as time passes a cached table only goes stale when the next user expires.
+
+    Writes made by other processes are picked up on each render when the store tracks changes
+    (see `IStore.changes_since`).
+    """
+
+    def __init__(self, store: IStore):
+        """
+        Initializes a new instance of the TableCache class.
+
+        :param store: The store to wrap.
+        """
+        super().__init__(store)
+        # Lookups don't affect the tables: skip the wrapper on the hot path
+        self.is_authenticated = store.is_authenticated
+        self.get_authorized_user = store.get_authorized_user
+        self.is_authenticated_many = store.is_authenticated_many
+        self.hits = 0
+        self.renders = 0
+        # user_id -> expiration timestamp and (expires, user_id) in order, None until the first render
+        self._users: Optional[Dict[int, int]] = None
+        self._sorted: List[Tuple[int, int]] = []
+        # datetime_format -> {user_id: formatted expiration date}
+        self._cells: Dict[str, Dict[int, str]] = {}
+        # key -> (version, time until which the table is valid, rendered table)
+        self._tables = {}
+        self._admin_tables: Dict[tuple, Tuple[FrozenSet[int], str]] = {}
+        # Users written since the last render, or a full reload when too many of them changed
+        self._dirty: Set[int] = set()
+        self._reload = True
+        self._version = 0
+        self._change_seq = None
+        # `_lock` guards the version and the dirty users, `_refresh_lock` the rows, which only renders update
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def info(self) -> dict:
+        """
+        Returns the number of tables answered from the cache, the number of tables laid out and the number of users
+        kept in memory.
+        """
+        return {"hits": self.hits, "renders": self.renders, "users": len(self._users or ())}
+
+    def _changed(self, user_ids: Iterable[int]):
+        with self._lock:
+            self._version += 1
+            if self._reload:
+                return
+            self._dirty.update(user_ids)
+            if len(self._dirty) > 256 and len(self._dirty) * 4 > len(self._users or ()):
+                # Reading every user again is cheaper than looking them up one by one
+                self._reload = True
+                self._dirty.clear()
+
+    def _refresh(self) -> int:
+        """
+        Brings the rows up to date with the store. Must be called with `_refresh_lock` held.
+
+        :return: The version the rows are at. Writes made while refreshing bump it past that.
+        """
+        if not self._reload and self._change_seq is not None:
+            seq, user_ids = self.store.changes_since(self._change_seq)
+            with self._lock:
+                self._change_seq = seq
+                if user_ids is None:
+                    # Too far behind to know which users changed
+                    self._reload = True
+                elif user_ids:
+                    self._version += 1
+                    self._dirty.update(user_ids)
+        with self._lock:
+            reload, self._reload = self._reload, False
+            dirty, self._dirty = self._dirty, set()
+            version = self._version
+
+        if reload:
+            changes = self.store.changes_since(None)
+            self._change_seq = None if changes is None else changes[0]
+            self._users = dict(self.store.get_authorized_users())
+            self._sorted = sorted((expires, user_id) for user_id, expires in self._users.items())
+            self._cells.clear()
+            return version
+
+        for user_id in dirty:
+            user = self.store.get_authorized_user(user_id)
+            expires = None if user is None else user[1]
+            previous = self._users.get(user_id)
+            if previous == expires:
+                continue
+            if previous is not None:
+                del self._sorted[bisect_left(self._sorted, (previous, user_id))]
+                del self._users[user_id]
+            if expires is not None:
+                insort(self._sorted, (expires, user_id))
+                self._users[user_id] = expires
+            for cells in self._cells.values():
+                cells.pop(user_id, None)
+        return version
+
+    def _rows(self, datetime_format: str, now: float) -> Tuple[List[list], float]:
+        """
+        Formats the rows of the users table. Must be called with `_refresh_lock` held.
+
+        :return: The rows, and the time until which they are valid (when the first unexpired user expires).
+        """
+        cells = self._cells.get(datetime_format)
+        if cells is None:
+            cells = self._cells[datetime_format] = {}
+        expired = bisect_left(self._sorted, (now,))
+        rows = []
+        for i, (expires, user_id) in enumerate(self._sorted):
+            expires_str = cells.get(user_id)
+            if expires_str is None:
+                expires_str = cells[user_id] = datetime.fromtimestamp(expires).strftime(datetime_format)
+            rows.append(_user_row(user_id, expires_str, i < expired))
+        return rows, self._sorted[expired][0] if expired < len(self._sorted) else float("inf")
+
+    def _render(self, key: tuple, datetime_format: str, render: Callable[[List[list]], object]):
+        now = time()
+        with self._refresh_lock:
+            version = self._refresh()
+            table = self._tables.get(key)
+            if table is not None and table[0] == version and now <= table[1]:
+                self.hits += 1
+                return table[2]
+            rows, valid_until = self._rows(datetime_format, now)
+
+        rendered = render(rows)
+        with self._lock:
+            self.renders += 1
+            self._tables.pop(key, None)
+            self._tables[key] = (version, valid_until, rendered)
+            if len(self._tables) > MAX_TABLES:
+                del self._tables[next(iter(self._tables))]
+        return rendered
+
+    def users_table(self, field_names: List[str], datetime_format: str) -> str:
+        """
+        Returns the users table, as `_users_table` would render it from every user of the store.
+
+        :param field_names: The field names to be displayed in the table.
+        :param datetime_format: The format for the expiration date.
+        :return: The table as a string
+        """
+        return self._render(("table", tuple(field_names), datetime_format), datetime_format,
+                            lambda rows: _render_table(rows, field_names))
+
+    def users_tables(self, field_names: List[str], datetime_format: str, max_length: int) -> List[str]:
+        """
+        Returns the users table split in chunks of at most `max_length` characters, as `_users_tables` would.
+
+        :param field_names: The field names to be displayed in the tables.
+        :param datetime_format: The format for the expiration date.
+        :param max_length: The maximum length of each table.
+        :return: The tables as strings
+        """
+        return self._render(("tables", tuple(field_names), datetime_format, max_length), datetime_format,
+                            lambda rows: list(_users_tables(rows, field_names, max_length)))
+
+    def admins_table(self, field_names: List[str]) -> str:
+        """
+        Returns the admins table, rendered again only when the admins change.
+
+        :param field_names: The field names to be displayed in the table.
+        :return: The table as a string
+        """
+        admins = frozenset(self.authorized_admin_ids)
+        key = tuple(field_names)
+        table = self._admin_tables.get(key)
+        if table is not None and table[0] == admins:
+            self.hits += 1
+            return table[1]
+        rendered = _admins_table(admins, field_names)
+        self.renders += 1
+        self._admin_tables[key] = (admins, rendered)
+        return rendered
+
+    def authorize_user(self, user_id: int, days: int, hours: int):
+        try:
+            self.store.authorize_user(user_id, days, hours)
+        finally:
+            self._changed((user_id,))
+
+    def revoke_access(self, user_id: int):
+        try:
+            self.store.revoke_access(user_id)
+        finally:
+            self._changed((user_id,))
+
+    def insert_user(self, user_id: int, expires: int):
+        try:
+            self.store.insert_user(user_id, expires)
+        finally:
+            self._changed((user_id,))
+
+    def update_user(self, user_id: int, expires: int):
+        try:
+            self.store.update_user(user_id, expires)
+        finally:
+            self._changed((user_id,))
+
+    def authorize_users_many(self, user_ids: Iterable[int], days: int, hours: int):
+        user_ids = list(user_ids)
+        try:
+            self.store.authorize_users_many(user_ids, days, hours)
+        finally:
+            self._changed(user_ids)
+
+    def revoke_many(self, user_ids: Iterable[int]):
+        user_ids = list(user_ids)
+        try:
+            self.store.revoke_many(user_ids)
+        finally:
+            self._changed(user_ids)
+
+    def upsert_users_many(self, users: Iterable[Tuple[int, int]]):
+        users = list(users)
+        try:
+            self.store.upsert_users_many(users)
+        finally:
+            self._changed(user_id for user_id, _ in users)
+
+    def purge_expired(self, before: int, limit: int) -> List[int]:
+        user_ids = self.store.purge_expired(before, limit)
+        if user_ids:
+            self._changed(user_ids)
+        return user_ids
@@ -0,0 +1,69 @@
+import pytest
+
+from teleauth import Auth
+from teleauth.admission import AdmissionController
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("teleauth.admission.monotonic", lambda: clock[0])
+    return clock
+
+
+def test_bucket_refills(clock):
+    admission = AdmissionController(rate=2, burst=3)
+    assert [admission.admit(1) for _ in range(4)] == [True, True, True, False]
+    # Other users have their own bucket
+    assert admission.admit(2)
+
+    clock[0] += 0.5
+    assert admission.admit(1)
+    assert not admission.admit(1)
+    # Refilled up to the burst, not beyond
+    clock[0] += 60
+    assert [admission.admit(1) for _ in range(4)] == [True, True, True, False]
+    assert admission.info() == {"admitted": 8, "rejected": 3, "shed_ratio": 3 / 11, "users": 2}
+
+
+def test_evicted_users_start_with_a_full_bucket(clock):
+    admission = AdmissionController(rate=1, burst=1, max_users=2)
+    assert admission.admit(1)
+    assert not admission.admit(1)
+    assert admission.admit(2)
+    assert admission.admit(3)
+    assert admission.info()["users"] == 2
+    assert admission.admit(1)
+
+
+def test_invalid_parameters():
+    with pytest.raises(ValueError):
+        AdmissionController(rate=0)
+    with pytest.raises(ValueError):
+        AdmissionController(rate=1, burst=0.5)
+
+
+def test_rejected_before_the_store(tmp_path, clock):
+    auth = Auth(1, [2], admission_rate=1, admission_burst=2, store_options={"filename": str(tmp_path / "teleauth")})
+    lookups = []
+    store_get = auth.store.get_authorized_user
+    store_is_authenticated = auth.store.is_authenticated
+    auth.store.get_authorized_user = lambda user_id: lookups.append(user_id) or store_get(user_id)
+    auth.store.is_authenticated = lambda user_id: lookups.append(user_id) or store_is_authenticated(user_id)
+    try:
+        auth.authorize_user(5, 1, 0)
+        assert auth.is_authenticated(5)
+        assert auth.get_status(5).authenticated
+        assert not auth.is_authenticated(5)
+        status = auth.get_status(5)
+        assert status.throttled and not status.authenticated
+        assert lookups == [5, 5]
+
+        # The owner and admins are never throttled
+        for _ in range(5):
+            assert auth.is_authenticated(2)
+            assert auth.get_status(1).owner
+            assert not auth.get_status(1).throttled
+        assert auth.admission.info()["rejected"] == 2
+    finally:
+        auth.close()
@@ -0,0 +1,102 @@
+import asyncio
+from types import SimpleNamespace
+
+import teleauth
+from teleauth import Auth, CachedStore
+from teleauth.sqlite_store import SQLiteStore
+
+
+def _update(user_id=None):
+    return SimpleNamespace(effective_user=None if user_id is None else SimpleNamespace(id=user_id),
+                           effective_message=None)
+
+
+def test_require_ignores_updates_without_user(tmp_path):
+    auth = Auth(1, [], store_options={"filename": str(tmp_path / "teleauth")})
+    calls = []
+
+    @auth.require()
+    def handler(update, context):
+        calls.append(update.effective_user.id)
+
+    @auth.require()
+    async def async_handler(update, context):
+        calls.append(update.effective_user.id)
+
+    try:
+        context = SimpleNamespace()
+        assert handler(_update(), context) is None
+        assert asyncio.run(async_handler(_update(), context)) is None
+        assert calls == []
+
+        handler(_update(1), context)
+        asyncio.run(async_handler(_update(1), context))
+        assert calls == [1, 1]
+        assert context.auth_status.owner
+    finally:
+        auth.close()
+
+
+
+def test_store_classes_exported_by_the_package():
+    # teleauth 1.x exported them with `from .store import *`
+    from teleauth import JSONStore, SQLiteStore
+    from teleauth.json_store import JSONStore as json_store
+    from teleauth.sqlite_store import SQLiteStore as sqlite_store
+
+    assert SQLiteStore is sqlite_store
+    assert JSONStore is json_store
+    assert teleauth.JSONStore is json_store
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    store = SQLiteStore([], str(tmp_path / "teleauth"))
+    cache = CachedStore(store, maxsize=2)
+    try:
+        store.upsert_users_many([(1, 4102444800), (2, 4102444800), (3, 4102444800)])
+        assert cache.is_authenticated(1) and cache.is_authenticated(2)
+        # 1 becomes the most recently used, so 2 is evicted by 3
+        assert cache.is_authenticated(1)
+        assert cache.is_authenticated(3)
+        assert cache.cache_info() == (1, 3, 2, 2)
+        assert cache.peek_authenticated(1) is True
+        assert cache.peek_authenticated(2) is None
+        assert cache.peek_authenticated(3) is True
+    finally:
+        cache.close()
+
+
+def test_cache_expires_entries_without_the_store(tmp_path, monkeypatch):
+    now = 1700000000
+    monkeypatch.setattr("teleauth.cache.time", lambda: now)
+    store = SQLiteStore([], str(tmp_path / "teleauth"))
+    cache = CachedStore(store)
+    try:
+        store.insert_user(1, now + 60)
+        assert cache.is_authenticated(1)
+        # Removed behind the cache's back: only the cached expiration is looked at
+        store.revoke_access(1)
+        assert cache.is_authenticated(1)
+        now += 60
+        assert not cache.is_authenticated(1)
+        assert cache.cache_info().misses == 1
+    finally:
+        cache.close()
+
+
+def test_cache_invalidated_by_auth_writes(tmp_path):
+    auth = Auth(1, [], cache_size=16, store_options={"filename": str(tmp_path / "teleauth")})
+    try:
+        assert not auth.is_authenticated(5)
+        auth.authorize_user(5, 1, 0)
+        assert auth.is_authenticated(5)
+        auth.revoke_access(5)
+        assert not auth.is_authenticated(5)
+        auth.authorize_users_many([5, 6], 0, 1)
+        assert auth.is_authenticated(5) and auth.is_authenticated(6)
+        auth.revoke_many([5, 6])
+        assert not auth.is_authenticated(5) and not auth.is_authenticated(6)
+        # Revoking caches the users as unknown
+        assert auth.cache_info().hits >= 2
+    finally:
+        auth.close()
@@ -0,0 +1,21 @@
+import time
+
+from teleauth.bloom import BloomFilterStore
+from teleauth.sqlite_store import SQLiteStore
+
+
+def test_learns_users_written_by_other_processes(tmp_path):
+    filename = str(tmp_path / "teleauth")
+    store = BloomFilterStore(SQLiteStore([], filename, change_log_size=100), 1000, coherence_interval=0.01)
+    other = SQLiteStore([], filename, change_log_size=100)
+    try:
+        store.insert_user(1, 4102444800)
+        assert not store.is_authenticated(2)
+
+        other.insert_user(2, 4102444800)
+        time.sleep(0.02)
+        assert store.is_authenticated(2)
+        assert store.is_authenticated(1)
+    finally:
+        other.close()
+        store.close()
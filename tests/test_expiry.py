@@ -0,0 +1,62 @@
+import threading
+from time import time
+
+from teleauth import Auth
+from teleauth.expiry import ExpiryScheduler
+from teleauth.sqlite_store import SQLiteStore
+
+
+def test_sweep(tmp_path):
+    now = int(time())
+    store = SQLiteStore([], str(tmp_path / "teleauth"))
+    scheduler = ExpiryScheduler(store, batch_size=2)
+    expired = []
+    scheduler.add_callback(expired.append)
+    try:
+        store.upsert_users_many([(1, now - 10), (2, now - 5), (3, now), (4, now + 3600)])
+        assert scheduler.sweep(now) == [1, 2, 3]
+        assert expired == [1, 2, 3]
+        assert store.get_authorized_users() == [(4, now + 3600)]
+        # Nothing left to purge, the callback doesn't fire again
+        assert scheduler.sweep(now) == []
+        assert expired == [1, 2, 3]
+    finally:
+        store.close()
+
+
+def test_failing_callback_does_not_stop_the_sweep(tmp_path):
+    store = SQLiteStore([], str(tmp_path / "teleauth"))
+    scheduler = ExpiryScheduler(store)
+    expired = []
+
+    def fail(user_id):
+        raise RuntimeError(user_id)
+
+    scheduler.add_callback(fail)
+    scheduler.add_callback(expired.append)
+    try:
+        store.upsert_users_many([(1, 100), (2, 200)])
+        assert scheduler.sweep(300) == [1, 2]
+        assert expired == [1, 2]
+    finally:
+        store.close()
+
+
+def test_on_expire(tmp_path):
+    auth = Auth(1, [], store_options={"filename": str(tmp_path / "teleauth")})
+    expired = []
+    fired = threading.Event()
+
+    def on_expire(user_id):
+        expired.append(user_id)
+        fired.set()
+
+    try:
+        auth.store.insert_user(5, int(time()) - 1)
+        auth.on_expire(on_expire)
+        assert fired.wait(5)
+        auth.expiry_scheduler.stop()
+        assert expired == [5]
+        assert auth.store.get_authorized_user(5) is None
+    finally:
+        auth.close()
@@ -0,0 +1,80 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+from teleauth.json_store import JSONStore, JournaledJSONStore
+
+
+def test_opens_v1_file(tmp_path):
+    filename = str(tmp_path / "teleauth")
+    future = (datetime.now() + timedelta(days=1)).replace(microsecond=0)
+    past = (datetime.now() - timedelta(days=1)).replace(microsecond=0)
+    # teleauth 1.x only wrote the users, keyed by user ID
+    with open(f"{filename}.json", "w") as f:
+        json.dump({"1": {"expires": future.isoformat()}, "2": {"expires": past.isoformat()}}, f)
+
+    store = JSONStore([], filename)
+    assert store.get_authorized_user(1) == (1, int(future.timestamp()))
+    assert store.is_authenticated(1)
+    assert not store.is_authenticated(2)
+    store.authorize_admin(3)
+    store.close()
+
+    # Written back in the current format
+    with open(f"{filename}.json") as f:
+        data = json.load(f)
+    assert set(data["users"]) == {"1", "2"}
+    assert data["admins"] == [3]
+    assert JSONStore([], filename).is_admin(3)
+
+
+def _compact(store: JournaledJSONStore):
+    compactor = store._compactor
+    if compactor is not None:
+        compactor.join()
+
+
+def test_journal_reopen_after_compaction(tmp_path):
+    filename = str(tmp_path / "teleauth")
+    store = JournaledJSONStore([], filename, compact_threshold=512)
+    store.upsert_users_many((user_id, 4102444800 + user_id) for user_id in range(50))
+    _compact(store)
+    assert not os.path.exists(f"{store.journal_filename}.compacting")
+    with open(f"{filename}.json") as f:
+        assert len(json.load(f)["users"]) == 50
+    # Written to the new journal, after the snapshot
+    store.revoke_access(0)
+    store.insert_user(100, 4102444900)
+    store.authorize_admin(7)
+    store.grant_scopes(1, 0b11, None)
+
+    # Reopened without closing, as after a crash
+    reopened = JournaledJSONStore([], filename, compact_threshold=512)
+    try:
+        assert reopened.get_authorized_user(0) is None
+        assert reopened.get_authorized_user(49) == (49, 4102444849)
+        assert reopened.get_authorized_user(100) == (100, 4102444900)
+        assert len(reopened.get_authorized_users()) == 50
+        assert reopened.is_admin(7)
+        assert reopened.get_scopes(1) == (0b11, {})
+    finally:
+        reopened.close()
+    store._journal.close()
+
+
+def test_journal_reopen_after_interrupted_compaction(tmp_path):
+    filename = str(tmp_path / "teleauth")
+    store = JournaledJSONStore([], filename)
+    store.insert_user(1, 4102444800)
+    # The journal was rotated but the snapshot never written
+    with store._lock:
+        store._rotate()
+    store.insert_user(2, 4102444800)
+    store._journal.close()
+
+    reopened = JournaledJSONStore([], filename)
+    try:
+        assert sorted(reopened.get_authorized_users()) == [(1, 4102444800), (2, 4102444800)]
+        assert not os.path.exists(f"{reopened.journal_filename}.compacting")
+    finally:
+        reopened.close()
@@ -0,0 +1,82 @@
+import pytest
+
+from teleauth.json_store import JSONStore
+from teleauth.migration import copy_store, export_users, import_users
+from teleauth.mmap_store import MMAPStore
+from teleauth.sqlite_store import SQLiteStore
+
+USERS = [(1, 4102444800), (2, 4102444900), (3, 4102445000)]
+SCOPES = {1: (0b111, {0b10: 4102444800}), 4: (0b1, {})}
+
+
+@pytest.fixture
+def source(tmp_path):
+    store = JSONStore([9], str(tmp_path / "source"))
+    store.upsert_users_many(USERS)
+    store.authorize_admin(8)
+    store.grant_scopes(1, 0b101, None)
+    store.grant_scopes(1, 0b10, 4102444800)
+    store.grant_scopes(4, 0b1, None)
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize("target_class", [SQLiteStore, JSONStore, MMAPStore])
+def test_copy_store(tmp_path, source, target_class):
+    target = target_class([], str(tmp_path / "target"))
+    try:
+        # Replaced, not merged
+        target.grant_scopes(1, 0b1000, None)
+        result = copy_store(source, target, batch_size=2)
+        assert (result.users, result.scopes) == (3, 2)
+        assert sorted(target.get_authorized_users()) == USERS
+        assert dict(target.iter_scopes()) == SCOPES
+        assert target.is_admin(8)
+    finally:
+        target.close()
+
+
+@pytest.mark.parametrize("format", ["ndjson", "csv"])
+def test_export_import(tmp_path, source, format):
+    path = str(tmp_path / f"users.{format}")
+    result = export_users(source, path, batch_size=2)
+    assert (result.users, result.scopes) == (3, 2)
+
+    target = SQLiteStore([], str(tmp_path / "target"))
+    try:
+        target.grant_scopes(1, 0b1000, None)
+        result = import_users(target, path, batch_size=2)
+        assert (result.users, result.scopes) == (3, 2)
+        assert sorted(target.get_authorized_users()) == USERS
+        assert dict(target.iter_scopes()) == SCOPES
+    finally:
+        target.close()
+
+
+def test_export_resumes_without_duplicating_scopes(tmp_path, source):
+    path = str(tmp_path / "users.ndjson")
+    checkpoint = str(tmp_path / "checkpoint.json")
+
+    def interrupt(progress):
+        if progress.scopes:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        export_users(source, path, batch_size=1, checkpoint=checkpoint, progress=interrupt)
+    export_users(source, path, batch_size=1, checkpoint=checkpoint)
+    with open(path) as f:
+        assert sum('"scopes"' in line for line in f) == 2
+
+
+def test_import_v1_csv(tmp_path):
+    path = str(tmp_path / "users.csv")
+    with open(path, "w") as f:
+        f.write("user_id,expires\n1,4102444800\n2,2100-01-01T00:00:00\n")
+    target = SQLiteStore([], str(tmp_path / "target"))
+    try:
+        assert import_users(target, path).users == 2
+        assert target.get_authorized_user(1) == (1, 4102444800)
+        assert target.is_authenticated(2)
+        assert list(target.iter_scopes()) == []
+    finally:
+        target.close()
@@ -0,0 +1,85 @@
+import os
+
+from teleauth.mmap_store import HEADER, RECORD, MMAPStore
+
+
+def test_reopen(tmp_path):
+    filename = str(tmp_path / "teleauth")
+    store = MMAPStore([], filename)
+    store.upsert_users_many([(3, 4102444803), (1, 4102444801), (2, 4102444802)])
+    store.authorize_admin(9)
+    store.grant_scopes(1, 0b11, 4102444800)
+    store.close()
+
+    store = MMAPStore([], filename)
+    try:
+        assert store.get_authorized_users() == [(1, 4102444801), (2, 4102444802), (3, 4102444803)]
+        assert store.is_admin(9)
+        assert store.get_scopes(1) == (0b11, {0b1: 4102444800, 0b10: 4102444800})
+    finally:
+        store.close()
+
+
+def test_reopen_from_log(tmp_path):
+    filename = str(tmp_path / "teleauth")
+    store = MMAPStore([], filename)
+    store.upsert_users_many([(1, 4102444801), (2, 4102444802)])
+    store.revoke_access(1)
+    # Reopened without merging, as after a crash, with a partially written last record
+    with open(store.log_filename, "ab") as f:
+        f.write(RECORD.pack(3, 4102444803)[:5])
+
+    reopened = MMAPStore([], filename)
+    try:
+        assert reopened.get_authorized_users() == [(2, 4102444802)]
+        assert os.path.getsize(reopened.log_filename) == 3 * RECORD.size
+    finally:
+        reopened.close()
+    store._log.close()
+
+
+def test_merge(tmp_path):
+    filename = str(tmp_path / "teleauth")
+    store = MMAPStore([], filename, merge_threshold=4)
+    try:
+        store.upsert_users_many([(user_id, 4102444800 + user_id) for user_id in range(3)])
+        assert os.path.getsize(store.log_filename) == 3 * RECORD.size
+        assert os.path.getsize(store.data_filename) == HEADER.size
+
+        # The fourth buffered user triggers the merge into the array, and the log is emptied
+        store.revoke_access(0)
+        store.insert_user(5, 4102444805)
+        assert os.path.getsize(store.log_filename) == 0
+        assert os.path.getsize(store.data_filename) == HEADER.size + 3 * RECORD.size
+        assert store.get_authorized_users() == [(1, 4102444801), (2, 4102444802), (5, 4102444805)]
+
+        # Later writes are buffered in front of the merged array
+        store.update_user(1, 4102444900)
+        assert store.get_authorized_user(1) == (1, 4102444900)
+        assert store.count_expiring_between(4102444900, None) == 1
+    finally:
+        store.close()
+
+
+def test_revoke_then_reinsert(tmp_path):
+    filename = str(tmp_path / "teleauth")
+    store = MMAPStore([], filename)
+    store.insert_user(1, 4102444801)
+    store.merge()
+    # Revoked in the buffer, still in the array
+    store.revoke_access(1)
+    assert not store.is_authenticated(1)
+    assert store.get_authorized_user(1) is None
+    store.insert_user(1, 4102444900)
+    assert store.get_authorized_user(1) == (1, 4102444900)
+    store.revoke_access(1)
+    store.merge()
+    assert store.get_authorized_user(1) is None
+    store.insert_user(1, 4102445000)
+    store.close()
+
+    store = MMAPStore([], filename)
+    try:
+        assert store.get_authorized_users() == [(1, 4102445000)]
+    finally:
+        store.close()
@@ -0,0 +1,22 @@
+from teleauth.sharded_store import ShardedSQLiteStore
+
+
+def test_is_authenticated_many_with_admins(tmp_path):
+    store = ShardedSQLiteStore([2], str(tmp_path / "teleauth"), shards=4)
+    try:
+        store.insert_user(1, 4102444800)
+        store.insert_user(3, 1)
+        # Persisted in the first shard only, whatever the shard of the user
+        store.authorize_admin(5)
+        user_ids = [1, 2, 3, 4, 5]
+        assert store.is_authenticated_many(user_ids) == {1: True, 2: True, 3: False, 4: False, 5: True}
+        assert store.is_authenticated_many(user_ids) == {user_id: store.is_authenticated(user_id)
+                                                         for user_id in user_ids}
+    finally:
+        store.close()
+
+    store = ShardedSQLiteStore([], str(tmp_path / "teleauth"), shards=4)
+    try:
+        assert store.is_authenticated_many([2, 5]) == {2: False, 5: True}
+    finally:
+        store.close()
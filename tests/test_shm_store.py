@@ -0,0 +1,125 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+from teleauth.shm_store import SEQUENCE, SEQUENCE_OFFSET, SharedMemoryStore
+from teleauth.store import StoreType
+
+
+@pytest.fixture
+def name():
+    name = f"teleauth-test-{uuid.uuid4().hex[:12]}"
+    yield name
+    try:
+        segment = SharedMemoryStore([], name=name, owner=False)
+    except FileNotFoundError:
+        return
+    segment.unlink()
+    segment.close()
+
+
+def _owner(tmp_path, name, **options) -> SharedMemoryStore:
+    return SharedMemoryStore([1], str(tmp_path / "teleauth"), name=name, backend=StoreType.JSON, **options)
+
+
+def test_reader_after_owner_restart(tmp_path, name):
+    owner = _owner(tmp_path, name, capacity=100)
+    owner.insert_user(10, 4102444800)
+    owner.grant_scopes(10, 0b1, None)
+    reader = SharedMemoryStore([], name=name, owner=False, read_timeout=0.5)
+    try:
+        assert reader.is_authenticated(10)
+        owner.close()
+
+        # Still readable while no owner is running
+        assert reader.is_authenticated(10)
+
+        owner = _owner(tmp_path, name, capacity=100)
+        owner.insert_user(11, 4102444800)
+        owner.revoke_access(10)
+        assert reader.is_authenticated_many([10, 11]) == {10: False, 11: True}
+        assert reader.is_admin(1)
+        assert reader.get_scopes(10) == (0b1, {})
+        with pytest.raises(PermissionError):
+            reader.insert_user(12, 4102444800)
+    finally:
+        reader.close()
+        owner.close()
+
+
+def test_reader_after_owner_died_mid_write(tmp_path, name):
+    owner = _owner(tmp_path, name)
+    owner.insert_user(10, 4102444800)
+    reader = SharedMemoryStore([], name=name, owner=False, read_timeout=0.1)
+    try:
+        # The owner died with the segment locked
+        sequence = SEQUENCE.unpack_from(owner._buf, SEQUENCE_OFFSET)[0]
+        SEQUENCE.pack_into(owner._buf, SEQUENCE_OFFSET, sequence + 1)
+        owner.close()
+        with pytest.raises(TimeoutError):
+            reader.is_authenticated(10)
+
+        owner = _owner(tmp_path, name)
+        assert reader.is_authenticated(10)
+        owner.insert_user(11, 4102444800)
+        assert reader.is_authenticated(11)
+    finally:
+        reader.close()
+        owner.close()
+
+
+def test_capacity(tmp_path, name):
+    owner = _owner(tmp_path, name, capacity=2)
+    reader = SharedMemoryStore([], name=name, owner=False)
+    try:
+        owner.upsert_users_many([(10, 4102444800), (11, 4102444800)])
+        with pytest.raises(ValueError):
+            owner.insert_user(12, 4102444800)
+        with pytest.raises(ValueError):
+            owner.upsert_users_many([(11, 4102444900), (13, 4102444800)])
+        # Nothing was written, neither to the segment nor to the backing store
+        assert not reader.is_authenticated(12)
+        assert reader.get_authorized_user(11) == (11, 4102444800)
+        assert owner.backend.get_authorized_user(12) is None
+        assert owner.backend.get_authorized_user(11) == (11, 4102444800)
+
+        # Existing users can still be updated, and revoking one makes room
+        owner.update_user(11, 4102444900)
+        assert reader.get_authorized_user(11) == (11, 4102444900)
+        owner.revoke_access(10)
+        owner.insert_user(12, 4102444800)
+        assert reader.is_authenticated(12)
+    finally:
+        reader.close()
+        owner.close()
+
+
+def test_slow_backend_write_does_not_stall_readers(tmp_path, name):
+    owner = _owner(tmp_path, name)
+    owner.insert_user(10, 4102444800)
+    reader = SharedMemoryStore([], name=name, owner=False, read_timeout=0.2)
+    backend_write = owner.backend.upsert_users_many
+    writing = threading.Event()
+
+    def slow_write(users):
+        writing.set()
+        time.sleep(0.5)
+        backend_write(users)
+
+    owner.backend.upsert_users_many = slow_write
+    writer = threading.Thread(target=owner.upsert_users_many, args=([(11, 4102444800)],))
+    try:
+        writer.start()
+        assert writing.wait(1)
+        start = time.monotonic()
+        assert reader.is_authenticated(10)
+        assert not reader.is_authenticated(11)
+        assert time.monotonic() - start < 0.1
+        writer.join()
+        assert reader.is_authenticated(11)
+    finally:
+        writer.join()
+        reader.close()
+        owner.close()
@@ -0,0 +1,121 @@
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from teleauth.sqlite_store import SQLiteStore, migrate
+
+
+def _write_v1(filename: str, users):
+    # The schema and date format written by teleauth 1.x
+    conn = sqlite3.connect(f"{filename}.db")
+    conn.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, expires TIMESTAMP)")
+    conn.executemany("INSERT INTO users (user_id, expires) VALUES (?, ?)",
+                     ((user_id, str(expires)) for user_id, expires in users))
+    conn.commit()
+    conn.close()
+
+
+def test_opens_v1_database(tmp_path):
+    filename = str(tmp_path / "teleauth")
+    future = datetime.now() + timedelta(days=1)
+    past = datetime.now() - timedelta(days=1)
+    _write_v1(filename, [(1, future), (2, past)])
+
+    store = SQLiteStore([], filename)
+    try:
+        assert store.get_authorized_user(1) == (1, int(future.timestamp()))
+        assert store.is_authenticated(1)
+        assert not store.is_authenticated(2)
+        assert sorted(store.get_authorized_users()) == [(1, int(future.timestamp())), (2, int(past.timestamp()))]
+    finally:
+        store.close()
+
+
+def test_migrate_in_batches(tmp_path):
+    filename = str(tmp_path / "teleauth")
+    expires = datetime.now() + timedelta(hours=1)
+    _write_v1(filename, [(user_id, expires) for user_id in range(25)])
+
+    progress = []
+    assert migrate(filename, batch_size=10, progress=progress.append) == 25
+    assert progress == [10, 20, 25]
+    # Already up to date
+    assert migrate(filename) == 0
+
+    store = SQLiteStore([], filename)
+    try:
+        assert len(store.get_authorized_users()) == 25
+    finally:
+        store.close()
+
+
+def test_group_commit_reads_own_writes(tmp_path):
+    filename = str(tmp_path / "teleauth")
+    # Long enough that nothing is committed by the background thread during the test
+    store = SQLiteStore([], filename, group_commit_interval=60000, group_commit_size=1000)
+    other = SQLiteStore([], filename)
+    try:
+        store.authorize_user(1, 1, 0)
+        store.insert_user(2, 4102444800)
+        assert store.is_authenticated(1)
+        assert store.get_authorized_user(2) == (2, 4102444800)
+        assert store.is_authenticated_many([1, 2, 3]) == {1: True, 2: True, 3: False}
+        # Still queued
+        assert other.get_authorized_user(2) is None
+
+        store.revoke_access(1)
+        assert not store.is_authenticated(1)
+        assert store.get_authorized_user(1) is None
+
+        # Listings flush the queue first
+        assert store.get_authorized_users() == [(2, 4102444800)]
+        assert other.get_authorized_user(2) == (2, 4102444800)
+        assert other.get_authorized_user(1) is None
+    finally:
+        other.close()
+        store.close()
+
+
+def test_group_commit_flushes_on_close(tmp_path):
+    filename = str(tmp_path / "teleauth")
+    store = SQLiteStore([], filename, group_commit_interval=60000)
+    store.insert_user(1, 4102444800)
+    store.close()
+
+    store = SQLiteStore([], filename)
+    try:
+        assert store.get_authorized_user(1) == (1, 4102444800)
+    finally:
+        store.close()
+
+
+def test_threads(tmp_path):
+    store = SQLiteStore([], str(tmp_path / "teleauth"))
+    errors = []
+
+    def work(first: int):
+        try:
+            user_ids = range(first, first + 50)
+            for user_id in user_ids:
+                store.insert_user(user_id, 4102444800 + user_id)
+            for user_id in user_ids:
+                assert store.get_authorized_user(user_id) == (user_id, 4102444800 + user_id)
+            store.revoke_many(user_ids[::2])
+            assert store.is_authenticated_many(user_ids) == {user_id: user_id % 2 == 1 for user_id in user_ids}
+        except Exception as e:
+            errors.append(e)
+
+    try:
+        # Two rounds of short-lived threads
+        for round in range(2):
+            threads = [threading.Thread(target=work, args=(round * 1000 + thread * 100,)) for thread in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        assert errors == []
+        assert len(store.get_authorized_users()) == 2 * 8 * 25
+        # The connections of the threads were closed when they ended, only the main thread's is left
+        assert len(store._connections) == 1
+    finally:
+        store.close()
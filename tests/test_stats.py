@@ -0,0 +1,77 @@
+import pytest
+
+from teleauth import Auth
+from teleauth.stats import BUCKET_BOUNDS, Histogram, Stats
+
+
+def test_buckets():
+    histogram = Histogram()
+    # Bucket upper bounds are inclusive
+    for seconds in [0.0, 1e-6, 1.5e-6, 2e-6, 1e-3, 100.0]:
+        histogram.record(seconds)
+    assert histogram.buckets[0] == 2
+    assert histogram.buckets[1] == 2
+    assert histogram.buckets[BUCKET_BOUNDS.index(2 ** 10 / 1_000_000)] == 1
+    # Slower than the last bound
+    assert histogram.buckets[-1] == 1
+    assert sum(histogram.buckets) == histogram.count == 6
+    assert histogram.max == 100.0
+    assert histogram.total == pytest.approx(100.0010045)
+
+
+def test_percentiles():
+    histogram = Histogram()
+    assert histogram.percentile(50) == 0.0
+    for _ in range(90):
+        histogram.record(3e-6)
+    for _ in range(10):
+        histogram.record(1e-3)
+    # The upper bound of the bucket the rank falls in, but never more than the slowest latency recorded
+    assert histogram.percentile(50) == 4e-6
+    assert histogram.percentile(90) == 4e-6
+    assert histogram.percentile(91) == 1e-3
+    assert histogram.percentile(100) == 1e-3
+
+    histogram.record(100.0)
+    assert histogram.percentile(100) == 100.0
+    snapshot = histogram.snapshot()
+    assert (snapshot["count"], snapshot["p50"], snapshot["p99"]) == (101, 4e-6, 2 ** 10 / 1_000_000)
+
+
+def test_exporter(monkeypatch):
+    exported = []
+    stats = Stats(exported.append, export_interval=60)
+    stats.record("op", 1e-6)
+    assert exported == []
+    monkeypatch.setattr("teleauth.stats.time", lambda: stats._next_export)
+    stats.incr("commits")
+    stats.record("op", 1e-6)
+    assert len(exported) == 1
+    assert exported[0]["operations"]["op"]["count"] == 2
+    assert exported[0]["counters"] == {"commits": 1}
+
+
+def test_auth_stats(tmp_path):
+    auth = Auth(1, [], stats=True, cache_size=16, store_options={"filename": str(tmp_path / "teleauth")})
+    try:
+        auth.authorize_user(5, 1, 0)
+        for _ in range(3):
+            auth.is_authenticated(5)
+        operations = auth.stats()["operations"]
+        assert operations["auth.is_authenticated"]["count"] == 3
+        assert operations["auth.authorize_user"]["count"] == 1
+        assert operations["store.authorize_user"]["count"] == 1
+        # The first lookup reached the store, the next ones were answered by the cache
+        assert operations["store.get_authorized_user"]["count"] == 1
+        assert auth.stats()["cache"]["hits"] == 2
+        assert auth.stats()["counters"]["commits"] >= 1
+    finally:
+        auth.close()
+
+
+def test_stats_disabled(tmp_path):
+    auth = Auth(1, [], store_options={"filename": str(tmp_path / "teleauth")})
+    try:
+        assert auth.stats() is None
+    finally:
+        auth.close()
@@ -0,0 +1,52 @@
+import uuid
+from time import time
+
+import pytest
+
+from teleauth.store import STORE_CLASSES, StoreType
+
+
+@pytest.fixture(params=list(StoreType), ids=lambda store_type: store_type.name)
+def store(request, tmp_path):
+    options = {}
+    if request.param == StoreType.SHARED_MEMORY:
+        options = {"name": f"teleauth-test-{uuid.uuid4().hex[:12]}", "capacity": 1000}
+    store = STORE_CLASSES[request.param]([], str(tmp_path / "teleauth"), **options)
+    yield store
+    store.close()
+    if request.param == StoreType.SHARED_MEMORY:
+        store.unlink()
+
+
+def _scan(store, start, end):
+    return sorted(((user_id, expires) for user_id, expires in store.get_authorized_users()
+                   if (start is None or start <= expires) and (end is None or expires < end)),
+                  key=lambda user: (user[1], user[0]))
+
+
+def test_expiring_between(store):
+    store.upsert_users_many([(1, 100), (2, 200), (3, 200), (4, 300), (5, 400)])
+    # Also exercises the stores' indexes after later writes
+    store.update_user(5, 250)
+    store.revoke_access(4)
+
+    assert list(store.iter_expiring_between(200, 250)) == [(2, 200), (3, 200)]
+    assert list(store.iter_expiring_between(100, 200)) == [(1, 100)]
+    assert list(store.iter_expiring_between(201, None)) == [(5, 250)]
+    assert store.count_expiring_between(200, 250) == 2
+    assert store.count_expiring_between(250, 251) == 1
+    assert store.count_expiring_between(300, 400) == 0
+    for start, end in [(None, None), (None, 200), (200, None), (150, 260), (0, 100), (401, 500)]:
+        users = _scan(store, start, end)
+        assert list(store.iter_expiring_between(start, end, batch_size=2)) == users
+        assert store.count_expiring_between(start, end) == len(users)
+
+
+def test_count_active_and_expired(store):
+    now = int(time())
+    store.upsert_users_many([(1, now - 3600), (2, now - 60), (3, now + 60), (4, now + 3600), (5, now + 7200)])
+    store.revoke_access(5)
+
+    assert store.count_active() == len(_scan(store, now + 1, None)) == 2
+    assert store.count_expired() == len(_scan(store, None, now + 1)) == 2
+    assert store.count_expired(now - 600) == len(_scan(store, now - 600, now + 1)) == 1
@@ -0,0 +1,52 @@
+from time import time
+
+from teleauth import Auth
+from teleauth.tables import _users_table
+
+FIELDS = ["USER ID", "EXPIRES"]
+FORMAT = "%d/%m/%Y %H:%M"
+
+
+def test_users_table_cached_until_it_changes(tmp_path, monkeypatch):
+    now = [time()]
+    monkeypatch.setattr("teleauth.tables.time", lambda: now[0])
+    auth = Auth(1, [], table_cache=True, store_options={"filename": str(tmp_path / "teleauth")})
+    store = auth.table_cache.store
+    try:
+        auth.authorize_user(5, 1, 0)
+        table = auth.get_authorized_users_table()
+        assert auth.get_authorized_users_table() is table
+        assert auth.table_cache.info() == {"hits": 1, "renders": 1, "users": 1}
+
+        auth.authorize_user(6, 0, 1)
+        table = auth.get_authorized_users_table()
+        assert auth.table_cache.info()["renders"] == 2
+        assert table == _users_table(store.get_authorized_users(), FIELDS, FORMAT)
+
+        auth.revoke_access(5)
+        table = auth.get_authorized_users_table()
+        assert auth.table_cache.info()["renders"] == 3
+        assert table == _users_table([(6, store.get_authorized_user(6)[1])], FIELDS, FORMAT)
+        assert auth.get_authorized_users_table() is table
+
+        # The table goes stale when user 6 expires, without any write
+        now[0] += 2 * 3600
+        table = auth.get_authorized_users_table()
+        assert auth.table_cache.info()["renders"] == 4
+        assert "⚠️" in table
+        assert table == _users_table(store.get_authorized_users(), FIELDS, FORMAT)
+        assert auth.get_authorized_users_table() is table
+    finally:
+        auth.close()
+
+
+def test_admins_table_cached_until_the_admins_change(tmp_path):
+    auth = Auth(1, [2], table_cache=True, store_options={"filename": str(tmp_path / "teleauth")})
+    try:
+        table = auth.get_authorized_admins_table()
+        assert auth.get_authorized_admins_table() is table
+        auth.authorize_admin(3)
+        assert auth.get_authorized_admins_table() != table
+        assert auth.table_cache.info()["renders"] == 2
+    finally:
+        auth.close()